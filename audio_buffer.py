@@ -0,0 +1,37 @@
+import os
+import tempfile
+from contextlib import contextmanager
+
+# In-memory audio uploads for the transcription API. The OpenAI SDK accepts a
+# (filename, bytes) tuple, so chunks can go straight from the socket to the
+# multipart body without a temp-file round-trip. The filename only tells
+# Whisper which container format to expect.
+
+# Uploads larger than this are spooled to disk instead; 0 disables the
+# disk fallback entirely (the default)
+AUDIO_DISK_FALLBACK_BYTES = int(os.getenv("AUDIO_DISK_FALLBACK_BYTES", "0"))
+
+def _as_bytes(audio_data):
+    # bytes pass through untouched; only views/bytearrays need materialising
+    if isinstance(audio_data, bytes):
+        return audio_data
+    return bytes(audio_data)
+
+@contextmanager
+def audio_upload(audio_data, filename="audio.webm"):
+    """Yield a value suitable for the `file=` argument of transcriptions.create"""
+    filename = os.path.basename(filename or "audio.webm")
+    if AUDIO_DISK_FALLBACK_BYTES and len(audio_data) > AUDIO_DISK_FALLBACK_BYTES:
+        suffix = os.path.splitext(filename)[1] or ".webm"
+        temp_file_path = None
+        try:
+            with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as temp_file:
+                temp_file_path = temp_file.name
+                temp_file.write(audio_data)
+            with open(temp_file_path, "rb") as audio_file:
+                yield (filename, audio_file)
+        finally:
+            if temp_file_path and os.path.exists(temp_file_path):
+                os.remove(temp_file_path)
+    else:
+        yield (filename, _as_bytes(audio_data))
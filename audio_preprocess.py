@@ -0,0 +1,157 @@
+import os
+import sys
+import threading
+from array import array
+from audio_utils import build_wav, ffmpeg_available, ffmpeg_to_wav, parse_wav, sniff_format
+import logs
+
+log = logs.get_logger("audio_preprocess")
+
+# Optional preprocessing in front of Whisper. Audio we can decode (PCM WAV
+# natively, anything else when AUDIO_PREPROCESS_FFMPEG is on and a local
+# ffmpeg is available) is downmixed to mono, resampled to 16 kHz and run
+# through a cheap energy-based voice activity detector: chunks without speech
+# are dropped before any upstream call, and leading/trailing silence is
+# trimmed off the rest. Audio we can't decode is passed through untouched.
+#
+# ffmpeg decoding is opt-in: for streamed webm/ogg chunks a subprocess, temp
+# files and a VAD pass per chunk cost more than trimming saves.
+
+AUDIO_PREPROCESS = os.getenv("AUDIO_PREPROCESS", "1") == "1"
+AUDIO_PREPROCESS_FFMPEG = os.getenv("AUDIO_PREPROCESS_FFMPEG", "0") == "1"
+# Larger inputs are passed through; decoding long recordings to PCM costs more than it saves
+AUDIO_PREPROCESS_MAX_BYTES = int(os.getenv("AUDIO_PREPROCESS_MAX_BYTES", str(10 * 1024 * 1024)))
+
+TARGET_RATE = 16000
+VAD_FRAME_MS = int(os.getenv("VAD_FRAME_MS", "30"))
+VAD_THRESHOLD_DBFS = float(os.getenv("VAD_THRESHOLD_DBFS", "-45"))
+VAD_MIN_SPEECH_MS = int(os.getenv("VAD_MIN_SPEECH_MS", "120"))
+VAD_PADDING_MS = int(os.getenv("VAD_PADDING_MS", "250"))
+
+_stats_lock = threading.Lock()
+_stats = {
+    "chunks": 0,            # chunks seen by the preprocessor
+    "decoded": 0,           # chunks we could decode and analyse
+    "passthrough": 0,       # disabled, undecodable or too large: sent as-is
+    "silent_dropped": 0,    # no speech found, upstream call avoided
+    "trimmed": 0,           # speech found and silence trimmed off
+    "bytes_in": 0,
+    "bytes_out": 0,
+}
+
+def _count(**increments):
+    with _stats_lock:
+        for key, value in increments.items():
+            _stats[key] += value
+
+def get_stats():
+    """Snapshot of the counters, plus bytes saved and upstream calls avoided"""
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["bytes_saved"] = stats["bytes_in"] - stats["bytes_out"]
+    stats["calls_avoided"] = stats["silent_dropped"]
+    return stats
+
+def reset_stats():
+    with _stats_lock:
+        for key in _stats:
+            _stats[key] = 0
+
+def can_decode(audio_data):
+    """Whether preprocess() would do real work on this input (cheap, header only)"""
+    if not AUDIO_PREPROCESS or len(audio_data) > AUDIO_PREPROCESS_MAX_BYTES:
+        return False
+    return sniff_format(audio_data) == "wav" or (AUDIO_PREPROCESS_FFMPEG and ffmpeg_available())
+
+def _to_mono(samples, channels):
+    if channels == 1:
+        return samples
+    if channels == 2:
+        return array("h", ((left + right) >> 1 for left, right in zip(samples[0::2], samples[1::2])))
+    return array("h", (sum(frame) // channels for frame in zip(*(samples[c::channels] for c in range(channels)))))
+
+def _resample(samples, rate):
+    if rate == TARGET_RATE or not samples:
+        return samples
+    if rate % TARGET_RATE == 0:
+        # Integer ratio (32/48 kHz): average each group, a cheap low-pass
+        factor = rate // TARGET_RATE
+        return array("h", (sum(group) // factor for group in zip(*(samples[k::factor] for k in range(factor)))))
+    # Anything else: linear interpolation
+    step = rate / TARGET_RATE
+    last = len(samples) - 1
+    out = array("h")
+    for i in range(int(len(samples) / step)):
+        position = i * step
+        index = int(position)
+        frac = position - index
+        nxt = samples[index + 1] if index < last else samples[index]
+        out.append(int(samples[index] + (nxt - samples[index]) * frac))
+    return out
+
+def decode(audio_data):
+    """Return 16 kHz mono 16-bit samples as an array("h"), or None if we can't decode"""
+    wav = parse_wav(audio_data)
+    if wav is None or wav[0][0] != 1 or wav[0][3] != 16:
+        # Compressed (or non 16-bit PCM): let ffmpeg do the whole conversion
+        if not (AUDIO_PREPROCESS_FFMPEG and ffmpeg_available()):
+            return None
+        converted = ffmpeg_to_wav([audio_data], TARGET_RATE, 1)
+        wav = parse_wav(converted) if converted else None
+        if wav is None:
+            return None
+    (_, channels, sample_rate, _), pcm = wav
+    samples = array("h")
+    samples.frombytes(pcm[:len(pcm) - len(pcm) % 2])
+    if sys.byteorder == "big":
+        samples.byteswap()
+    return _resample(_to_mono(samples, channels), sample_rate)
+
+def detect_speech(samples, rate=TARGET_RATE):
+    """
+    Energy-based VAD. Returns the (start, end) sample range to keep, padded
+    by VAD_PADDING_MS, or None when there is too little speech.
+    """
+    frame = max(1, rate * VAD_FRAME_MS // 1000)
+    # Compare mean squares directly instead of taking a sqrt per frame
+    threshold = (32768 * 10 ** (VAD_THRESHOLD_DBFS / 20)) ** 2
+    voiced = []
+    for start in range(0, len(samples), frame):
+        window = samples[start:start + frame]
+        if sum(s * s for s in window) / len(window) >= threshold:
+            voiced.append(start)
+    if len(voiced) * VAD_FRAME_MS < VAD_MIN_SPEECH_MS:
+        return None
+    padding = rate * VAD_PADDING_MS // 1000
+    return max(0, voiced[0] - padding), min(len(samples), voiced[-1] + frame + padding)
+
+def preprocess(audio_data, filename="audio.webm"):
+    """
+    Return (data, filename) to upload, or None if the chunk holds no speech
+    and shouldn't be sent at all.
+    """
+    _count(chunks=1, bytes_in=len(audio_data))
+    samples = decode(audio_data) if can_decode(audio_data) else None
+    if samples is None:
+        _count(passthrough=1, bytes_out=len(audio_data))
+        return audio_data, filename
+    _count(decoded=1)
+
+    region = detect_speech(samples)
+    if region is None:
+        log.info("No speech detected, dropping chunk", bytes=len(audio_data))
+        _count(silent_dropped=1)
+        return None
+
+    start, end = region
+    trimmed = samples[start:end]
+    if sys.byteorder == "big":
+        trimmed.byteswap()
+    wav = build_wav(trimmed.tobytes(), 1, TARGET_RATE)
+    # Decoded PCM is often bigger than the compressed original; only switch
+    # to it when it actually shrinks the upload
+    if len(wav) >= len(audio_data):
+        _count(bytes_out=len(audio_data))
+        return audio_data, filename
+    _count(trimmed=1, bytes_out=len(wav))
+    return wav, "audio.wav"
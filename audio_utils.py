@@ -0,0 +1,141 @@
+import os
+import shutil
+import struct
+import subprocess
+import tempfile
+import logs
+
+log = logs.get_logger("audio_utils")
+
+# Container sniffing, WAV parsing/building and an optional ffmpeg helper,
+# shared by the chunk coalescer and the audio preprocessing stage.
+
+FFMPEG_PATH = os.getenv("FFMPEG_PATH") or shutil.which("ffmpeg")
+FFMPEG_TIMEOUT = float(os.getenv("FFMPEG_TIMEOUT", "10"))
+
+# Used to estimate durations of compressed chunks (Opus in WebM from browsers
+# is typically 24-64 kbit/s)
+ASSUMED_BITRATE = int(os.getenv("AUDIO_ASSUMED_BITRATE", "32000"))
+
+_MAGIC = [
+    (b"\x1a\x45\xdf\xa3", "webm"),
+    (b"OggS", "ogg"),
+    (b"fLaC", "flac"),
+    (b"ID3", "mp3"),
+]
+
+def sniff_format(data):
+    """Return "wav", "webm", "ogg", "flac", "mp3" or None for headerless data"""
+    head = bytes(data[:12])
+    if head[:4] == b"RIFF" and head[8:12] == b"WAVE":
+        return "wav"
+    for magic, name in _MAGIC:
+        if head.startswith(magic):
+            return name
+    if len(head) >= 2 and head[0] == 0xFF and head[1] & 0xE0 == 0xE0:
+        return "mp3"
+    return None
+
+def parse_wav(data):
+    """
+    Return (format, pcm) for PCM WAV data, where format is
+    (audio_format, channels, sample_rate, bits_per_sample), or None.
+    """
+    data = memoryview(data)
+    if len(data) < 12 or bytes(data[:4]) != b"RIFF" or bytes(data[8:12]) != b"WAVE":
+        return None
+    fmt = None
+    pos = 12
+    while pos + 8 <= len(data):
+        chunk_id = bytes(data[pos:pos + 4])
+        size = struct.unpack_from("<I", data, pos + 4)[0]
+        body = pos + 8
+        if chunk_id == b"fmt " and size >= 16:
+            audio_format, channels, sample_rate, _, _, bits = struct.unpack_from("<HHIIHH", data, body)
+            fmt = (audio_format, channels, sample_rate, bits)
+        elif chunk_id == b"data" and fmt is not None:
+            # Streaming writers sometimes leave the size as 0 or 0xFFFFFFFF
+            end = len(data) if size in (0, 0xFFFFFFFF) else min(len(data), body + size)
+            return fmt, bytes(data[body:end])
+        pos = body + size + (size & 1)
+    return None
+
+def build_wav(pcm, channels, sample_rate, bits=16, audio_format=1):
+    block_align = channels * bits // 8
+    header = struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF", 36 + len(pcm), b"WAVE",
+        b"fmt ", 16, audio_format, channels, sample_rate, sample_rate * block_align, block_align, bits,
+        b"data", len(pcm),
+    )
+    return header + pcm
+
+def estimate_seconds(data, bitrate=None):
+    """Exact duration for PCM WAV, a bitrate-based estimate for anything else"""
+    wav = parse_wav(data)
+    if wav is not None:
+        (_, channels, sample_rate, bits), pcm = wav
+        bytes_per_second = channels * sample_rate * bits // 8
+        if bytes_per_second:
+            return len(pcm) / bytes_per_second
+    return len(data) * 8 / (bitrate or ASSUMED_BITRATE)
+
+def ffmpeg_available():
+    return bool(FFMPEG_PATH)
+
+def ffmpeg_to_wav(inputs, sample_rate=16000, channels=1):
+    """
+    Decode (and concatenate) one or more encoded inputs into 16-bit PCM WAV
+    with ffmpeg. Returns the WAV bytes, or None if ffmpeg is unavailable or fails.
+    """
+    if not FFMPEG_PATH or not inputs:
+        return None
+    with tempfile.TemporaryDirectory() as directory:
+        args = [FFMPEG_PATH, "-hide_banner", "-loglevel", "error", "-nostdin"]
+        for index, data in enumerate(inputs):
+            path = os.path.join(directory, f"in{index}")
+            with open(path, "wb") as f:
+                f.write(data)
+            args += ["-i", path]
+        if len(inputs) > 1:
+            streams = "".join(f"[{i}:a]" for i in range(len(inputs)))
+            args += ["-filter_complex", f"{streams}concat=n={len(inputs)}:v=0:a=1"]
+        args += ["-ac", str(channels), "-ar", str(sample_rate), "-acodec", "pcm_s16le", "-f", "wav", "pipe:1"]
+        try:
+            result = subprocess.run(args, capture_output=True, timeout=FFMPEG_TIMEOUT)
+        except (OSError, subprocess.TimeoutExpired) as e:
+            log.warning("ffmpeg failed", error=e)
+            return None
+    if result.returncode != 0 or not result.stdout:
+        log.warning("ffmpeg failed", stderr=result.stderr.decode('utf-8', 'ignore'))
+        return None
+    return result.stdout
+
+def merge_chunks(chunks):
+    """
+    Merge adjacent chunks of one session into as few uploads as possible.
+    Returns a list of (bytes, filename) pairs; a single pair when the chunks
+    could be merged, the original chunks when they couldn't.
+    """
+    if len(chunks) == 1:
+        return [(chunks[0], "audio.webm" if sniff_format(chunks[0]) != "wav" else "audio.wav")]
+
+    formats = [sniff_format(chunk) for chunk in chunks]
+
+    # PCM WAV with identical parameters: concatenate the samples
+    if all(f == "wav" for f in formats):
+        parsed = [parse_wav(chunk) for chunk in chunks]
+        if all(parsed) and len({p[0] for p in parsed}) == 1:
+            (audio_format, channels, sample_rate, bits), _ = parsed[0]
+            pcm = b"".join(p[1] for p in parsed)
+            return [(build_wav(pcm, channels, sample_rate, bits, audio_format), "audio.wav")]
+
+    # MediaRecorder timeslices: one header followed by headerless continuations
+    if formats[0] is not None and all(f is None for f in formats[1:]):
+        return [(b"".join(chunks), f"audio.{formats[0]}")]
+
+    # Several self-contained files: only ffmpeg can join them
+    merged = ffmpeg_to_wav(chunks)
+    if merged is not None:
+        return [(merged, "audio.wav")]
+    return [(chunk, "audio.wav" if f == "wav" else "audio.webm") for chunk, f in zip(chunks, formats)]
@@ -0,0 +1,92 @@
+import asyncio
+import os
+import openai_client
+
+# Several recordings in one multipart request (POST /transcribe/batch/). Up to
+# BATCH_CONCURRENCY files are transcribed at once; transcripts that finish
+# within BATCH_PACK_WINDOW seconds of each other go to extraction together so
+# they can share a packed request. Each file's result is yielded as soon as
+# its extraction is done, so clients see results in completion order.
+
+BATCH_MAX_FILES = int(os.getenv("BATCH_MAX_FILES", "20"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+# Whole request; each file is still held to UPLOAD_MAX_BYTES
+BATCH_UPLOAD_MAX_BYTES = int(os.getenv("BATCH_UPLOAD_MAX_BYTES", str(100 * 1024 * 1024)))
+BATCH_PACK_WINDOW = float(os.getenv("BATCH_PACK_WINDOW", "0.2"))
+
+def _error(index, filename, error):
+    result = {"index": index, "file": filename}
+    if isinstance(error, openai_client.UpstreamBusy):
+        result.update({"error": "Server busy, file not processed", "busy": True})
+    else:
+        result["error"] = f"Error processing audio: {str(error)}"
+    return result
+
+async def run_batch(files, transcribe_one, extract_group, pack_max):
+    """
+    Async generator of one result dict per file, in completion order.
+    transcribe_one(file) returns the transcript ("" for no speech);
+    extract_group(transcripts) returns one item list per transcript and is
+    given at most pack_max transcripts at a time.
+    """
+    results = asyncio.Queue()
+    ready = asyncio.Queue()
+    slots = asyncio.Semaphore(BATCH_CONCURRENCY)
+    loop = asyncio.get_running_loop()
+    extractions = []
+
+    async def transcribe(index, file):
+        async with slots:
+            try:
+                transcript = await transcribe_one(file)
+            except Exception as e:
+                results.put_nowait(_error(index, file.filename, e))
+                return
+        if transcript.strip():
+            ready.put_nowait((index, file.filename, transcript))
+        else:
+            results.put_nowait({"index": index, "file": file.filename, "items": []})
+
+    async def extract(group):
+        try:
+            item_lists = await extract_group([transcript for _, _, transcript in group])
+        except Exception as e:
+            for index, filename, _ in group:
+                results.put_nowait(_error(index, filename, e))
+            return
+        for (index, filename, _), items in zip(group, item_lists):
+            results.put_nowait({"index": index, "file": filename, "items": items})
+
+    async def transcribe_all():
+        await asyncio.gather(*(transcribe(index, file) for index, file in enumerate(files)))
+        ready.put_nowait(None)
+
+    async def pack():
+        finished = False
+        while not finished:
+            entry = await ready.get()
+            if entry is None:
+                break
+            group = [entry]
+            deadline = loop.time() + BATCH_PACK_WINDOW
+            while len(group) < pack_max:
+                try:
+                    entry = await asyncio.wait_for(ready.get(), max(0.0, deadline - loop.time()))
+                except asyncio.TimeoutError:
+                    break
+                if entry is None:
+                    finished = True
+                    break
+                group.append(entry)
+            extractions.append(loop.create_task(extract(group)))
+        await asyncio.gather(*extractions)
+
+    tasks = [loop.create_task(transcribe_all()), loop.create_task(pack())]
+    try:
+        for _ in files:
+            yield await results.get()
+    finally:
+        # The client may have gone away mid-batch
+        for task in tasks + extractions:
+            task.cancel()
+        await asyncio.gather(*tasks, *extractions, return_exceptions=True)
@@ -0,0 +1,200 @@
+"""
+Accuracy and time-to-item of streaming sessions, with and without the
+rolling transcript context (transcript_context.py), across chunk lengths.
+
+Every transcript in prompt_corpus.json is cut into chunks of --chunk-seconds
+of speech (at --words-per-second; 0 keeps the whole transcript as one
+chunk, the upload baseline). Each chunk goes through extraction exactly as
+a WebSocket session sends it: on its own, or with the tail of the chunks
+before it as context. The items of all chunks are scored together against
+the hand-labelled items, so an item split at a boundary, or repeated from
+the context, counts against recall or precision.
+
+Time-to-item is modelled rather than measured: a chunk is sent when its
+speech ends, transcribed in --transcription-latency seconds, and extracted
+in --chat-latency seconds per chat call actually made (rule-matched chunks
+make none). first_item_s is from the start of speech to the first item,
+after_speech_s from the end of speech to the last item.
+
+Chunk text stands in for Whisper's output, so the Whisper prompt's effect
+on spelling is not part of the result. Chat answers are replayed from
+recordings like prompt_eval.py:
+
+    OPENAI_API_KEY=... python benchmarks/context_eval.py --record
+    python benchmarks/context_eval.py --chunk-seconds 1 2 4 0 --output context.json
+
+Responses are keyed on the exact request, so changing the chunking, the
+context length or a prompt needs a new --record run.
+"""
+import argparse
+import json
+import math
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(HERE)
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, HERE)
+
+# Every chunk must reach the (recorded) upstream, not an earlier answer
+os.environ["EXTRACTION_CACHE_BACKEND"] = "none"
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+import extraction
+import prompts
+import transcript_context
+from prompt_eval import DEFAULT_CORPUS, MissingRecording, RecordedClient, RecordingClient, score
+
+DEFAULT_RECORDINGS = os.path.join(HERE, "context_recordings.json")
+
+MODES = ["isolated", "context"]
+
+class CountingClient:
+    """Counts the chat calls made through another client"""
+    def __init__(self, client):
+        self.client = client
+        self.calls = 0
+        self.chat = self
+
+    @property
+    def completions(self):
+        return self
+
+    def create(self, **args):
+        self.calls += 1
+        return self.client.chat.completions.create(**args)
+
+def split_words(transcript, chunk_words):
+    words = transcript.split()
+    if not chunk_words:
+        return [" ".join(words)]
+    return [" ".join(words[i:i + chunk_words]) for i in range(0, len(words), chunk_words)]
+
+def run_session(client, transcript, chunk_words, mode, args):
+    """Items and modelled delivery times for one transcript sent in chunks"""
+    system_prompt, user_prompt = prompts.get_prompts()
+    tail = ""
+    spoken = 0.0
+    items = []
+    times = []
+    for chunk in split_words(transcript, chunk_words):
+        spoken += len(chunk.split()) / args.words_per_second
+        context = tail if mode == "context" else None
+        calls = client.calls
+        found = extraction.extract_items(client, chunk, system_prompt, user_prompt, temperature=args.temperature,
+                                         context=context or None)
+        tail = transcript_context.append(tail, chunk, args.context_chars)
+        done = spoken + args.transcription_latency + (client.calls - calls) * args.chat_latency
+        items += found
+        times += [done] * len(found)
+    return items, times, spoken
+
+def evaluate(client, corpus, chunk_seconds, mode, args):
+    chunk_words = max(1, math.ceil(chunk_seconds * args.words_per_second)) if chunk_seconds else 0
+    totals = {"expected": 0, "predicted": 0, "matched": 0, "exact": 0, "tamil_name": 0, "weight": 0,
+              "quantity": 0, "transcript_exact": 0}
+    first_item = []
+    after_speech = []
+    missing = []
+    failures = []
+    calls = client.calls
+    for case in corpus:
+        try:
+            predicted, times, spoken = run_session(client, case["transcript"], chunk_words, mode, args)
+        except MissingRecording:
+            missing.append(case["transcript"])
+            continue
+        counts = score(case["items"], predicted)
+        for key, value in counts.items():
+            totals[key] += value
+        if times:
+            first_item.append(min(times))
+            after_speech.append(max(times) - spoken)
+        if not counts["transcript_exact"]:
+            failures.append({"transcript": case["transcript"], "predicted": predicted})
+
+    answered = len(corpus) - len(missing)
+
+    def ratio(numerator, denominator, digits=4):
+        return round(numerator / denominator, digits) if denominator else None
+
+    return {
+        "chunk_seconds": chunk_seconds or None,
+        "chunk_words": chunk_words or None,
+        "mode": mode,
+        "transcripts": answered,
+        "missing_recordings": len(missing),
+        "transcript_exact": ratio(totals["transcript_exact"], answered),
+        "item_recall": ratio(totals["matched"], totals["expected"]),
+        "item_precision": ratio(totals["matched"], totals["predicted"]),
+        "item_exact": ratio(totals["exact"], totals["expected"]),
+        "chat_calls": client.calls - calls,
+        "first_item_s": ratio(sum(first_item), len(first_item), 3),
+        "after_speech_s": ratio(sum(after_speech), len(after_speech), 3),
+        "failures": failures,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunk-seconds", nargs="+", type=float, default=[1.0, 2.0, 4.0, 0.0],
+                        help="speech per chunk; 0 sends each transcript whole")
+    parser.add_argument("--modes", nargs="+", default=MODES, choices=MODES)
+    parser.add_argument("--words-per-second", type=float, default=2.5)
+    parser.add_argument("--context-chars", type=int, default=transcript_context.TRANSCRIPT_CONTEXT_CHARS)
+    parser.add_argument("--transcription-latency", type=float, default=0.4)
+    parser.add_argument("--chat-latency", type=float, default=0.6)
+    parser.add_argument("--temperature", type=float, default=0.3)
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS)
+    parser.add_argument("--recordings", default=DEFAULT_RECORDINGS)
+    parser.add_argument("--record", action="store_true", help="call the real API and save its responses")
+    parser.add_argument("--output", help="write JSON here instead of stdout")
+    args = parser.parse_args()
+
+    # Whole items only, so a held-back item can't make the call count depend on timing
+    extraction.EXTRACTION_STREAMING = False
+
+    with open(args.corpus, encoding="utf-8") as f:
+        corpus = json.load(f)
+    recordings = {}
+    if os.path.exists(args.recordings):
+        with open(args.recordings, encoding="utf-8") as f:
+            recordings = json.load(f)
+
+    if args.record:
+        import openai_client
+        client = CountingClient(RecordingClient(openai_client.create_sync_client(), recordings))
+    else:
+        client = CountingClient(RecordedClient(recordings))
+
+    results = [evaluate(client, corpus, seconds, mode, args)
+               for seconds in args.chunk_seconds for mode in args.modes]
+
+    if args.record:
+        with open(args.recordings, "w", encoding="utf-8") as f:
+            json.dump(recordings, f, indent=2, sort_keys=True, ensure_ascii=False)
+            f.write("\n")
+
+    for r in results:
+        chunk = f"{r['chunk_seconds']:g}s" if r["chunk_seconds"] else "whole"
+        print(f"{chunk:>6} {r['mode']:9} exact {r['transcript_exact']}  recall {r['item_recall']}  "
+              f"precision {r['item_precision']}  chat calls {r['chat_calls']}  "
+              f"first item {r['first_item_s']} s  after speech {r['after_speech_s']} s", file=sys.stderr)
+        if r["missing_recordings"]:
+            print(f"  {r['missing_recordings']} transcripts have no recording; run with --record", file=sys.stderr)
+
+    report = {"benchmark": "context_eval", "words_per_second": args.words_per_second,
+              "context_chars": args.context_chars, "transcription_latency": args.transcription_latency,
+              "chat_latency": args.chat_latency, "temperature": args.temperature, "results": results}
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, sort_keys=True, ensure_ascii=False)
+            f.write("\n")
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True, ensure_ascii=False)
+        print()
+    if any(r["missing_recordings"] for r in results):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+"""
+Local stand-in for the upstream services the backend talks to, so benchmarks
+can run offline without API credits:
+
+- OpenAI: POST .../audio/transcriptions and POST .../chat/completions
+  (plain JSON, or SSE when the request asks for stream=true)
+- API Gateway management API: POST /@connections/{id} (boto3 with
+  GATEWAY_ENDPOINT_URL pointed here)
+
+Latency, jitter and failure rate are configurable per route family.
+"""
+import json
+import random
+import threading
+import time
+from urllib.parse import unquote
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_TRANSCRIPT = "2 kg rice, konjam thakkali matrum vengayam"
+DEFAULT_ITEMS = [
+    {"tamil_name": "தக்காளி", "english_name": "Tomato", "weight": "", "quantity": None},
+    {"tamil_name": "வெங்காயம்", "english_name": "Onion", "weight": "", "quantity": None},
+]
+
+class UpstreamConfig:
+    def __init__(self, transcription_latency=0.0, chat_latency=0.0, jitter=0.0, failure_rate=0.0,
+                 transcript=DEFAULT_TRANSCRIPT, items=None, stream_chunk_chars=8, stream_chunk_delay=0.0,
+                 seed=None):
+        self.transcription_latency = transcription_latency
+        self.chat_latency = chat_latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.transcript = transcript
+        self.items = DEFAULT_ITEMS if items is None else items
+        self.stream_chunk_chars = stream_chunk_chars
+        self.stream_chunk_delay = stream_chunk_delay
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counts = {"transcriptions": 0, "chat": 0, "chat_stream": 0, "post_to_connection": 0, "failures": 0}
+        self.posted = []
+        self.first_post = {}  # connection id -> time.perf_counter() of its first message
+
+    def count(self, key):
+        with self.lock:
+            self.counts[key] += 1
+
+    def delay(self, base):
+        with self.lock:
+            extra = self.random.uniform(0, self.jitter) if self.jitter else 0.0
+            fail = self.random.random() < self.failure_rate
+        if base + extra > 0:
+            time.sleep(base + extra)
+        return fail
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    config = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _send(self, status, body, content_type="application/json"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _fail(self):
+        self.config.count("failures")
+        self._send(503, json.dumps({"error": {"message": "fake upstream failure", "type": "server_error"}}).encode())
+
+    def do_POST(self):
+        config = self.config
+        body = self._body()
+        path = self.path.split("?")[0]
+
+        if path.endswith("/audio/transcriptions"):
+            config.count("transcriptions")
+            if config.delay(config.transcription_latency):
+                return self._fail()
+            return self._send(200, config.transcript.encode("utf-8"), "text/plain; charset=utf-8")
+
+        if path.endswith("/chat/completions"):
+            request = json.loads(body or b"{}")
+            content = json.dumps({"items": config.items}, ensure_ascii=False)
+            if request.get("stream"):
+                config.count("chat_stream")
+                if config.delay(config.chat_latency):
+                    return self._fail()
+                return self._stream(request.get("model", "gpt-4o"), content)
+            config.count("chat")
+            if config.delay(config.chat_latency):
+                return self._fail()
+            prompt_chars = sum(len(m.get("content") or "") for m in request.get("messages", []))
+            response = {
+                "id": "chatcmpl-fake", "object": "chat.completion", "created": int(time.time()),
+                "model": request.get("model", "gpt-4o"),
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": content}}],
+                "usage": {"prompt_tokens": prompt_chars // 4, "completion_tokens": len(content) // 4,
+                          "total_tokens": (prompt_chars + len(content)) // 4},
+            }
+            return self._send(200, json.dumps(response, ensure_ascii=False).encode("utf-8"))
+
+        if "/@connections/" in path:
+            config.count("post_to_connection")
+            connection_id = unquote(path.split("/@connections/", 1)[1])
+            with config.lock:
+                config.posted.append(body)
+                config.first_post.setdefault(connection_id, time.perf_counter())
+            return self._send(200, b"")
+
+        self._send(404, b'{"error": "not found"}')
+
+    def _stream(self, model, content):
+        config = self.config
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        size = max(1, config.stream_chunk_chars)
+        for i in range(0, len(content), size):
+            chunk = {"id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": int(time.time()),
+                     "model": model, "choices": [{"index": 0, "delta": {"content": content[i:i + size]},
+                                                  "finish_reason": None}]}
+            self._write_chunk(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+            if config.stream_chunk_delay:
+                time.sleep(config.stream_chunk_delay)
+        self._write_chunk(b"data: [DONE]\n\n")
+        self._write_chunk(b"")
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # The default backlog of 5 refuses connections under benchmark concurrency
+    request_queue_size = 1024
+
+class FakeUpstream:
+    """Run the fake server on a background thread: with FakeUpstream(config) as upstream: ..."""
+
+    def __init__(self, config=None, host="127.0.0.1", port=0):
+        self.config = config or UpstreamConfig()
+        handler = type("Handler", (_Handler,), {"config": self.config})
+        self.server = _Server((host, port), handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def openai_base_url(self):
+        return f"{self.url}/v1"
+
+    def env(self):
+        """Environment variables pointing the backend at this server"""
+        return {
+            "OPENAI_API_KEY": "sk-fake",
+            "OPENAI_BASE_URL": self.openai_base_url,
+            "GATEWAY_ENDPOINT_URL": self.url,
+            "AWS_ACCESS_KEY_ID": "fake",
+            "AWS_SECRET_ACCESS_KEY": "fake",
+            "AWS_DEFAULT_REGION": "us-east-1",
+        }
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Run the fake OpenAI / management API server")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--transcription-latency", type=float, default=0.3)
+    parser.add_argument("--chat-latency", type=float, default=0.5)
+    parser.add_argument("--jitter", type=float, default=0.1)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    config = UpstreamConfig(args.transcription_latency, args.chat_latency, args.jitter, args.failure_rate)
+    upstream = FakeUpstream(config, port=args.port)
+    print(f"Fake upstream listening on {upstream.url}")
+    upstream.server.serve_forever()
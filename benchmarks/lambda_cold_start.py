@@ -0,0 +1,106 @@
+"""
+Cold-start benchmark for lambda_handler.
+
+Each run starts a fresh interpreter (like a new Lambda container), imports
+lambda_handler, then invokes handler() twice with a synthetic API Gateway
+event for one route key: the first call is the cold invocation, the second
+the warm one. OpenAI and the management API are served by fake_upstream, so
+no network access or credentials are needed.
+
+    python benchmarks/lambda_cold_start.py --runs 5 --modes lazy eager
+
+Prints a table to stderr and a JSON summary to stdout.
+"""
+import argparse
+import base64
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fake_upstream import FakeUpstream, UpstreamConfig
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def make_event(route_key, body=None, connection_id="bench-connection"):
+    event = {
+        "requestContext": {
+            "routeKey": route_key,
+            "connectionId": connection_id,
+            "domainName": "example.execute-api.local",
+            "stage": "prod",
+        },
+        "isBase64Encoded": False,
+    }
+    if body is not None:
+        event["body"] = body
+    return event
+
+def route_events():
+    audio = base64.b64encode(os.urandom(2048)).decode("ascii")
+    return {
+        "$connect": make_event("$connect"),
+        "$disconnect": make_event("$disconnect"),
+        "$default:test": make_event("$default", json.dumps({"type": "test", "message": "ping"})),
+        "$default:audio": make_event("$default", json.dumps({"type": "audio", "data": audio})),
+    }
+
+# Runs inside the fresh interpreter; prints one JSON line with timings in ms
+_CHILD = r"""
+import json, sys, time, io, contextlib
+event, warm_event = json.loads(sys.argv[1]), json.loads(sys.argv[2])
+t0 = time.perf_counter()
+with contextlib.redirect_stdout(io.StringIO()):
+    import lambda_handler
+    t1 = time.perf_counter()
+    lambda_handler.handler(event, None)
+    t2 = time.perf_counter()
+    lambda_handler.handler(warm_event, None)
+    t3 = time.perf_counter()
+print(json.dumps({"import_ms": (t1 - t0) * 1000, "first_ms": (t2 - t1) * 1000, "warm_ms": (t3 - t2) * 1000}))
+"""
+
+def run_once(route, env):
+    # Fresh payloads for the warm call so it isn't served by the dedupe cache
+    event, warm_event = route_events()[route], route_events()[route]
+    result = subprocess.run(
+        [sys.executable, "-c", _CHILD, json.dumps(event), json.dumps(warm_event)],
+        cwd=REPO_ROOT, env=env, capture_output=True, text=True, check=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def summarize(samples):
+    return {key: round(statistics.median(s[key] for s in samples), 2) for key in samples[0]}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--modes", nargs="+", default=["lazy", "eager"], choices=["lazy", "eager"])
+    parser.add_argument("--routes", nargs="+", default=None)
+    args = parser.parse_args()
+
+    routes = args.routes or list(route_events())
+    results = []
+    with FakeUpstream(UpstreamConfig()) as upstream:
+        base_env = dict(os.environ, **upstream.env())
+        # Keep dedupe/extraction caches in-process so every run starts cold
+        base_env.update({"AUDIO_DEDUPE_BACKEND": "memory", "EXTRACTION_CACHE_BACKEND": "memory"})
+        for mode in args.modes:
+            env = dict(base_env, LAMBDA_LAZY_IMPORTS="1" if mode == "lazy" else "0")
+            for route in routes:
+                samples = [run_once(route, env) for _ in range(args.runs)]
+                summary = summarize(samples)
+                results.append({"mode": mode, "route": route, "runs": args.runs, **summary})
+                print(f"{mode:6} {route:16} import {summary['import_ms']:8.2f} ms  "
+                      f"first {summary['first_ms']:8.2f} ms  warm {summary['warm_ms']:8.2f} ms", file=sys.stderr)
+
+        upstream_calls = dict(upstream.config.counts)
+
+    json.dump({"benchmark": "lambda_cold_start", "results": results, "upstream_calls": upstream_calls},
+              sys.stdout, indent=2)
+    print()
+
+if __name__ == "__main__":
+    main()
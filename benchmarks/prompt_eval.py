@@ -0,0 +1,227 @@
+"""
+Accuracy and token comparison of the extraction prompt variants.
+
+Sends every transcript in prompt_corpus.json through each variant in
+prompts.py, exactly as extraction builds the request. The answers are
+scored against the hand-labelled items: item recall/precision, per-field
+accuracy and exact-match transcripts. Prompt and completion tokens come
+from the API's reported usage.
+
+Recording talks to the real API once and saves every response:
+
+    OPENAI_API_KEY=... python benchmarks/prompt_eval.py --record
+
+Later runs replay the recordings through a stand-in client, so prompt or
+scoring changes can be checked without credentials or network access:
+
+    python benchmarks/prompt_eval.py --variants full compact --output eval.json
+
+Responses are keyed on the exact request, so editing a prompt needs a new
+--record run; missing recordings are reported, not faked.
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+import unicodedata
+from types import SimpleNamespace
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(HERE)
+sys.path.insert(0, REPO_ROOT)
+
+import extraction
+import prompts
+
+DEFAULT_CORPUS = os.path.join(HERE, "prompt_corpus.json")
+DEFAULT_RECORDINGS = os.path.join(HERE, "prompt_recordings.json")
+
+_UNITS = {
+    "kg": "kg", "kgs": "kg", "kilo": "kg", "kilos": "kg", "kilogram": "kg", "kilograms": "kg",
+    "g": "g", "gm": "g", "gms": "g", "gram": "g", "grams": "g",
+    "l": "l", "ltr": "l", "litre": "l", "litres": "l", "liter": "l", "liters": "l",
+    "ml": "ml", "millilitre": "ml", "milliliter": "ml",
+}
+_WEIGHT_RE = re.compile(r"^\s*(\d+(?:\.\d+)?|\.\d+)\s*([a-z]+)\s*$")
+
+def request_key(args):
+    return hashlib.sha256(json.dumps(args, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+class MissingRecording(Exception):
+    pass
+
+class RecordedClient:
+    """Stand-in for openai.OpenAI that answers chat completions from recordings"""
+    def __init__(self, recordings):
+        self.recordings = recordings
+        self.chat = SimpleNamespace(completions=self)
+
+    def create(self, **args):
+        args.pop("timeout", None)
+        recorded = self.recordings.get(request_key(args))
+        if recorded is None:
+            raise MissingRecording(args["messages"][-1]["content"])
+        usage = SimpleNamespace(prompt_tokens_details=None, **recorded["usage"])
+        message = SimpleNamespace(content=recorded["content"])
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=usage)
+
+class RecordingClient:
+    """Wraps a real client and keeps every response for later replay"""
+    def __init__(self, client, recordings):
+        self.client = client
+        self.recordings = recordings
+        self.chat = SimpleNamespace(completions=self)
+
+    def create(self, **args):
+        timeout = args.pop("timeout", None)
+        response = self.client.chat.completions.create(timeout=timeout, **args)
+        self.recordings[request_key(args)] = {
+            "model": args["model"],
+            "content": response.choices[0].message.content,
+            "usage": {"prompt_tokens": response.usage.prompt_tokens,
+                      "completion_tokens": response.usage.completion_tokens},
+        }
+        return response
+
+def _accepted(value):
+    values = value if isinstance(value, list) else [value]
+    return {unicodedata.normalize("NFC", str(v)).strip().casefold() for v in values}
+
+def _norm(value):
+    return unicodedata.normalize("NFC", str(value or "")).strip().casefold()
+
+def norm_weight(weight):
+    """'1 kg', '1000 grams' and '1 kilo' all become '1000 g'"""
+    match = _WEIGHT_RE.match(_norm(weight))
+    if not match:
+        return _norm(weight)
+    amount, unit = float(match[1]), _UNITS.get(match[2], match[2])
+    if unit in ("kg", "l"):
+        amount, unit = amount * 1000, "g" if unit == "kg" else "ml"
+    return f"{amount:g} {unit}"
+
+def score(expected, predicted):
+    """Per-transcript counts: matched items, exact items and field hits"""
+    remaining = list(predicted)
+    counts = {"expected": len(expected), "predicted": len(predicted), "matched": 0, "exact": 0,
+              "tamil_name": 0, "weight": 0, "quantity": 0}
+    for want in expected:
+        names = _accepted(want["english_name"])
+        found = next((item for item in remaining if _norm(item.get("english_name")) in names), None)
+        if found is None:
+            continue
+        remaining.remove(found)
+        counts["matched"] += 1
+        fields = {
+            "tamil_name": _norm(found.get("tamil_name")) in _accepted(want["tamil_name"]),
+            "weight": norm_weight(found.get("weight")) == norm_weight(want["weight"]),
+            "quantity": found.get("quantity") == want["quantity"],
+        }
+        for field, ok in fields.items():
+            counts[field] += ok
+        counts["exact"] += all(fields.values())
+    counts["transcript_exact"] = counts["exact"] == len(expected) and not remaining
+    return counts
+
+def evaluate(client, corpus, variant, model, temperature):
+    system_prompt, user_prompt = prompts.get_prompts(variant)
+    totals = {"expected": 0, "predicted": 0, "matched": 0, "exact": 0, "tamil_name": 0, "weight": 0,
+              "quantity": 0, "transcript_exact": 0, "prompt_tokens": 0, "completion_tokens": 0}
+    missing = []
+    failures = []
+    for case in corpus:
+        args = extraction._completion_args(case["transcript"], model, system_prompt, user_prompt, temperature)
+        try:
+            response = client.chat.completions.create(**args)
+        except MissingRecording:
+            missing.append(case["transcript"])
+            continue
+        totals["prompt_tokens"] += response.usage.prompt_tokens
+        totals["completion_tokens"] += response.usage.completion_tokens
+        try:
+            predicted = extraction.parse_items(response.choices[0].message.content)
+        except ValueError:
+            predicted = []
+        counts = score(case["items"], predicted)
+        for key, value in counts.items():
+            totals[key] += value
+        if not counts["transcript_exact"]:
+            failures.append({"transcript": case["transcript"], "predicted": predicted})
+
+    answered = len(corpus) - len(missing)
+
+    def ratio(numerator, denominator):
+        return round(numerator / denominator, 4) if denominator else None
+
+    return {
+        "variant": variant,
+        "prompt_version": prompts.version_of(system_prompt),
+        "system_prompt_chars": len(system_prompt),
+        "transcripts": answered,
+        "missing_recordings": len(missing),
+        "transcript_exact": ratio(totals["transcript_exact"], answered),
+        "item_recall": ratio(totals["matched"], totals["expected"]),
+        "item_precision": ratio(totals["matched"], totals["predicted"]),
+        "item_exact": ratio(totals["exact"], totals["expected"]),
+        "field_accuracy": {field: ratio(totals[field], totals["matched"])
+                           for field in ("tamil_name", "weight", "quantity")},
+        "mean_prompt_tokens": ratio(totals["prompt_tokens"], answered),
+        "mean_completion_tokens": ratio(totals["completion_tokens"], answered),
+        "failures": failures,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--variants", nargs="+", default=list(prompts.PROMPT_VARIANTS),
+                        choices=list(prompts.PROMPT_VARIANTS))
+    parser.add_argument("--model", default="gpt-4o")
+    parser.add_argument("--temperature", type=float, default=0.3)
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS)
+    parser.add_argument("--recordings", default=DEFAULT_RECORDINGS)
+    parser.add_argument("--record", action="store_true", help="call the real API and save its responses")
+    parser.add_argument("--output", help="write JSON here instead of stdout")
+    args = parser.parse_args()
+
+    with open(args.corpus, encoding="utf-8") as f:
+        corpus = json.load(f)
+    recordings = {}
+    if os.path.exists(args.recordings):
+        with open(args.recordings, encoding="utf-8") as f:
+            recordings = json.load(f)
+
+    if args.record:
+        import openai_client
+        client = RecordingClient(openai_client.create_sync_client(), recordings)
+    else:
+        client = RecordedClient(recordings)
+
+    results = [evaluate(client, corpus, variant, args.model, args.temperature) for variant in args.variants]
+
+    if args.record:
+        with open(args.recordings, "w", encoding="utf-8") as f:
+            json.dump(recordings, f, indent=2, sort_keys=True, ensure_ascii=False)
+            f.write("\n")
+
+    for r in results:
+        print(f"{r['prompt_version']:11} {r['system_prompt_chars']:>5} chars  "
+              f"prompt tokens {r['mean_prompt_tokens']}  completion tokens {r['mean_completion_tokens']}  "
+              f"exact {r['transcript_exact']}  recall {r['item_recall']}  precision {r['item_precision']}  "
+              f"fields {r['field_accuracy']}", file=sys.stderr)
+        if r["missing_recordings"]:
+            print(f"  {r['missing_recordings']} transcripts have no recording; run with --record", file=sys.stderr)
+
+    report = {"benchmark": "prompt_eval", "model": args.model, "temperature": args.temperature, "results": results}
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, sort_keys=True, ensure_ascii=False)
+            f.write("\n")
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True, ensure_ascii=False)
+        print()
+    if any(r["missing_recordings"] for r in results):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""
+Serving-stack benchmark: the production entry point (serve.py: one worker
+per --workers, uvloop, httptools, orjson) against a plain single uvicorn
+process (asyncio loop, h11, stdlib JSON via FAST_JSON=0).
+
+- frames: per-frame serialization cost of typical WebSocket messages (one
+  item, an items batch, a session-list delta, a 100-item list snapshot)
+  with the stdlib encoder and with fast_json
+- http: requests/s and p50/p95/p99 latency of GET / and POST /transcribe/
+  against fake_upstream, closed-loop with --concurrency clients for
+  --duration seconds, for each stack
+
+    python benchmarks/serving.py --workers 4 --concurrency 64 --duration 10 --output serving.json
+
+Prints a table to stderr and JSON (sorted keys) to stdout or --output.
+Upstream latency defaults to 0 so the numbers reflect the server itself.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fake_upstream import FakeUpstream, UpstreamConfig
+from suite import REPO_ROOT, app_server, fake_chunk, percentile, uvicorn_command
+
+STACKS = ["plain", "production"]
+TARGETS = ["root", "transcribe"]
+
+_ITEM = {"tamil_name": "தக்காளி", "english_name": "Tomato", "weight": "1 kg", "quantity": 2}
+
+FRAMES = {
+    "item": dict(_ITEM, seq=3),
+    "items_batch": {"type": "items", "items": [_ITEM] * 10},
+    "delta": {"type": "delta", "version": 12, "base": 11,
+              "ops": [{"op": "add", "id": 7, "item": _ITEM}, {"op": "update", "id": 2, "item": _ITEM},
+                      {"op": "remove", "id": 4}]},
+    "list_snapshot": {"type": "list", "version": 40, "items": [dict(_ITEM, id=i) for i in range(100)]},
+}
+
+def frame_costs(number):
+    """Microseconds per frame for each encoder"""
+    sys.path.insert(0, REPO_ROOT)
+    import fast_json
+
+    def stdlib(message):
+        # What Starlette's websocket.send_json() does
+        return json.dumps(message, separators=(",", ":"), ensure_ascii=False)
+
+    results = []
+    for name, message in FRAMES.items():
+        row = {"frame": name, "bytes": len(stdlib(message).encode("utf-8")), "encoder": fast_json.ENCODER}
+        for label, encode in (("stdlib_us", stdlib), ("fast_us", fast_json.dumps)):
+            row[label] = round(min(timeit.repeat(lambda: encode(message), number=number, repeat=5)) / number * 1e6, 3)
+        row["speedup"] = round(row["stdlib_us"] / row["fast_us"], 2) if row["fast_us"] else None
+        results.append(row)
+    return results
+
+def stack_command(stack, workers):
+    if stack == "plain":
+        def command(port):
+            return uvicorn_command(port) + ["--loop", "asyncio", "--http", "h11"]
+        return command, {"FAST_JSON": "0"}
+
+    def command(port):
+        return [sys.executable, "serve.py", "--host", "127.0.0.1", "--port", str(port), "--workers", str(workers)]
+    return command, {"SERVER_LOG_LEVEL": "warning"}
+
+async def load(base, target, concurrency, duration, upload_bytes):
+    import httpx
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    latencies = []
+    errors = 0
+    async with httpx.AsyncClient(limits=limits, timeout=60) as client:
+        stop_at = time.perf_counter() + duration
+
+        async def client_loop():
+            nonlocal errors
+            while time.perf_counter() < stop_at:
+                start = time.perf_counter()
+                try:
+                    if target == "root":
+                        response = await client.get(f"http://{base}/")
+                    else:
+                        files = {"file": ("audio.webm", fake_chunk(upload_bytes), "audio/webm")}
+                        response = await client.post(f"http://{base}/transcribe/", files=files)
+                    response.read()
+                    errors += response.status_code != 200
+                except Exception:
+                    errors += 1
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(client_loop() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "requests_per_s": round(len(latencies) / elapsed, 1),
+        "latency_ms": {f"p{int(q * 100)}": round(percentile(latencies, q) * 1000, 2) if latencies else None
+                       for q in (0.5, 0.95, 0.99)},
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--stacks", nargs="+", default=STACKS, choices=STACKS)
+    parser.add_argument("--targets", nargs="+", default=TARGETS, choices=TARGETS)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per stack and target")
+    parser.add_argument("--upload-bytes", type=int, default=4000)
+    parser.add_argument("--frame-iterations", type=int, default=20000)
+    parser.add_argument("--transcription-latency", type=float, default=0.0)
+    parser.add_argument("--chat-latency", type=float, default=0.0)
+    parser.add_argument("--output", help="write JSON here instead of stdout")
+    args = parser.parse_args()
+
+    frames = frame_costs(args.frame_iterations)
+    for row in frames:
+        print(f"frame {row['frame']:14} {row['bytes']:>6} B  stdlib {row['stdlib_us']:>8} us  "
+              f"{row['encoder']} {row['fast_us']:>8} us  x{row['speedup']}", file=sys.stderr)
+
+    http = []
+    config = UpstreamConfig(transcription_latency=args.transcription_latency, chat_latency=args.chat_latency)
+    with FakeUpstream(config) as upstream:
+        for stack in args.stacks:
+            command, stack_env = stack_command(stack, args.workers)
+            env = dict(os.environ, **upstream.env())
+            env.update({"AUDIO_DEDUPE_BACKEND": "memory", "EXTRACTION_CACHE_BACKEND": "none",
+                        "PYTHONPATH": REPO_ROOT, "LOG_LEVEL": "WARNING", **stack_env})
+            with app_server(env, command) as base:
+                for target in args.targets:
+                    result = asyncio.run(load(base, target, args.concurrency, args.duration, args.upload_bytes))
+                    http.append({"stack": stack, "target": target, "concurrency": args.concurrency,
+                                 "workers": args.workers if stack == "production" else 1, **result})
+                    print(f"http  {stack:10} {target:10} {result['requests_per_s']:>9} req/s  "
+                          f"p50 {result['latency_ms']['p50']} p95 {result['latency_ms']['p95']} "
+                          f"p99 {result['latency_ms']['p99']} ms  errors {result['errors']}", file=sys.stderr)
+
+    output = json.dumps({"frames": frames, "http": http}, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    main()
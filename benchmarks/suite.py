@@ -0,0 +1,327 @@
+"""
+Offline throughput / latency benchmark suite.
+
+Runs every scenario against fake_upstream (OpenAI and the API Gateway
+management API) at each concurrency level:
+
+- websocket: sessions stream audio chunks to the FastAPI WebSocket endpoint
+  (uvicorn subprocess) and wait for {"status": "completed"}
+- upload: sessions POST one recording to /transcribe/
+- lambda: sessions invoke lambda_handler.handler with synthetic $default
+  events, one thread per concurrent session, items delivered to the fake
+  management API
+
+For each scenario and level it reports throughput, time-to-first-item and
+p50/p95/p99 session latency. Audio payloads are random so the dedupe cache
+never hits, and the extraction cache is off unless --caches is given.
+
+    python benchmarks/suite.py --concurrency 1 10 100 1000 --output bench.json
+    python benchmarks/suite.py --concurrency 1 10 --baseline bench.json
+
+Prints a table to stderr and JSON (sorted keys, stable for diffing) to
+stdout or --output. The lambda scenario runs in this process next to the
+fake server, so its numbers include some GIL contention with it.
+"""
+import argparse
+import asyncio
+import base64
+import contextlib
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fake_upstream import FakeUpstream, UpstreamConfig
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCENARIOS = ["websocket", "upload", "lambda"]
+
+def fake_chunk(size):
+    # WebM magic so sniffing treats it as a self-contained file; random body
+    # so every chunk is unique
+    return b"\x1a\x45\xdf\xa3" + os.urandom(max(0, size - 4))
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+def _ms(values):
+    return {f"p{int(q * 100)}": round(percentile(values, q) * 1000, 2) if values else None
+            for q in (0.5, 0.95, 0.99)}
+
+def summarize(samples, elapsed, chunks_per_session):
+    """samples: list of (latency_s, ttfi_s or None, errors)"""
+    latencies = [s[0] for s in samples]
+    ttfi = [s[1] for s in samples if s[1] is not None]
+    return {
+        "sessions": len(samples),
+        "errors": sum(s[2] for s in samples),
+        "sessions_without_items": len(samples) - len(ttfi),
+        "elapsed_s": round(elapsed, 3),
+        "sessions_per_s": round(len(samples) / elapsed, 2) if elapsed else None,
+        "chunks_per_s": round(len(samples) * chunks_per_session / elapsed, 2) if elapsed else None,
+        "ttfi_ms": _ms(ttfi),
+        "latency_ms": _ms(latencies),
+    }
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def uvicorn_command(port):
+    return [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+            "--log-level", "warning", "--backlog", "2048",
+            # Overloaded levels can delay pongs past the default 20 s and kill
+            # every session; report the latency instead
+            "--ws-ping-interval", "3600", "--ws-ping-timeout", "3600"]
+
+@contextlib.contextmanager
+def app_server(env, command=uvicorn_command):
+    """Run the app in a subprocess started by command(port); yields its base URL"""
+    port = free_port()
+    process = subprocess.Popen(command(port), cwd=REPO_ROOT, env=env, stdout=subprocess.DEVNULL)
+    base = f"127.0.0.1:{port}"
+    try:
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                    break
+            except OSError:
+                if process.poll() is not None or time.monotonic() > deadline:
+                    raise RuntimeError("uvicorn did not start")
+                time.sleep(0.1)
+        yield base
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+async def _run_sessions(session, concurrency, sessions):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def bounded(i):
+        async with semaphore:
+            try:
+                return await session(i)
+            except Exception as e:
+                print(f"session {i} failed: {e!r}", file=sys.stderr)
+                return None
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(bounded(i) for i in range(sessions)))
+    elapsed = time.perf_counter() - start
+    failed = sum(1 for r in results if r is None)
+    samples = [r for r in results if r is not None]
+    return samples, elapsed, failed
+
+async def websocket_level(base, concurrency, sessions, args):
+    import websockets
+
+    async def session(i):
+        start = time.perf_counter()
+        first = None
+        errors = 0
+        async with websockets.connect(f"ws://{base}/", max_size=None, open_timeout=120,
+                                      ping_interval=None) as ws:
+            for _ in range(args.chunks):
+                await ws.send(fake_chunk(args.chunk_bytes))
+                if args.chunk_interval:
+                    await asyncio.sleep(args.chunk_interval)
+            await ws.send(b"\xff")
+            async for raw in ws:
+                message = json.loads(raw)
+                if message.get("status") == "completed":
+                    break
+                if "error" in message:
+                    errors += 1
+                elif first is None and "english_name" in message:
+                    first = time.perf_counter() - start
+        return time.perf_counter() - start, first, errors
+
+    return await _run_sessions(session, concurrency, sessions)
+
+async def upload_level(base, concurrency, sessions, args):
+    import httpx
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=300) as client:
+        async def session(i):
+            start = time.perf_counter()
+            files = {"file": ("audio.webm", fake_chunk(args.upload_bytes), "audio/webm")}
+            response = await client.post(f"http://{base}/transcribe/", files=files)
+            latency = time.perf_counter() - start
+            if response.status_code != 200:
+                return latency, None, 1
+            # The whole list arrives at once, so first item == full response
+            return latency, latency if response.json() else None, 0
+
+        return await _run_sessions(session, concurrency, sessions)
+
+def _lambda_event(connection_id, body):
+    return {
+        "requestContext": {"routeKey": "$default", "connectionId": connection_id,
+                           "domainName": "bench.execute-api.local", "stage": "prod"},
+        "isBase64Encoded": False,
+        "body": json.dumps(body),
+    }
+
+def lambda_level(upstream, concurrency, sessions, args, level_tag):
+    import lambda_handler
+
+    def session(i):
+        connection_id = f"bench-{level_tag}-{i}"
+        start = time.perf_counter()
+        errors = 0
+        for _ in range(args.chunks):
+            audio = base64.b64encode(fake_chunk(args.chunk_bytes)).decode("ascii")
+            response = lambda_handler.handler(_lambda_event(connection_id, {"type": "audio", "data": audio}), None)
+            errors += response.get("statusCode") != 200
+        lambda_handler.handler(_lambda_event(connection_id, {"type": "end"}), None)
+        latency = time.perf_counter() - start
+        first = upstream.config.first_post.get(connection_id)
+        return latency, (first - start) if first is not None else None, errors
+
+    def guarded(i):
+        try:
+            return session(i)
+        except Exception as e:
+            print(f"session {i} failed: {e!r}", file=sys.stderr)
+            return None
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(guarded, range(sessions)))
+    elapsed = time.perf_counter() - start
+    samples = [r for r in results if r is not None]
+    return samples, elapsed, len(results) - len(samples)
+
+def git_revision():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_ROOT, capture_output=True,
+                                text=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=REPO_ROOT,
+                                    capture_output=True, text=True).stdout.strip())
+        return commit or None, dirty
+    except OSError:
+        return None, None
+
+def compare(results, baseline_path):
+    """Print throughput / p95 deltas against an earlier run to stderr"""
+    with open(baseline_path) as f:
+        baseline = {(r["scenario"], r["concurrency"]): r for r in json.load(f)["results"]}
+
+    def delta(new, old):
+        if new is None or old in (None, 0):
+            return "   n/a"
+        return f"{(new - old) / old * 100:+6.1f}%"
+
+    print(f"\nvs {baseline_path}:", file=sys.stderr)
+    for r in results:
+        old = baseline.get((r["scenario"], r["concurrency"]))
+        if old is None:
+            continue
+        print(f"{r['scenario']:9} c={r['concurrency']:<5} "
+              f"sessions/s {delta(r['sessions_per_s'], old['sessions_per_s'])}  "
+              f"ttfi p95 {delta(r['ttfi_ms']['p95'], old['ttfi_ms']['p95'])}  "
+              f"latency p95 {delta(r['latency_ms']['p95'], old['latency_ms']['p95'])}", file=sys.stderr)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", nargs="+", default=SCENARIOS, choices=SCENARIOS)
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 10, 100, 1000])
+    parser.add_argument("--min-sessions", type=int, default=20,
+                        help="sessions per level: max(concurrency, min-sessions)")
+    parser.add_argument("--chunks", type=int, default=3, help="audio chunks per streaming session")
+    parser.add_argument("--chunk-bytes", type=int, default=16000)
+    parser.add_argument("--chunk-interval", type=float, default=0.0, help="seconds between chunks")
+    parser.add_argument("--upload-bytes", type=int, default=64000)
+    parser.add_argument("--transcription-latency", type=float, default=0.3)
+    parser.add_argument("--chat-latency", type=float, default=0.5)
+    parser.add_argument("--jitter", type=float, default=0.1)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--stream-chunk-delay", type=float, default=0.01)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--caches", action="store_true", help="keep the extraction cache enabled")
+    parser.add_argument("--output", help="write JSON here instead of stdout")
+    parser.add_argument("--baseline", help="earlier JSON output to compare against")
+    args = parser.parse_args()
+
+    config = UpstreamConfig(
+        transcription_latency=args.transcription_latency, chat_latency=args.chat_latency,
+        jitter=args.jitter, failure_rate=args.failure_rate,
+        stream_chunk_delay=args.stream_chunk_delay, seed=args.seed,
+    )
+    results = []
+    with FakeUpstream(config) as upstream:
+        env = dict(os.environ, **upstream.env())
+        env.update({"AUDIO_DEDUPE_BACKEND": "memory",
+                    "EXTRACTION_CACHE_BACKEND": "memory" if args.caches else "none",
+                    "PYTHONPATH": REPO_ROOT})
+
+        def record(scenario, concurrency, samples, elapsed, failed, chunks_per_session):
+            summary = summarize(samples, elapsed, chunks_per_session)
+            summary["failed_sessions"] = failed
+            results.append({"scenario": scenario, "concurrency": concurrency, **summary})
+            print(f"{scenario:9} c={concurrency:<5} {summary['sessions_per_s']:>8} sessions/s  "
+                  f"ttfi p50 {summary['ttfi_ms']['p50']} p95 {summary['ttfi_ms']['p95']} ms  "
+                  f"latency p50 {summary['latency_ms']['p50']} p95 {summary['latency_ms']['p95']} "
+                  f"p99 {summary['latency_ms']['p99']} ms  errors {summary['errors'] + failed}", file=sys.stderr)
+
+        if "websocket" in args.scenarios or "upload" in args.scenarios:
+            with app_server(env) as base:
+                for concurrency in args.concurrency:
+                    sessions = max(concurrency, args.min_sessions)
+                    if "websocket" in args.scenarios:
+                        record("websocket", concurrency,
+                               *asyncio.run(websocket_level(base, concurrency, sessions, args)), args.chunks)
+                    if "upload" in args.scenarios:
+                        record("upload", concurrency,
+                               *asyncio.run(upload_level(base, concurrency, sessions, args)), 1)
+
+        if "lambda" in args.scenarios:
+            os.environ.update(env)
+            sys.path.insert(0, REPO_ROOT)
+            for concurrency in args.concurrency:
+                sessions = max(concurrency, args.min_sessions)
+                # lambda_handler logs every event; keep it out of the report
+                with contextlib.redirect_stdout(open(os.devnull, "w")):
+                    outcome = lambda_level(upstream, concurrency, sessions, args, concurrency)
+                record("lambda", concurrency, *outcome, args.chunks)
+
+        upstream_calls = dict(upstream.config.counts)
+
+    commit, dirty = git_revision()
+    report = {
+        "benchmark": "suite",
+        "meta": {
+            "commit": commit, "dirty": dirty, "python": platform.python_version(),
+            "platform": platform.platform(), "cpus": os.cpu_count(),
+            "args": {k: v for k, v in vars(args).items() if k not in ("output", "baseline")},
+        },
+        "results": results,
+        "upstream_calls": upstream_calls,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+            f.write("\n")
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        print()
+    if args.baseline:
+        compare(results, args.baseline)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Small key/value caches with LRU + TTL eviction. MemoryCache is per process;
+# SqliteCache is a file so several uvicorn workers (or warm Lambda containers
+# sharing /tmp) see each other's entries. Values must be JSON-serialisable.
+
+class _StatsMixin:
+    def _init_stats(self):
+        self._stats_lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "sets": 0, "evictions": 0}
+
+    def _record(self, key, amount=1):
+        with self._stats_lock:
+            self._stats[key] += amount
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        stats["size"] = len(self)
+        return stats
+
+class MemoryCache(_StatsMixin):
+    def __init__(self, max_entries=1024, ttl=3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._init_stats()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key):
+        """Return the cached value or None"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                expires, value = entry
+                if expires >= time.monotonic():
+                    self._data.move_to_end(key)
+                    self._record("hits")
+                    return value
+                del self._data[key]
+        self._record("misses")
+        return None
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            evicted = 0
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                evicted += 1
+        self._record("sets")
+        if evicted:
+            self._record("evictions", evicted)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+class SqliteCache(_StatsMixin):
+    def __init__(self, path, max_entries=10000, ttl=86400):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        # WAL lets readers in other processes proceed while one process writes
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires)")
+        self._init_stats()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT value, expires FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is not None and row[1] >= now:
+                self._conn.execute("UPDATE cache SET accessed = ? WHERE key = ?", (now, key))
+                self._record("hits")
+                return json.loads(row[0])
+            if row is not None:
+                self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+        self._record("misses")
+        return None
+
+    def set(self, key, value):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires, accessed) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), now + self.ttl, now),
+            )
+            # Drop expired rows, then the least recently used beyond the cap
+            cursor = self._conn.execute("DELETE FROM cache WHERE expires < ?", (now,))
+            evicted = cursor.rowcount
+            cursor = self._conn.execute(
+                "DELETE FROM cache WHERE key IN ("
+                "SELECT key FROM cache ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            evicted += cursor.rowcount
+        self._record("sets")
+        if evicted > 0:
+            self._record("evictions", evicted)
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM cache")
+
+    def close(self):
+        self._conn.close()
+
+def create_cache(backend, max_entries, ttl, path=None):
+    """Build a cache from config values; backend is "memory", "sqlite" or "none" """
+    if backend == "none":
+        return None
+    if backend == "sqlite":
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        return SqliteCache(path, max_entries=max_entries, ttl=ttl)
+    return MemoryCache(max_entries=max_entries, ttl=ttl)
@@ -0,0 +1,321 @@
+import asyncio
+import contextvars
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+import logs
+import metrics
+
+log = logs.get_logger("call_policy")
+
+# Call policy for upstream (OpenAI) requests, per stage ("transcription",
+# "chat"):
+# - a deadline for the whole call, retries included, and a timeout per attempt
+# - retries with full-jitter exponential backoff, only for idempotent calls and
+#   retryable errors (timeouts, connection errors, 408/409/429/5xx)
+# - optional hedging: if the first attempt hasn't answered after the stage's
+#   recent p95 latency, a second identical request is sent and the first
+#   response wins
+# - a circuit breaker that fails fast after repeated retryable failures and
+#   lets a single probe through once the reset period has passed
+# The SDK's own retries are disabled (OPENAI_SDK_RETRIES) so this is the only
+# retry layer.
+#
+# Settings are read per stage, e.g. POLICY_TRANSCRIPTION_DEADLINE or
+# POLICY_CHAT_HEDGE, falling back to POLICY_DEADLINE, POLICY_HEDGE, ...
+
+_DEFAULTS = {
+    "deadline": 30.0,           # seconds for the whole call
+    "attempt_timeout": 15.0,    # seconds per attempt
+    "retries": 2,
+    "retry_base": 0.25,
+    "retry_max": 2.0,
+    "hedge": 0,                 # 1 enables hedged requests
+    "hedge_delay": 1.0,         # used until enough latencies are recorded
+    "hedge_min_delay": 0.2,
+    "hedge_quantile": 0.95,
+    "breaker_failures": 5,      # consecutive retryable failures that open the circuit
+    "breaker_reset": 30.0,      # seconds before a probe is let through
+}
+
+_LATENCY_WINDOW = 200
+_MIN_LATENCY_SAMPLES = 20
+
+def _setting(stage, name):
+    default = _DEFAULTS[name]
+    raw = os.getenv(f"POLICY_{stage.upper()}_{name.upper()}") or os.getenv(f"POLICY_{name.upper()}")
+    return type(default)(raw) if raw else default
+
+class CircuitOpen(Exception):
+    """Upstream is considered degraded; the call was not attempted"""
+
+class DeadlineExceeded(TimeoutError):
+    """The call's deadline passed before an attempt succeeded"""
+
+# Absolute time.monotonic() deadline imposed by the caller (e.g. what is left
+# of a Lambda invocation); stage deadlines are capped to it
+_budget = contextvars.ContextVar("call_policy_budget", default=None)
+
+@contextmanager
+def budget(seconds):
+    """Cap every call made inside the block to finish within `seconds`"""
+    if seconds is None:
+        yield
+        return
+    token = _budget.set(time.monotonic() + max(0.0, seconds))
+    try:
+        yield
+    finally:
+        _budget.reset(token)
+
+def is_retryable(error):
+    import openai
+    if isinstance(error, (openai.APIConnectionError, asyncio.TimeoutError, TimeoutError, ConnectionError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in (408, 409, 429) or error.status_code >= 500
+    return False
+
+class CircuitBreaker:
+    def __init__(self, name, failures, reset):
+        self.name = name
+        self.threshold = failures
+        self.reset = reset
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.lock = threading.Lock()
+
+    def before(self):
+        """Raise CircuitOpen if the call must fail fast; True when it is the half-open probe"""
+        with self.lock:
+            if self.opened_at is None:
+                return False
+            if time.monotonic() - self.opened_at < self.reset or self.probing:
+                metrics.inc("grocery_circuit_rejections_total", call=self.name)
+                raise CircuitOpen(f"{self.name} upstream is degraded, failing fast")
+            # Half-open: let exactly one probe through
+            self.probing = True
+            return True
+
+    def success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.probing or self.failures >= self.threshold:
+                if self.opened_at is None or self.probing:
+                    log.warning("Circuit opened", circuit=self.name, failures=self.failures)
+                    metrics.inc("grocery_circuit_opened_total", call=self.name)
+                self.opened_at = time.monotonic()
+                self.probing = False
+
+    def release_probe(self):
+        # A probe that failed for a non-upstream reason doesn't tell us anything
+        with self.lock:
+            self.probing = False
+
+class CallPolicy:
+    def __init__(self, stage):
+        self.stage = stage
+        for name in _DEFAULTS:
+            setattr(self, name, _setting(stage, name))
+        self.breaker = CircuitBreaker(stage, self.breaker_failures, self.breaker_reset)
+        self.latencies = deque(maxlen=_LATENCY_WINDOW)
+        self._executor = None
+
+    def _deadline(self):
+        deadline = time.monotonic() + self.deadline
+        outer = _budget.get()
+        return min(deadline, outer) if outer is not None else deadline
+
+    def hedge_after(self):
+        """Delay before hedging: recent p-quantile latency, or hedge_delay until we have data"""
+        samples = sorted(self.latencies)
+        if len(samples) < _MIN_LATENCY_SAMPLES:
+            return self.hedge_delay
+        index = min(len(samples) - 1, int(self.hedge_quantile * len(samples)))
+        return max(self.hedge_min_delay, samples[index])
+
+    def _backoff(self, attempt_number):
+        return random.uniform(0, min(self.retry_max, self.retry_base * 2 ** attempt_number))
+
+    def _record(self, error):
+        if error is None:
+            self.breaker.success()
+        elif is_retryable(error):
+            self.breaker.failure()
+        else:
+            self.breaker.release_probe()
+
+    def call(self, attempt, idempotent=True, discard=None, hedge=True):
+        """
+        Blocking call. attempt(timeout) performs one request; discard(result)
+        cleans up the losing result of a hedge (e.g. closes a stream). Pass
+        hedge=False when two attempts can't safely run at once.
+        """
+        deadline = self._deadline()
+        retries = self.retries if idempotent else 0
+        for number in range(retries + 1):
+            # Checked per attempt so retries stop once the circuit opens
+            probe = self.breaker.before()
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                if probe:
+                    self.breaker.release_probe()
+                raise DeadlineExceeded(f"{self.stage} deadline exceeded")
+            timeout = min(remaining, self.attempt_timeout)
+            started = time.monotonic()
+            try:
+                if self.hedge and hedge and idempotent:
+                    result = self._hedged(attempt, timeout, discard)
+                else:
+                    result = attempt(timeout)
+            except BaseException as e:
+                if not isinstance(e, Exception):
+                    # Cancelled or interrupted: no verdict, but the next call may probe
+                    if probe:
+                        self.breaker.release_probe()
+                    raise
+                self._record(e)
+                if not is_retryable(e) or number == retries:
+                    raise
+                delay = self._backoff(number)
+                if time.monotonic() + delay >= deadline:
+                    raise
+                metrics.inc("grocery_upstream_retries_total", call=self.stage)
+                log.info("Retrying", stage=self.stage, error=type(e).__name__, delay=round(delay, 2))
+                time.sleep(delay)
+                continue
+            self._record(None)
+            self.latencies.append(time.monotonic() - started)
+            return result
+
+    async def call_async(self, attempt, idempotent=True, discard=None, hedge=True):
+        """Async version of call(); attempt(timeout) returns an awaitable"""
+        deadline = self._deadline()
+        retries = self.retries if idempotent else 0
+        for number in range(retries + 1):
+            # Checked per attempt so retries stop once the circuit opens
+            probe = self.breaker.before()
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                if probe:
+                    self.breaker.release_probe()
+                raise DeadlineExceeded(f"{self.stage} deadline exceeded")
+            timeout = min(remaining, self.attempt_timeout)
+            started = time.monotonic()
+            try:
+                if self.hedge and hedge and idempotent:
+                    result = await self._hedged_async(attempt, timeout, discard)
+                else:
+                    result = await asyncio.wait_for(attempt(timeout), timeout)
+            except BaseException as e:
+                if not isinstance(e, Exception):
+                    # Cancelled or interrupted: no verdict, but the next call may probe
+                    if probe:
+                        self.breaker.release_probe()
+                    raise
+                self._record(e)
+                if not is_retryable(e) or number == retries:
+                    raise
+                delay = self._backoff(number)
+                if time.monotonic() + delay >= deadline:
+                    raise
+                metrics.inc("grocery_upstream_retries_total", call=self.stage)
+                log.info("Retrying", stage=self.stage, error=type(e).__name__, delay=round(delay, 2))
+                await asyncio.sleep(delay)
+                continue
+            self._record(None)
+            self.latencies.append(time.monotonic() - started)
+            return result
+
+    async def _hedged_async(self, attempt, timeout, discard):
+        end = time.monotonic() + timeout
+        first = asyncio.ensure_future(attempt(timeout))
+        done, _ = await asyncio.wait({first}, timeout=min(self.hedge_after(), timeout))
+        if done:
+            return first.result()
+
+        metrics.inc("grocery_upstream_hedges_total", call=self.stage)
+        second = asyncio.ensure_future(attempt(max(0.0, end - time.monotonic())))
+        tasks = [first, second]
+        pending = set(tasks)
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, timeout=max(0.0, end - time.monotonic()),
+                                                   return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    raise asyncio.TimeoutError()
+                for task in tasks:
+                    if task in done and task.exception() is None:
+                        metrics.inc("grocery_upstream_hedge_wins_total", call=self.stage,
+                                    winner="hedge" if task is second else "first")
+                        winner = task.result()
+                        for other in done - {task}:
+                            if other.exception() is None and discard is not None:
+                                await _maybe_await(discard(other.result()))
+                        return winner
+                error = next(task.exception() for task in done if task.exception() is not None)
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def _hedged(self, attempt, timeout, discard):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix=f"hedge-{self.stage}")
+        end = time.monotonic() + timeout
+        # Hedge threads don't inherit the caller's context; nothing inside
+        # attempt() needs it
+        first = self._executor.submit(attempt, timeout)
+        done, _ = wait([first], timeout=min(self.hedge_after(), timeout))
+        if done:
+            return first.result()
+
+        metrics.inc("grocery_upstream_hedges_total", call=self.stage)
+        second = self._executor.submit(attempt, max(0.0, end - time.monotonic()))
+        pending = {first, second}
+        while pending:
+            done, pending = wait(pending, timeout=max(0.0, end - time.monotonic()), return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                if future.exception() is None:
+                    metrics.inc("grocery_upstream_hedge_wins_total", call=self.stage,
+                                winner="hedge" if future is second else "first")
+                    # Threads can't be cancelled; clean up the loser whenever it finishes
+                    for other in pending | (done - {future}):
+                        if discard is not None:
+                            other.add_done_callback(
+                                lambda f: f.exception() is None and discard(f.result()))
+                    return future.result()
+            if not pending:
+                raise next(f.exception() for f in done)
+        raise TimeoutError(f"{self.stage} attempt timed out")
+
+async def _maybe_await(value):
+    if asyncio.iscoroutine(value):
+        await value
+
+_policies = {}
+_policies_lock = threading.Lock()
+
+def get_policy(stage):
+    """Return the process-wide policy for a stage, created on first use"""
+    policy = _policies.get(stage)
+    if policy is None:
+        with _policies_lock:
+            policy = _policies.get(stage)
+            if policy is None:
+                policy = _policies[stage] = CallPolicy(stage)
+    return policy
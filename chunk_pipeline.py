@@ -0,0 +1,151 @@
+import asyncio
+import os
+import logs
+
+log = logs.get_logger("chunk_pipeline")
+
+# Per-connection pipeline: chunks are processed concurrently by a small pool of
+# workers but their results are delivered strictly in arrival order. Worker and
+# sender tasks only exist while there is work, so idle connections hold none.
+
+WS_QUEUE_SIZE = int(os.getenv("WS_QUEUE_SIZE", "8"))
+WS_WORKERS = int(os.getenv("WS_WORKERS", "3"))
+# "block" stops reading from the socket while the queue is full (the client
+# sees TCP backpressure); "drop" rejects the chunk with a busy message instead
+WS_BACKPRESSURE = os.getenv("WS_BACKPRESSURE", "block")
+
+_END = object()
+_DONE = object()
+
+class ChunkPipeline:
+    def __init__(self, process, send, workers=None, queue_size=None, backpressure=None, discard=None):
+        """
+        process: async generator function taking the chunk bytes (plus any extra
+            submit() args) and yielding messages
+        send: coroutine taking a single message dict
+        discard: optional function called with the same args for a chunk that
+            is dropped instead of processed
+        """
+        self.process = process
+        self.send = send
+        self.discard = discard
+        self.workers = workers or WS_WORKERS
+        self.backpressure = backpressure or WS_BACKPRESSURE
+        self.work_queue = asyncio.Queue(maxsize=queue_size or WS_QUEUE_SIZE)
+        # Per-chunk output queues (or end markers) in the order they must go out.
+        # The sender streams the head chunk's messages as they are produced while
+        # later chunks buffer theirs.
+        self.delivery_queue = asyncio.Queue()
+        self.next_seq = 0
+        self.tasks = set()
+        self.active_workers = 0
+        self.sender_running = False
+
+    @property
+    def idle(self):
+        """No chunk queued, in progress or waiting to be delivered"""
+        return not self.tasks and self.work_queue.empty() and self.delivery_queue.empty()
+
+    def _spawn(self, coro):
+        task = asyncio.get_running_loop().create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def _wake_sender(self):
+        if not self.sender_running:
+            self.sender_running = True
+            self._spawn(self._sender())
+
+    def _wake_workers(self):
+        while self.active_workers < self.workers and self.active_workers < self.work_queue.qsize():
+            self.active_workers += 1
+            self._spawn(self._worker())
+
+    async def submit(self, data, *args):
+        """
+        Queue a chunk for processing, applying backpressure if the queue is full.
+        Extra args are passed through to process().
+        """
+        seq = self.next_seq
+        self.next_seq += 1
+        output = asyncio.Queue()
+        # Reserve the delivery slot before any await so concurrent submitters
+        # (e.g. a coalescer timer) can't reorder chunks
+        self.delivery_queue.put_nowait((seq, output))
+        self._wake_sender()
+        if self.backpressure == "drop":
+            try:
+                self.work_queue.put_nowait((seq, (data,) + args, output))
+            except asyncio.QueueFull:
+                log.warning("Chunk queue full, dropping chunk", seq=seq)
+                output.put_nowait({"error": "Server busy, chunk dropped"})
+                output.put_nowait(_DONE)
+                if self.discard is not None:
+                    self.discard(data, *args)
+        else:
+            await self.work_queue.put((seq, (data,) + args, output))
+        self._wake_workers()
+        return seq
+
+    async def end_of_stream(self):
+        """Send the completion message once every chunk queued so far is delivered"""
+        self.delivery_queue.put_nowait((None, _END))
+        self._wake_sender()
+
+    async def _worker(self):
+        # Counted down however the worker ends, cancellation included, or
+        # _wake_workers would stop starting new ones
+        try:
+            while True:
+                try:
+                    seq, args, output = self.work_queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                try:
+                    async for message in self.process(*args):
+                        output.put_nowait(message)
+                except Exception as e:
+                    log.exception("Error processing chunk", seq=seq)
+                    output.put_nowait({"error": f"Error from server: {str(e)}"})
+                finally:
+                    output.put_nowait(_DONE)
+                    self.work_queue.task_done()
+        finally:
+            self.active_workers -= 1
+
+    async def _deliver(self, message):
+        # One failed send (e.g. a locked session store behind send) must not
+        # end the sender, or nothing after it would ever go out
+        try:
+            await self.send(message)
+        except Exception as e:
+            log.exception("Error sending message", seq=message.get("seq"))
+            try:
+                await self.send({"seq": message.get("seq"), "error": f"Error from server: {str(e)}"})
+            except Exception:
+                log.warning("Error frame not sent either", seq=message.get("seq"))
+
+    async def _sender(self):
+        try:
+            while True:
+                try:
+                    seq, output = self.delivery_queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                if output is _END:
+                    await self._deliver({"status": "completed"})
+                    continue
+                while True:
+                    message = await output.get()
+                    if message is _DONE:
+                        break
+                    await self._deliver({"seq": seq, **message})
+        finally:
+            self.sender_running = False
+
+    async def close(self):
+        tasks = list(self.tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.tasks.clear()
@@ -0,0 +1,152 @@
+import asyncio
+import base64
+import os
+import time
+from audio_utils import estimate_seconds, merge_chunks
+import logs
+
+log = logs.get_logger("coalescer")
+
+# Micro-batching of small consecutive audio chunks. Per-request overhead
+# dominates Whisper latency for short chunks, and cutting speech mid-word hurts
+# extraction, so adjacent chunks of a session are merged until they reach
+# COALESCE_MIN_SECONDS of audio (or COALESCE_MIN_BYTES), or the oldest pending
+# chunk has waited COALESCE_MAX_WAIT seconds. End of stream flushes early.
+#
+# Off by default. Merging webm/ogg chunks needs ffmpeg, and on Lambda the
+# buffer must live in a store shared by every container (a connection's
+# chunks can land on any of them; see session_store.py), otherwise chunks are
+# stranded until the next message or reordered.
+
+COALESCE_ENABLED = os.getenv("COALESCE_ENABLED", "0") == "1"
+COALESCE_MIN_SECONDS = float(os.getenv("COALESCE_MIN_SECONDS", "2.0"))
+COALESCE_MIN_BYTES = int(os.getenv("COALESCE_MIN_BYTES", "0"))  # 0 disables the size threshold
+COALESCE_MAX_WAIT = float(os.getenv("COALESCE_MAX_WAIT", "1.5"))
+
+class CoalescePolicy:
+    def __init__(self, min_seconds=None, min_bytes=None, max_wait=None):
+        self.min_seconds = COALESCE_MIN_SECONDS if min_seconds is None else min_seconds
+        self.min_bytes = COALESCE_MIN_BYTES if min_bytes is None else min_bytes
+        self.max_wait = COALESCE_MAX_WAIT if max_wait is None else max_wait
+
+    def ready(self, total_bytes, total_seconds, age):
+        return (total_seconds >= self.min_seconds
+                or (self.min_bytes and total_bytes >= self.min_bytes)
+                or age >= self.max_wait)
+
+class AsyncChunkCoalescer:
+    """
+    Per-connection coalescer for the FastAPI WebSocket endpoint.
+    emit(data, filename) is awaited for every merged upload, in order.
+    """
+
+    def __init__(self, emit, policy=None):
+        self.emit = emit
+        self.policy = policy or CoalescePolicy()
+        self.pending = []
+        self.pending_bytes = 0
+        self.pending_seconds = 0.0
+        self.first_at = None
+        self.timer = None
+        self.emit_lock = asyncio.Lock()
+
+    @property
+    def idle(self):
+        return not self.pending
+
+    async def add(self, data):
+        if not self.pending:
+            self.first_at = time.monotonic()
+        self.pending.append(data)
+        self.pending_bytes += len(data)
+        self.pending_seconds += estimate_seconds(data)
+        if self.policy.ready(self.pending_bytes, self.pending_seconds, time.monotonic() - self.first_at):
+            await self.flush()
+        elif self.timer is None:
+            self.timer = asyncio.get_running_loop().create_task(self._flush_after(self.policy.max_wait))
+
+    async def _flush_after(self, delay):
+        await asyncio.sleep(delay)
+        self.timer = None
+        await self.flush()
+
+    async def flush(self):
+        """Merge and emit whatever is pending"""
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if not self.pending:
+            return
+        chunks = self.pending
+        self.pending = []
+        self.pending_bytes = 0
+        self.pending_seconds = 0.0
+        # Hold the lock across emits so a timer flush and an inline flush
+        # can't interleave their uploads
+        async with self.emit_lock:
+            if len(chunks) > 1:
+                # Merging may shell out to ffmpeg, so keep it off the event loop
+                uploads = await asyncio.to_thread(merge_chunks, chunks)
+                log.debug("Coalesced chunks", chunks=len(chunks), uploads=len(uploads))
+            else:
+                uploads = merge_chunks(chunks)
+            for data, filename in uploads:
+                await self.emit(data, filename)
+
+    async def close(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+class StoreCoalescer:
+    """
+    Coalescer for the stateless Lambda handler: pending chunks live in a
+    session store keyed by connection id. Without timers, the max-wait check
+    happens when the next chunk (or the end-of-stream marker) arrives.
+    """
+
+    def __init__(self, store, policy=None, ttl=300):
+        self.store = store
+        self.policy = policy or CoalescePolicy()
+        self.ttl = ttl
+
+    @staticmethod
+    def _key(connection_id):
+        return f"pending-audio:{connection_id}"
+
+    @staticmethod
+    def _decode(pending):
+        return [base64.b64decode(chunk) for chunk in pending["chunks"]]
+
+    def add(self, connection_id, data):
+        """Buffer a chunk; return the merged uploads to process now ([] if still buffering)"""
+        now = time.time()
+        seconds = estimate_seconds(data)
+
+        def append(pending):
+            pending = pending or {"chunks": [], "bytes": 0, "seconds": 0.0, "first_at": now}
+            pending["chunks"].append(base64.b64encode(data).decode("ascii"))
+            pending["bytes"] += len(data)
+            pending["seconds"] += seconds
+            if self.policy.ready(pending["bytes"], pending["seconds"], now - pending["first_at"]):
+                return None, pending
+            return pending, None
+
+        ready = self.store.update(self._key(connection_id), append, ttl=self.ttl)
+        if ready is None:
+            return []
+        return self._merge(ready)
+
+    def flush(self, connection_id):
+        """Take everything pending for the connection (end of stream)"""
+        pending = self.store.update(self._key(connection_id), lambda pending: (None, pending))
+        if pending is None:
+            return []
+        return self._merge(pending)
+
+    def _merge(self, pending):
+        chunks = self._decode(pending)
+        uploads = merge_chunks(chunks)
+        if len(chunks) > 1:
+            log.debug("Coalesced chunks", chunks=len(chunks), uploads=len(uploads))
+        return uploads
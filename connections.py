@@ -0,0 +1,187 @@
+import asyncio
+import itertools
+import os
+import time
+from fastapi import WebSocket
+import fast_json
+import logs
+import metrics
+
+log = logs.get_logger("connections")
+
+# WebSocket connection registry for one worker. Connections are keyed by id,
+# and outbound messages go through a bounded per-connection queue drained by a
+# writer task, so a slow client only ever delays itself. Writer tasks (like
+# the chunk pipeline's) run only while there is something to do, and a single
+# sweeper task handles heartbeats and idle timeouts for every connection, so
+# an idle connection costs its socket, its receive loop and a small object.
+
+WS_MAX_CONNECTIONS = int(os.getenv("WS_MAX_CONNECTIONS", "5000"))
+WS_SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "64"))
+WS_SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", "10"))
+# What to do when a client can't keep up: "drop" skips item messages (status
+# and error messages still go out) and tells the client how many it missed;
+# "close" disconnects it
+WS_SLOW_CONSUMER = os.getenv("WS_SLOW_CONSUMER", "drop")
+WS_IDLE_TIMEOUT = float(os.getenv("WS_IDLE_TIMEOUT", "300"))
+WS_HEARTBEAT_INTERVAL = float(os.getenv("WS_HEARTBEAT_INTERVAL", "30"))
+# Seconds a shutting-down worker waits for sessions to finish their chunks
+WS_DRAIN_TIMEOUT = float(os.getenv("WS_DRAIN_TIMEOUT", "30"))
+
+# Close codes: 1008 policy violation (too slow), 1013 try again later (full),
+# 1001 going away (idle / shutdown), 1012 service restart (drained; reconnect)
+CLOSE_TOO_SLOW = 1008
+CLOSE_TRY_AGAIN = 1013
+CLOSE_GOING_AWAY = 1001
+CLOSE_RESTART = 1012
+
+_ids = itertools.count(1)
+
+def _droppable(message):
+    # Items can be skipped; completion, errors and notices can't
+    return "status" not in message and "error" not in message
+
+class Connection:
+    def __init__(self, websocket: WebSocket):
+        self.id = next(_ids)
+        self.websocket = websocket
+        self.queue = asyncio.Queue()
+        self.writer = None
+        # Processing stages (coalescer, chunk pipeline) with an idle property,
+        # so a drain can wait for the chunks they hold
+        self.stages = []
+        self.dropped = 0
+        self.closed = False
+        self.last_activity = time.monotonic()
+        self.last_sent = self.last_activity
+
+    def touch(self):
+        self.last_activity = time.monotonic()
+
+    @property
+    def busy(self):
+        """Chunks still being processed or messages still to send"""
+        return (not self.closed and (self.writer is not None or not self.queue.empty()
+                                     or not all(stage.idle for stage in self.stages)))
+
+    async def send(self, message):
+        """Queue a message for the client without waiting for the socket"""
+        if self.closed:
+            return
+        if self.queue.qsize() >= WS_SEND_QUEUE_SIZE and _droppable(message):
+            if WS_SLOW_CONSUMER == "close":
+                log.warning("Connection too slow, closing", connection_id=self.id)
+                await self.close(CLOSE_TOO_SLOW)
+                return
+            self.dropped += 1
+            metrics.inc("grocery_dropped_messages_total")
+            return
+        self.queue.put_nowait(message)
+        if message.get("type") != "heartbeat":
+            self.touch()
+        if self.writer is None:
+            self.writer = asyncio.get_running_loop().create_task(self._write())
+
+    async def _write(self):
+        try:
+            while not self.queue.empty():
+                message = self.queue.get_nowait()
+                with metrics.timer("grocery_stage_seconds", pipeline="websocket", stage="send"):
+                    await asyncio.wait_for(fast_json.send_json(self.websocket, message), WS_SEND_TIMEOUT)
+                self.last_sent = time.monotonic()
+                if self.dropped and self.queue.empty():
+                    dropped, self.dropped = self.dropped, 0
+                    await asyncio.wait_for(fast_json.send_json(
+                        self.websocket, {"error": f"Client too slow, {dropped} messages dropped"}), WS_SEND_TIMEOUT)
+        except asyncio.TimeoutError:
+            log.warning("Connection send timed out, closing", connection_id=self.id)
+            await self.close(CLOSE_TOO_SLOW)
+        except Exception as e:
+            log.warning("Connection send failed", connection_id=self.id, error=e)
+            self.closed = True
+        finally:
+            self.writer = None
+
+    async def close(self, code=1000):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            await self.websocket.close(code=code)
+        except Exception:
+            pass  # already gone
+
+    async def aclose(self):
+        """Stop the writer (on disconnect)"""
+        self.closed = True
+        if self.writer is not None:
+            self.writer.cancel()
+            await asyncio.gather(self.writer, return_exceptions=True)
+
+class ConnectionManager:
+    def __init__(self, max_connections=None):
+        self.max_connections = max_connections or WS_MAX_CONNECTIONS
+        self.connections = {}
+        self.sweeper = None
+        self.draining = False
+
+    def __len__(self):
+        return len(self.connections)
+
+    async def connect(self, websocket: WebSocket):
+        """Accept and register the socket; returns None if the worker is full"""
+        await websocket.accept()
+        if self.draining or len(self.connections) >= self.max_connections:
+            log.warning("Rejecting connection", open=len(self.connections), draining=self.draining)
+            await fast_json.send_json(websocket, {"error": "Server busy, too many connections"})
+            await websocket.close(code=CLOSE_TRY_AGAIN)
+            return None
+        connection = Connection(websocket)
+        self.connections[connection.id] = connection
+        if self.sweeper is None:
+            self.sweeper = asyncio.get_running_loop().create_task(self._sweep())
+        return connection
+
+    async def disconnect(self, connection):
+        self.connections.pop(connection.id, None)
+        await connection.aclose()
+
+    async def send_json(self, websocket: WebSocket, data: dict):
+        await fast_json.send_json(websocket, data)
+
+    async def _sweep(self):
+        interval = max(1.0, min(WS_HEARTBEAT_INTERVAL, WS_IDLE_TIMEOUT) / 2)
+        while True:
+            await asyncio.sleep(interval)
+            now = time.monotonic()
+            for connection in list(self.connections.values()):
+                if now - connection.last_activity >= WS_IDLE_TIMEOUT and connection.queue.empty():
+                    log.info("Connection idle, closing", connection_id=connection.id)
+                    await connection.close(CLOSE_GOING_AWAY)
+                elif now - connection.last_sent >= WS_HEARTBEAT_INTERVAL:
+                    await connection.send({"type": "heartbeat"})
+
+    async def drain(self, timeout=None):
+        """
+        Stop admitting connections, wait up to timeout seconds for open ones to
+        finish the chunks they have sent, then close them with 1012 so clients
+        reconnect (to another worker) and resync.
+        """
+        self.draining = True
+        deadline = time.monotonic() + (WS_DRAIN_TIMEOUT if timeout is None else timeout)
+        log.info("Draining connections", open=len(self.connections))
+        while time.monotonic() < deadline and any(c.busy for c in self.connections.values()):
+            await asyncio.sleep(0.1)
+        busy = sum(1 for c in self.connections.values() if c.busy)
+        if busy:
+            log.warning("Drain timed out", busy=busy)
+        for connection in list(self.connections.values()):
+            await connection.close(CLOSE_RESTART)
+
+    async def shutdown(self):
+        if self.sweeper is not None:
+            self.sweeper.cancel()
+            await asyncio.gather(self.sweeper, return_exceptions=True)
+            self.sweeper = None
+        for connection in list(self.connections.values()):
+            await connection.close(CLOSE_GOING_AWAY)
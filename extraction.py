@@ -0,0 +1,435 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import unicodedata
+import cache
+import call_policy
+import grocery_rules
+import logs
+import metrics
+import model_router
+import prompts
+from item_stream import ItemStreamParser
+
+log = logs.get_logger("extraction")
+
+# Transcript -> grocery items. The local rule extractor runs first and GPT only
+# sees the segments it couldn't parse; when every segment parses, no upstream
+# call is made at all. GPT results are cached on the normalized text, so
+# repeated phrases ("ஒரு கிலோ அரிசி", "onion half kg") are only paid for once.
+# model_router picks the chat model and decides when to escalate.
+
+# Stream the completion and yield each item as soon as its object closes
+EXTRACTION_STREAMING = os.getenv("EXTRACTION_STREAMING", "1") == "1"
+
+# Batch uploads: transcripts sharing one extraction request
+EXTRACTION_PACK_MAX = int(os.getenv("EXTRACTION_PACK_MAX", "4"))
+EXTRACTION_PACK_MAX_CHARS = int(os.getenv("EXTRACTION_PACK_MAX_CHARS", "800"))
+
+# "memory" (per process), "sqlite" (shared file, e.g. across uvicorn workers or
+# warm Lambda containers) or "none"
+EXTRACTION_CACHE_BACKEND = os.getenv("EXTRACTION_CACHE_BACKEND", "memory")
+EXTRACTION_CACHE_PATH = os.getenv("EXTRACTION_CACHE_PATH", "/tmp/grocery_extraction_cache.sqlite3")
+EXTRACTION_CACHE_SIZE = int(os.getenv("EXTRACTION_CACHE_SIZE", "2048"))
+EXTRACTION_CACHE_TTL = float(os.getenv("EXTRACTION_CACHE_TTL", "86400"))
+
+_cache = None
+_cache_created = False
+
+_WHITESPACE_RE = re.compile(r"\s+")
+_BOUNDARY_RE = re.compile(r"[,.;!?]\s*$")
+
+def get_cache():
+    """Return the process-wide extraction cache (None when disabled)"""
+    global _cache, _cache_created
+    if not _cache_created:
+        _cache = cache.create_cache(
+            EXTRACTION_CACHE_BACKEND, EXTRACTION_CACHE_SIZE, EXTRACTION_CACHE_TTL, EXTRACTION_CACHE_PATH
+        )
+        _cache_created = True
+    return _cache
+
+def cache_stats():
+    extraction_cache = get_cache()
+    return extraction_cache.stats() if extraction_cache is not None else {}
+
+def normalize_transcript(text):
+    """NFC, case-folded, with punctuation and runs of whitespace folded to single spaces"""
+    text = unicodedata.normalize("NFC", text).casefold()
+    # Tamil vowel signs are category M, so only P* (punctuation) is dropped
+    text = "".join(" " if unicodedata.category(ch).startswith("P") else ch for ch in text)
+    return _WHITESPACE_RE.sub(" ", text).strip()
+
+def _prompt_version(system_prompt, user_prompt):
+    return hashlib.sha256(f"{system_prompt}\x00{user_prompt}".encode("utf-8")).hexdigest()[:16]
+
+def cache_key(text, model, system_prompt, user_prompt):
+    raw = f"{model}\x00{_prompt_version(system_prompt, user_prompt)}\x00{normalize_transcript(text)}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+def parse_items(content):
+    """Parse the {"items": [...]} JSON object returned by the model"""
+    with metrics.timer("grocery_parse_seconds"):
+        return json.loads(content).get("items", [])
+
+def _parse_or_none(content):
+    try:
+        return parse_items(content)
+    except (ValueError, TypeError, AttributeError):
+        return None
+
+def _continues(context):
+    """True when the earlier transcript stops mid-item, so the new text may finish it"""
+    segments = grocery_rules.split_segments(context)
+    return bool(segments) and not _BOUNDARY_RE.search(context) and grocery_rules.parse_segment(segments[-1]) is None
+
+def _carried(context):
+    # The earlier transcript is only used when the new text may finish an item
+    # from it; otherwise the chunk is extracted on its own, with the default
+    # prompt and cache key
+    return context if context and _continues(context) else None
+
+def _rule_pass(transcript, context=None):
+    if not grocery_rules.RULE_EXTRACTOR_ENABLED:
+        return [], transcript
+    head = ""
+    if context:
+        # "அரை கிலோ" | "தக்காளி": the first segment goes to GPT with the context
+        segments = grocery_rules.split_segments(transcript)
+        if segments:
+            head, transcript = segments[0], ", ".join(segments[1:])
+    items, remainder = grocery_rules.extract(transcript)
+    if items:
+        log.debug("Rule extractor matched items locally", items=len(items))
+    return [item.model_dump() for item in items], ", ".join(part for part in (head, remainder) if part)
+
+def _context_prompt(user_prompt, context):
+    # Carried-over transcript of a streaming session (transcript_context.py)
+    # replaces the caller's template; the cache key covers it through the
+    # prompt text
+    return prompts.with_context(context) if context else user_prompt
+
+def _cached(text, model, system_prompt, user_prompt):
+    extraction_cache = get_cache()
+    if extraction_cache is None:
+        return None, None
+    key = cache_key(text, model, system_prompt, user_prompt)
+    return key, extraction_cache.get(key)
+
+def _store(key, items):
+    if key is not None:
+        get_cache().set(key, items)
+
+def _completion_args(text, model, system_prompt, user_prompt, temperature):
+    args = {
+        "model": model,
+        "messages": [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt.format(transcript=text)}
+        ],
+        "response_format": {"type": "json_object"},
+    }
+    if temperature is not None:
+        args["temperature"] = temperature
+    return args
+
+def _needs_escalation(model, text, items):
+    if not model_router.can_escalate(model):
+        return False
+    reason = model_router.review(text, items)
+    if reason:
+        model_router.escalated(model, reason)
+    return reason is not None
+
+def _log_usage(args, usage):
+    """Log and count the tokens an upstream call actually billed"""
+    if usage is None:
+        return
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = getattr(details, "cached_tokens", None) or 0
+    version = prompts.version_of(args["messages"][0]["content"])
+    log.info("Chat usage", model=args["model"], prompt=version, prompt_tokens=usage.prompt_tokens,
+             cached_tokens=cached, completion_tokens=usage.completion_tokens)
+    metrics.inc("grocery_tokens_total", usage.prompt_tokens, model=args["model"], kind="prompt")
+    metrics.inc("grocery_tokens_total", cached, model=args["model"], kind="cached_prompt")
+    metrics.inc("grocery_tokens_total", usage.completion_tokens, model=args["model"], kind="completion")
+
+def _complete(client, args):
+    with metrics.timer("grocery_upstream_seconds", call="chat", model=args["model"]):
+        response = call_policy.get_policy("chat").call(
+            lambda timeout: client.chat.completions.create(timeout=timeout, **args)
+        )
+    _log_usage(args, getattr(response, "usage", None))
+    return response.choices[0].message.content
+
+async def _complete_async(client, args):
+    with metrics.timer("grocery_upstream_seconds", call="chat", model=args["model"]):
+        response = await call_policy.get_policy("chat").call_async(
+            lambda timeout: client.chat.completions.create(timeout=timeout, **args)
+        )
+    _log_usage(args, getattr(response, "usage", None))
+    return response.choices[0].message.content
+
+def extract_items(client, transcript, system_prompt, user_prompt, temperature=None, context=None):
+    """
+    Blocking extraction with an OpenAI client.
+    user_prompt is a template with a {transcript} placeholder. context is the
+    earlier transcript of a streaming session; only items in transcript are
+    returned.
+    """
+    context = _carried(context)
+    items, remainder = _rule_pass(transcript, context)
+    user_prompt = _context_prompt(user_prompt, context)
+    if remainder:
+        model = model_router.choose_model(remainder)
+        key, cached = _cached(remainder, model, system_prompt, user_prompt)
+        if cached is None:
+            content = _complete(client, _completion_args(remainder, model, system_prompt, user_prompt, temperature))
+            cached = _parse_or_none(content)
+            if _needs_escalation(model, remainder, cached):
+                large = model_router.EXTRACTION_LARGE_MODEL
+                content = _complete(client, _completion_args(remainder, large, system_prompt, user_prompt, temperature))
+                cached = None
+            if cached is None:
+                cached = parse_items(content)
+            _store(key, cached)
+        items += cached
+    return items
+
+async def _extract_remainder_async(client, remainder, system_prompt, user_prompt, temperature, model=None):
+    model = model or model_router.choose_model(remainder)
+    key, cached = _cached(remainder, model, system_prompt, user_prompt)
+    if cached is None:
+        args = _completion_args(remainder, model, system_prompt, user_prompt, temperature)
+        content = await _complete_async(client, args)
+        cached = _parse_or_none(content)
+        if _needs_escalation(model, remainder, cached):
+            large = model_router.EXTRACTION_LARGE_MODEL
+            args = _completion_args(remainder, large, system_prompt, user_prompt, temperature)
+            content = await _complete_async(client, args)
+            cached = None
+        if cached is None:
+            cached = parse_items(content)
+        _store(key, cached)
+    return cached
+
+async def extract_items_async(client, transcript, system_prompt, user_prompt, temperature=None, context=None):
+    """Same as extract_items, with an AsyncOpenAI client"""
+    context = _carried(context)
+    items, remainder = _rule_pass(transcript, context)
+    user_prompt = _context_prompt(user_prompt, context)
+    if remainder:
+        items += await _extract_remainder_async(client, remainder, system_prompt, user_prompt, temperature)
+    return items
+
+def parse_packed(content, count):
+    """Item lists from a packed answer, in transcript order, or None if attribution was lost"""
+    try:
+        packed = json.loads(content).get("transcripts")
+    except (ValueError, TypeError, AttributeError):
+        return None
+    if not isinstance(packed, dict) or set(packed) != {str(n) for n in range(1, count + 1)}:
+        return None
+    results = []
+    for n in range(1, count + 1):
+        entry = packed[str(n)]
+        items = entry.get("items") if isinstance(entry, dict) else None
+        if not isinstance(items, list):
+            return None
+        results.append(items)
+    return results
+
+def _pack_groups(pending):
+    groups = [[]]
+    for entry in pending:
+        group = groups[-1]
+        size = sum(len(remainder) for _, remainder, _, _ in group)
+        if group and (len(group) >= EXTRACTION_PACK_MAX or size + len(entry[1]) > EXTRACTION_PACK_MAX_CHARS):
+            groups.append([])
+        groups[-1].append(entry)
+    return [group for group in groups if group]
+
+async def _extract_packed_async(client, group, system_prompt, user_prompt, temperature):
+    # One model for the whole request: the large one if any transcript needs it
+    models = {model for _, _, model, _ in group}
+    model = model_router.EXTRACTION_LARGE_MODEL if model_router.EXTRACTION_LARGE_MODEL in models else models.pop()
+    numbered = "\n".join(f"Transcript {n}: {remainder}" for n, (_, remainder, _, _) in enumerate(group, 1))
+    args = _completion_args(numbered, model, system_prompt, prompts.BATCH_USER_PROMPT, temperature)
+    item_lists = parse_packed(await _complete_async(client, args), len(group))
+    if item_lists is None:
+        log.warning("Packed extraction lost attribution, extracting separately", transcripts=len(group))
+        metrics.inc("grocery_extraction_unpacked_total", len(group), reason="attribution")
+        item_lists = [None] * len(group)
+
+    results = []
+    for (_, remainder, own_model, key), items in zip(group, item_lists):
+        reason = "attribution" if items is None else model_router.review(remainder, items)
+        if reason is None:
+            _store(key, items)
+        else:
+            if items is not None:
+                metrics.inc("grocery_extraction_unpacked_total", reason=reason)
+            items = await _extract_remainder_async(client, remainder, system_prompt, user_prompt, temperature,
+                                                   model=own_model)
+        results.append(items)
+    return results
+
+async def extract_batch_async(client, transcripts, system_prompt, user_prompt, temperature=None):
+    """
+    extract_items_async for several transcripts at once; returns one item
+    list per transcript. Remainders that need GPT are packed into shared
+    requests (up to EXTRACTION_PACK_MAX transcripts and EXTRACTION_PACK_MAX_CHARS
+    characters each) that answer per transcript number. A transcript whose
+    packed answer is missing or fails the router's checks is redone on its own.
+    """
+    results = []
+    pending = []
+    for index, transcript in enumerate(transcripts):
+        items, remainder = _rule_pass(transcript)
+        results.append(items)
+        if not remainder:
+            continue
+        model = model_router.choose_model(remainder)
+        key, cached = _cached(remainder, model, system_prompt, user_prompt)
+        if cached is not None:
+            items += cached
+        else:
+            pending.append((index, remainder, model, key))
+
+    async def run(group):
+        if len(group) == 1:
+            _, remainder, model, _ = group[0]
+            item_lists = [await _extract_remainder_async(client, remainder, system_prompt, user_prompt,
+                                                         temperature, model=model)]
+        else:
+            item_lists = await _extract_packed_async(client, group, system_prompt, user_prompt, temperature)
+        for (index, _, _, _), items in zip(group, item_lists):
+            results[index] += items
+
+    await asyncio.gather(*(run(group) for group in _pack_groups(pending)))
+    return results
+
+def _stream_delta(chunk):
+    if not chunk.choices:
+        return None
+    return chunk.choices[0].delta.content
+
+# The last chunk of the stream then carries the token usage
+_STREAM_OPTIONS = {"include_usage": True}
+
+def _stream_completion(client, args, parser):
+    # Covers the whole stream, until the last token has arrived
+    with metrics.timer("grocery_upstream_seconds", call="chat_stream", model=args["model"]):
+        # The policy covers opening the stream (retries and hedging happen
+        # before the first token); reads then use the attempt's timeout
+        stream = call_policy.get_policy("chat").call(
+            lambda timeout: client.chat.completions.create(stream=True, stream_options=_STREAM_OPTIONS,
+                                                           timeout=timeout, **args),
+            discard=lambda losing_stream: losing_stream.close(),
+        )
+        for chunk in stream:
+            _log_usage(args, getattr(chunk, "usage", None))
+            yield from parser.feed(_stream_delta(chunk))
+
+async def _stream_completion_async(client, args, parser):
+    with metrics.timer("grocery_upstream_seconds", call="chat_stream", model=args["model"]):
+        stream = await call_policy.get_policy("chat").call_async(
+            lambda timeout: client.chat.completions.create(stream=True, stream_options=_STREAM_OPTIONS,
+                                                           timeout=timeout, **args),
+            discard=lambda losing_stream: losing_stream.close(),
+        )
+        async for chunk in stream:
+            _log_usage(args, getattr(chunk, "usage", None))
+            for item in parser.feed(_stream_delta(chunk)):
+                yield item
+
+def stream_items(client, transcript, system_prompt, user_prompt, temperature=None, context=None):
+    """
+    Generator version of extract_items that yields each item as soon as it is
+    complete. Yields exactly the items extract_items would return, in order.
+    """
+    if not EXTRACTION_STREAMING:
+        yield from extract_items(client, transcript, system_prompt, user_prompt, temperature, context)
+        return
+
+    context = _carried(context)
+    items, remainder = _rule_pass(transcript, context)
+    user_prompt = _context_prompt(user_prompt, context)
+    yield from items
+    if not remainder:
+        return
+    model = model_router.choose_model(remainder)
+    key, cached = _cached(remainder, model, system_prompt, user_prompt)
+    if cached is not None:
+        yield from cached
+        return
+
+    # A small-model answer may still be replaced by the large model's, so its
+    # items are held until the review has passed (the router only sends it
+    # short, simple remainders); large-model items go out as they complete
+    parser = ItemStreamParser()
+    emitted = 0
+    if model_router.can_escalate(model):
+        args = _completion_args(remainder, model, system_prompt, user_prompt, temperature)
+        for _ in _stream_completion(client, args, parser):
+            pass
+        final = _parse_or_none(parser.text)
+        if not _needs_escalation(model, remainder, final):
+            _store(key, final)
+            yield from final
+            return
+        parser = ItemStreamParser()
+    args = _completion_args(remainder, model_router.EXTRACTION_LARGE_MODEL, system_prompt, user_prompt, temperature)
+    for item in _stream_completion(client, args, parser):
+        emitted += 1
+        yield item
+    # The full parse is authoritative; anything the incremental parser
+    # couldn't pick out goes out now
+    final = parse_items(parser.text)
+    _store(key, final)
+    yield from final[emitted:]
+
+async def stream_items_async(client, transcript, system_prompt, user_prompt, temperature=None, context=None):
+    """Async generator version of stream_items, with an AsyncOpenAI client"""
+    if not EXTRACTION_STREAMING:
+        for item in await extract_items_async(client, transcript, system_prompt, user_prompt, temperature, context):
+            yield item
+        return
+
+    context = _carried(context)
+    items, remainder = _rule_pass(transcript, context)
+    user_prompt = _context_prompt(user_prompt, context)
+    for item in items:
+        yield item
+    if not remainder:
+        return
+    model = model_router.choose_model(remainder)
+    key, cached = _cached(remainder, model, system_prompt, user_prompt)
+    if cached is not None:
+        for item in cached:
+            yield item
+        return
+
+    parser = ItemStreamParser()
+    emitted = 0
+    if model_router.can_escalate(model):
+        args = _completion_args(remainder, model, system_prompt, user_prompt, temperature)
+        async for _ in _stream_completion_async(client, args, parser):
+            pass
+        final = _parse_or_none(parser.text)
+        if not _needs_escalation(model, remainder, final):
+            _store(key, final)
+            for item in final:
+                yield item
+            return
+        parser = ItemStreamParser()
+    args = _completion_args(remainder, model_router.EXTRACTION_LARGE_MODEL, system_prompt, user_prompt, temperature)
+    async for item in _stream_completion_async(client, args, parser):
+        emitted += 1
+        yield item
+    final = parse_items(parser.text)
+    _store(key, final)
+    for item in final[emitted:]:
+        yield item
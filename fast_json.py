@@ -0,0 +1,33 @@
+import json
+import os
+
+# JSON encoding for responses and WebSocket frames. orjson is several times
+# faster than the stdlib for the small dicts we send per item and produces the
+# same compact UTF-8 output as Starlette's JSONResponse; without it (or with
+# FAST_JSON=0) the stdlib encoder is used.
+
+FAST_JSON = os.getenv("FAST_JSON", "1") == "1"
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+ENCODER = "orjson" if FAST_JSON and orjson is not None else "stdlib"
+
+if ENCODER == "orjson":
+    def dumps_bytes(obj):
+        return orjson.dumps(obj)
+
+    def dumps(obj):
+        return orjson.dumps(obj).decode("utf-8")
+else:
+    def dumps(obj):
+        return json.dumps(obj, ensure_ascii=False, allow_nan=False, separators=(",", ":"))
+
+    def dumps_bytes(obj):
+        return dumps(obj).encode("utf-8")
+
+async def send_json(websocket, message):
+    """websocket.send_json() with the fast encoder (still a text frame)"""
+    await websocket.send_text(dumps(message))
@@ -0,0 +1,315 @@
+import os
+import re
+import threading
+import unicodedata
+from models import GroceryItem
+
+# Deterministic fast path for simple utterances like "அரை கிலோ தக்காளி" or
+# "2 kg rice". A segment is only accepted when every word in it is understood;
+# anything else is handed back so the caller can send just that part to GPT.
+
+RULE_EXTRACTOR_ENABLED = os.getenv("RULE_EXTRACTOR_ENABLED", "1") == "1"
+
+# (tamil_name, english_name, other spellings: transliterations, English, plurals)
+LEXICON = [
+    ("அரிசி", "Rice", ["arisi", "rice"]),
+    ("வெங்காயம்", "Onion", ["vengayam", "vengaayam", "onion", "onions"]),
+    ("சின்ன வெங்காயம்", "Shallots", ["chinna vengayam", "small onion", "small onions", "shallot", "shallots"]),
+    ("தக்காளி", "Tomato", ["thakkali", "takkali", "tomato", "tomatoes"]),
+    ("மிளகாய்", "Chili", ["milagai", "milaghai", "chili", "chilli", "chilies", "chillies"]),
+    ("பச்சை மிளகாய்", "Green Chili", ["pachai milagai", "green chili", "green chilli", "green chilies", "green chillies"]),
+    ("பட்டாணி", "Peas", ["pattani", "peas"]),
+    ("கீரை", "Greens", ["keerai", "greens", "spinach"]),
+    ("பால்", "Milk", ["paal", "milk"]),
+    ("தயிர்", "Curd", ["thayir", "curd", "yogurt"]),
+    ("நெய்", "Ghee", ["nei", "ghee"]),
+    ("வெண்ணெய்", "Butter", ["vennai", "butter"]),
+    ("சர்க்கரை", "Sugar", ["sakkarai", "sarkarai", "sugar"]),
+    ("வெல்லம்", "Jaggery", ["vellam", "jaggery"]),
+    ("உப்பு", "Salt", ["uppu", "salt"]),
+    ("எண்ணெய்", "Oil", ["ennai", "ennei", "oil"]),
+    ("நல்லெண்ணெய்", "Sesame Oil", ["nallennai", "gingelly oil", "sesame oil"]),
+    ("தேங்காய் எண்ணெய்", "Coconut Oil", ["thengai ennai", "coconut oil"]),
+    ("உருளைக்கிழங்கு", "Potato", ["urulaikilangu", "urulai kizhangu", "urulaikizhangu", "potato", "potatoes"]),
+    ("கேரட்", "Carrot", ["carrot", "carrots"]),
+    ("பீன்ஸ்", "Beans", ["beans"]),
+    ("பூண்டு", "Garlic", ["poondu", "garlic"]),
+    ("இஞ்சி", "Ginger", ["inji", "ginger"]),
+    ("தேங்காய்", "Coconut", ["thengai", "thenga", "coconut", "coconuts"]),
+    ("வாழைப்பழம்", "Banana", ["vazhaipazham", "valaipalam", "banana", "bananas"]),
+    ("கத்தரிக்காய்", "Brinjal", ["kathirikai", "kathirikkai", "brinjal", "brinjals", "eggplant"]),
+    ("வெண்டைக்காய்", "Okra", ["vendakkai", "vendaikkai", "ladies finger", "okra"]),
+    ("முருங்கைக்காய்", "Drumstick", ["murungakkai", "murungaikkai", "drumstick", "drumsticks"]),
+    ("முட்டைகோஸ்", "Cabbage", ["muttaikose", "muttaikos", "cabbage"]),
+    ("எலுமிச்சை", "Lemon", ["elumichai", "lemon", "lemons"]),
+    ("முட்டை", "Egg", ["muttai", "egg", "eggs"]),
+    ("கோதுமை மாவு", "Wheat Flour", ["kothumai maavu", "godhumai maavu", "wheat flour", "atta"]),
+    ("மைதா", "Maida", ["maida", "all purpose flour"]),
+    ("ரவை", "Rava", ["ravai", "rava", "sooji", "semolina"]),
+    ("ராகி", "Ragi", ["ragi", "finger millet"]),
+    ("துவரம் பருப்பு", "Toor Dal", ["thuvaram paruppu", "toor dal", "tur dal"]),
+    ("உளுத்தம் பருப்பு", "Urad Dal", ["ulutham paruppu", "urad dal"]),
+    ("பாசிப் பருப்பு", "Moong Dal", ["pasi paruppu", "paasi paruppu", "moong dal"]),
+    ("கடலை பருப்பு", "Chana Dal", ["kadalai paruppu", "chana dal"]),
+    ("பருப்பு", "Dal", ["paruppu", "dal", "lentils"]),
+    ("கொத்தமல்லி", "Coriander", ["kothamalli", "kothamalli ilai", "coriander", "coriander leaves", "cilantro"]),
+    ("கறிவேப்பிலை", "Curry Leaves", ["karuveppilai", "kariveppilai", "curry leaves", "curry leaf"]),
+    ("புளி", "Tamarind", ["puli", "tamarind"]),
+    ("மஞ்சள் தூள்", "Turmeric Powder", ["manjal thool", "manjal podi", "turmeric powder", "turmeric"]),
+    ("மிளகாய் தூள்", "Chili Powder", ["milagai thool", "milagai podi", "chili powder", "chilli powder"]),
+    ("கடுகு", "Mustard Seeds", ["kadugu", "mustard", "mustard seeds"]),
+    ("சீரகம்", "Cumin", ["seeragam", "jeeragam", "cumin", "jeera"]),
+    ("மிளகு", "Pepper", ["milagu", "pepper", "black pepper"]),
+    ("காபி தூள்", "Coffee Powder", ["coffee thool", "coffee podi", "coffee powder"]),
+    ("டீ தூள்", "Tea Powder", ["tea thool", "tea podi", "tea powder"]),
+    ("ஆப்பிள்", "Apple", ["apple", "apples"]),
+    ("ஆரஞ்சு", "Orange", ["orange", "oranges"]),
+    ("பிரட்", "Bread", ["bread"]),
+    ("மீன்", "Fish", ["meen", "fish"]),
+    ("கோழி", "Chicken", ["kozhi", "chicken"]),
+]
+
+# Whole numbers spoken as words
+NUMBER_WORDS = {
+    "ஒன்று": 1, "ஒன்னு": 1, "ஒரு": 1, "one": 1, "onnu": 1, "oru": 1, "a": 1, "an": 1,
+    "இரண்டு": 2, "ரெண்டு": 2, "two": 2, "rendu": 2, "irandu": 2,
+    "மூன்று": 3, "மூணு": 3, "three": 3, "moonu": 3, "moondru": 3,
+    "நான்கு": 4, "நாலு": 4, "four": 4, "naalu": 4, "nangu": 4,
+    "ஐந்து": 5, "அஞ்சு": 5, "five": 5, "anju": 5, "ainthu": 5,
+    "ஆறு": 6, "six": 6, "aaru": 6,
+    "ஏழு": 7, "seven": 7, "ezhu": 7,
+    "எட்டு": 8, "eight": 8, "ettu": 8,
+    "ஒன்பது": 9, "nine": 9, "onbathu": 9,
+    "பத்து": 10, "ten": 10, "pathu": 10,
+}
+
+# Fractions that are only meaningful with a unit ("அரை கிலோ" is 500 grams)
+FRACTION_WORDS = {
+    "கால்": 0.25, "kaal": 0.25, "quarter": 0.25,
+    "அரை": 0.5, "arai": 0.5, "half": 0.5,
+    "முக்கால்": 0.75, "mukkaal": 0.75, "mukkal": 0.75,
+    "ஒன்றரை": 1.5, "ஒன்னரை": 1.5, "onnarai": 1.5, "onnara": 1.5,
+}
+
+UNIT_WORDS = {
+    "கிலோ": "kg", "kilo": "kg", "kilos": "kg", "kg": "kg", "kgs": "kg", "kilogram": "kg", "kilograms": "kg",
+    "கிராம்": "g", "gram": "g", "grams": "g", "g": "g", "gm": "g", "gms": "g",
+    "லிட்டர்": "l", "litre": "l", "litres": "l", "liter": "l", "liters": "l", "l": "l", "ltr": "l",
+    "மில்லி": "ml", "ml": "ml", "millilitre": "ml", "milliliter": "ml",
+}
+
+# Words that carry no item information ("need", "please", "of", ...)
+FILLER_WORDS = {
+    "வேண்டும்", "வேணும்", "கொடு", "கொடுங்க", "வாங்க", "வாங்கணும்",
+    "venum", "vendum", "kodunga", "vaanganum",
+    "of", "please", "need", "want", "buy", "get", "some", "i", "we",
+}
+
+# Segment separators: punctuation, "and", and their Tamil equivalents. A
+# decimal point ("1.5 kg") and the "and" of "one and a half" don't split.
+_SEPARATOR_RE = re.compile(
+    r"(?:[,;\n!?]|(?<!\d)\.|\.(?!\d))+|\s+(?:and|மற்றும்|um)\s+(?!(?:an?\s+)?(?:half|quarter)\b)",
+    re.IGNORECASE,
+)
+_TOKEN_RE = re.compile(r"\d+(?:\.\d+)?|[^\s\d]+")
+_NUMBER_RE = re.compile(r"^\d+(?:\.\d+)?$")
+_STRIP_RE = re.compile(r"[\"'“”‘’()\[\]:-]+")
+
+def _build_index():
+    index = {}
+    for tamil_name, english_name, aliases in LEXICON:
+        for name in [tamil_name, english_name] + aliases:
+            index[name.lower()] = (tamil_name, english_name)
+    return index
+
+_ITEM_INDEX = _build_index()
+_MAX_PHRASE_WORDS = max(len(key.split()) for key in _ITEM_INDEX)
+
+_stats_lock = threading.Lock()
+_stats = {
+    "transcripts": 0,       # transcripts seen by the rule extractor
+    "rule_only": 0,         # fully parsed, LLM skipped
+    "partial": 0,           # some segments parsed, remainder sent to LLM
+    "llm_only": 0,          # nothing parsed, whole transcript sent to LLM
+    "segments": 0,
+    "segments_parsed": 0,
+}
+
+def _count(**increments):
+    with _stats_lock:
+        for key, value in increments.items():
+            _stats[key] += value
+
+def get_stats():
+    """Snapshot of the hit-rate counters, plus the share of transcripts that skipped the LLM"""
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["llm_skip_rate"] = stats["rule_only"] / stats["transcripts"] if stats["transcripts"] else 0.0
+    return stats
+
+def reset_stats():
+    with _stats_lock:
+        for key in _stats:
+            _stats[key] = 0
+
+def _normalize(text):
+    return _STRIP_RE.sub(" ", unicodedata.normalize("NFC", text)).strip().lower()
+
+def _tokenize(segment):
+    # Separate digits from attached units ("2kg" -> "2", "kg")
+    return _TOKEN_RE.findall(segment)
+
+def _lookup_word(word):
+    """Look up a single word, trying the Tamil "-உம்" (and) suffix forms"""
+    if word in _ITEM_INDEX:
+        return _ITEM_INDEX[word]
+    # அரிசியும் -> அரிசி, பாலும் -> பால்
+    for suffix, replacement in (("யும்", ""), ("வும்", ""), ("ும்", "்")):
+        if word.endswith(suffix):
+            stem = word[: -len(suffix)] + replacement
+            if stem in _ITEM_INDEX:
+                return _ITEM_INDEX[stem]
+    return None
+
+def _and_fraction(tokens, i):
+    """Value and length of "and a half" / "and a quarter" at tokens[i], else (None, 0)"""
+    j = i
+    if j < len(tokens) and tokens[j] == "and":
+        j += 1
+        if j < len(tokens) and tokens[j] in ("a", "an"):
+            j += 1
+        fraction = FRACTION_WORDS.get(tokens[j]) if j < len(tokens) else None
+        if fraction is not None and fraction < 1:
+            return fraction, j + 1 - i
+    return None, 0
+
+def _classify(tokens):
+    """Turn tokens into (kind, value) pairs, or None if any token is unknown"""
+    classified = []
+    i = 0
+    while i < len(tokens):
+        # Longest lexicon phrase first so "green chili" beats "chili"
+        for size in range(min(_MAX_PHRASE_WORDS, len(tokens) - i), 0, -1):
+            phrase = " ".join(tokens[i:i + size])
+            item = _ITEM_INDEX.get(phrase) if size > 1 else _lookup_word(phrase)
+            if item:
+                classified.append(("item", item))
+                i += size
+                break
+        else:
+            token = tokens[i]
+            if _NUMBER_RE.match(token) or token in NUMBER_WORDS:
+                value = float(token) if _NUMBER_RE.match(token) else float(NUMBER_WORDS[token])
+                # "one and a half kg" is a single amount
+                fraction, size = _and_fraction(tokens, i + 1)
+                classified.append(("number", value + (fraction or 0)))
+                i += size
+            elif token in FRACTION_WORDS:
+                classified.append(("fraction", FRACTION_WORDS[token]))
+            elif token in UNIT_WORDS:
+                classified.append(("unit", UNIT_WORDS[token]))
+            elif token in FILLER_WORDS:
+                pass
+            else:
+                return None
+            i += 1
+    return classified
+
+def _format_number(value):
+    return str(int(value)) if value == int(value) else f"{value:g}"
+
+def _format_weight(amount, unit):
+    if unit == "kg":
+        if amount < 1:
+            return f"{_format_number(amount * 1000)} grams"
+        return f"{_format_number(amount)} kg"
+    if unit == "g":
+        return f"{_format_number(amount)} grams"
+    if unit == "l":
+        if amount < 1:
+            return f"{_format_number(amount * 1000)} ml"
+        return f"{_format_number(amount)} litre" if amount == 1 else f"{_format_number(amount)} litres"
+    return f"{_format_number(amount)} ml"
+
+def parse_segment(segment):
+    """Parse one segment into a GroceryItem, or return None if it isn't fully understood"""
+    classified = _classify(_tokenize(_normalize(segment)))
+    if not classified:
+        return None
+
+    item = None
+    weight = None
+    quantity = None
+    i = 0
+    while i < len(classified):
+        kind, value = classified[i]
+        next_kind = classified[i + 1][0] if i + 1 < len(classified) else None
+        if kind == "item":
+            if item is not None:
+                return None  # two items in one segment, let GPT split them
+            item = value
+        elif kind in ("number", "fraction") and next_kind == "unit":
+            if weight is not None or value <= 0:
+                return None
+            weight = _format_weight(value, classified[i + 1][1])
+            i += 1
+        elif kind == "number":
+            # A bare number is a count ("அரை கிலோ ரெண்டு" -> quantity 2)
+            if quantity is not None or value != int(value) or value <= 0:
+                return None
+            quantity = int(value)
+        else:
+            # A fraction or unit on its own is ambiguous
+            return None
+        i += 1
+
+    if item is None:
+        return None
+    tamil_name, english_name = item
+    return GroceryItem(tamil_name=tamil_name, english_name=english_name, weight=weight or "", quantity=quantity)
+
+def canonical_name(name):
+    """English name for a known item in any spelling ("thakkali" -> "Tomato"), else None"""
+    item = _lookup_word(_normalize(name or ""))
+    return item[1] if item else None
+
+def parse_weight(text):
+    """(amount, unit) in grams or ml for weights like "அரை கிலோ" or "1.5 litres", else None"""
+    classified = _classify(_tokenize(_normalize(text or "")))
+    if not classified or len(classified) != 2 or classified[0][0] not in ("number", "fraction") or classified[1][0] != "unit":
+        return None
+    amount, unit = classified[0][1], classified[1][1]
+    if amount <= 0:
+        return None
+    if unit in ("kg", "l"):
+        amount *= 1000
+    return amount, "g" if unit in ("kg", "g") else "ml"
+
+def split_segments(transcript):
+    return [segment.strip() for segment in _SEPARATOR_RE.split(transcript or "") if segment and segment.strip()]
+
+def extract(transcript):
+    """
+    Extract what we can locally.
+    Returns (items, remainder) where remainder is the text of the segments that
+    could not be parsed and still need the LLM ("" when the LLM can be skipped).
+    """
+    segments = split_segments(transcript)
+    items = []
+    unparsed = []
+    for segment in segments:
+        item = parse_segment(segment)
+        if item is None:
+            unparsed.append(segment)
+        else:
+            items.append(item)
+
+    _count(
+        transcripts=1,
+        segments=len(segments),
+        segments_parsed=len(items),
+        rule_only=1 if segments and not unparsed else 0,
+        partial=1 if items and unparsed else 0,
+        llm_only=1 if not items else 0,
+    )
+    return items, ", ".join(unparsed)
@@ -0,0 +1,69 @@
+import json
+
+# Incremental parser for the {"items": [{...}, {...}]} object the extraction
+# prompt asks for. Feed it the streamed completion text and it returns each
+# item object as soon as its closing brace arrives.
+
+class ItemStreamParser:
+    def __init__(self, key="items"):
+        self.key = key
+        self.text = ""
+        self.pos = 0
+        self.stack = []          # open containers: "{" or "["
+        self.in_string = False
+        self.escape = False
+        self.string_start = None
+        self.last_string = None  # most recent complete string
+        self.current_key = None  # most recent object key (string followed by ":")
+        self.array_key = {}      # stack depth of an open array -> its key
+        self.item_start = None
+        self.items_seen = 0
+
+    def _in_items_array(self):
+        return (len(self.stack) == 2 and self.stack[0] == "{" and self.stack[1] == "["
+                and self.array_key.get(2) == self.key)
+
+    def feed(self, chunk):
+        """Consume more text; return the list of item dicts completed by it"""
+        completed = []
+        if not chunk:
+            return completed
+        self.text += chunk
+        text = self.text
+        i = self.pos
+        while i < len(text):
+            ch = text[i]
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == "\\":
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+                    self.last_string = text[self.string_start + 1:i]
+            elif ch == '"':
+                self.in_string = True
+                self.string_start = i
+            elif ch == ":":
+                self.current_key = self.last_string
+            elif ch == "{":
+                if self._in_items_array():
+                    self.item_start = i
+                self.stack.append("{")
+            elif ch == "[":
+                self.stack.append("[")
+                self.array_key[len(self.stack)] = self.current_key if len(self.stack) == 2 else None
+            elif ch in "}]":
+                if self.stack:
+                    self.array_key.pop(len(self.stack), None)
+                    self.stack.pop()
+                if ch == "}" and self.item_start is not None and self._in_items_array():
+                    try:
+                        completed.append(json.loads(text[self.item_start:i + 1]))
+                        self.items_seen += 1
+                    except ValueError:
+                        pass  # leave it to the final full parse
+                    self.item_start = None
+            i += 1
+        self.pos = i
+        return completed
@@ -0,0 +1,221 @@
+import itertools
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+import logs
+
+log = logs.get_logger("job_queue")
+
+# Audio jobs between the Lambda ingest handler and the worker handler
+# (LAMBDA_PROCESSING=queue). The interface is shaped after an SQS FIFO queue,
+# with the connection id as the message group:
+#   send(group, body, dedup_id=None) -> message id
+#   receive(max_messages=10, visibility_timeout=None) -> [message]
+#       message = {"id", "receipt", "group", "body", "receives"}; received
+#       messages are hidden for visibility_timeout seconds unless deleted
+#   delete(receipt)
+#   release(receipt)
+#       makes a received message visible again at once, for a retry
+#
+# Per-group order: a group's messages are only handed out while none of them
+# is in flight, and in send order, so one connection's chunks are never
+# processed out of order or concurrently. Other groups aren't held up.
+#
+# MemoryQueue only works within one process (local testing); SqliteQueue is
+# the local stand-in shared by several processes; SqsQueue is a FIFO queue in
+# production, normally consumed through a Lambda event source mapping. Bodies
+# are JSON-serialisable dicts.
+
+JOB_QUEUE_BACKEND = os.getenv("JOB_QUEUE_BACKEND", "memory")
+JOB_QUEUE_PATH = os.getenv("JOB_QUEUE_PATH", "/tmp/grocery_jobs.sqlite3")
+# URL of an SQS FIFO queue (name ending in .fifo)
+JOB_QUEUE_URL = os.getenv("JOB_QUEUE_URL")
+# Seconds a received job stays hidden; must exceed the worker's processing time
+JOB_VISIBILITY_TIMEOUT = float(os.getenv("JOB_VISIBILITY_TIMEOUT", "120"))
+# Receives before a job is dropped (SQS: set maxReceiveCount on the queue's
+# redrive policy instead)
+JOB_MAX_RECEIVES = int(os.getenv("JOB_MAX_RECEIVES", "3"))
+# SQS rejects larger messages
+JOB_MAX_BODY_BYTES = 256 * 1024
+
+def body_size(body):
+    return len(json.dumps(body).encode("utf-8"))
+
+def _receipt(message_id):
+    return f"{message_id}:{uuid.uuid4().hex}"
+
+class MemoryQueue:
+    def __init__(self, visibility_timeout=JOB_VISIBILITY_TIMEOUT, max_receives=JOB_MAX_RECEIVES):
+        self.visibility_timeout = visibility_timeout
+        self.max_receives = max_receives
+        self._messages = []  # send order
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def send(self, group, body, dedup_id=None):
+        with self._lock:
+            message_id = str(next(self._ids))
+            self._messages.append({"id": message_id, "group": group, "body": json.dumps(body),
+                                   "visible_at": 0.0, "receipt": None, "receives": 0})
+            return message_id
+
+    def receive(self, max_messages=10, visibility_timeout=None):
+        timeout = self.visibility_timeout if visibility_timeout is None else visibility_timeout
+        with self._lock:
+            now = time.time()
+            in_flight = {m["group"] for m in self._messages if m["visible_at"] > now}
+            received = []
+            for message in list(self._messages):
+                if len(received) == max_messages:
+                    break
+                if message["group"] in in_flight:
+                    continue
+                if message["receives"] >= self.max_receives:
+                    log.warning("Dropping job after repeated failures", job=message["id"],
+                                group=message["group"], receives=message["receives"])
+                    self._messages.remove(message)
+                    continue
+                message["receives"] += 1
+                message["visible_at"] = now + timeout
+                message["receipt"] = _receipt(message["id"])
+                received.append({"id": message["id"], "receipt": message["receipt"], "group": message["group"],
+                                 "body": json.loads(message["body"]), "receives": message["receives"]})
+            return received
+
+    def delete(self, receipt):
+        with self._lock:
+            self._messages = [m for m in self._messages if m["receipt"] != receipt]
+
+    def release(self, receipt):
+        with self._lock:
+            for message in self._messages:
+                if message["receipt"] == receipt:
+                    message["visible_at"] = 0.0
+
+class SqliteQueue:
+    def __init__(self, path=JOB_QUEUE_PATH, visibility_timeout=JOB_VISIBILITY_TIMEOUT,
+                 max_receives=JOB_MAX_RECEIVES):
+        self.path = path
+        self.visibility_timeout = visibility_timeout
+        self.max_receives = max_receives
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=10, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs (id INTEGER PRIMARY KEY AUTOINCREMENT, grp TEXT NOT NULL, "
+            "body TEXT NOT NULL, visible_at REAL NOT NULL DEFAULT 0, receipt TEXT, "
+            "receives INTEGER NOT NULL DEFAULT 0)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_grp ON jobs (grp, visible_at)")
+
+    def send(self, group, body, dedup_id=None):
+        with self._lock:
+            cursor = self._conn.execute("INSERT INTO jobs (grp, body) VALUES (?, ?)", (group, json.dumps(body)))
+            return str(cursor.lastrowid)
+
+    def receive(self, max_messages=10, visibility_timeout=None):
+        timeout = self.visibility_timeout if visibility_timeout is None else visibility_timeout
+        with self._lock:
+            # IMMEDIATE so two workers can't take the same jobs
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                dead = self._conn.execute(
+                    "SELECT id, grp, receives FROM jobs WHERE receives >= ? AND visible_at <= ?",
+                    (self.max_receives, now),
+                ).fetchall()
+                for message_id, group, receives in dead:
+                    log.warning("Dropping job after repeated failures", job=str(message_id), group=group,
+                                receives=receives)
+                    self._conn.execute("DELETE FROM jobs WHERE id = ?", (message_id,))
+                rows = self._conn.execute(
+                    "SELECT id, grp, body, receives FROM jobs "
+                    "WHERE grp NOT IN (SELECT grp FROM jobs WHERE visible_at > ?) ORDER BY id LIMIT ?",
+                    (now, max_messages),
+                ).fetchall()
+                received = []
+                for message_id, group, body, receives in rows:
+                    receipt = _receipt(message_id)
+                    self._conn.execute(
+                        "UPDATE jobs SET visible_at = ?, receipt = ?, receives = receives + 1 WHERE id = ?",
+                        (now + timeout, receipt, message_id),
+                    )
+                    received.append({"id": str(message_id), "receipt": receipt, "group": group,
+                                     "body": json.loads(body), "receives": receives + 1})
+                self._conn.execute("COMMIT")
+                return received
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def delete(self, receipt):
+        with self._lock:
+            self._conn.execute("DELETE FROM jobs WHERE receipt = ?", (receipt,))
+
+    def release(self, receipt):
+        with self._lock:
+            self._conn.execute("UPDATE jobs SET visible_at = 0 WHERE receipt = ?", (receipt,))
+
+class SqsQueue:
+    """
+    SQS FIFO queue. The worker is normally invoked by a Lambda event source
+    mapping (see message_from_record); receive() is for polling consumers.
+    """
+
+    def __init__(self, url=JOB_QUEUE_URL, visibility_timeout=JOB_VISIBILITY_TIMEOUT):
+        import boto3
+        if not url:
+            raise ValueError("JOB_QUEUE_URL environment variable not set")
+        self.url = url
+        self.visibility_timeout = visibility_timeout
+        self.client = boto3.client("sqs")
+
+    def send(self, group, body, dedup_id=None):
+        response = self.client.send_message(
+            QueueUrl=self.url, MessageBody=json.dumps(body), MessageGroupId=group,
+            MessageDeduplicationId=dedup_id or uuid.uuid4().hex,
+        )
+        return response["MessageId"]
+
+    def receive(self, max_messages=10, visibility_timeout=None):
+        timeout = self.visibility_timeout if visibility_timeout is None else visibility_timeout
+        response = self.client.receive_message(
+            QueueUrl=self.url, MaxNumberOfMessages=min(max_messages, 10), VisibilityTimeout=int(timeout),
+            AttributeNames=["MessageGroupId", "ApproximateReceiveCount"],
+        )
+        return [{"id": m["MessageId"], "receipt": m["ReceiptHandle"], "group": m["Attributes"]["MessageGroupId"],
+                 "body": json.loads(m["Body"]), "receives": int(m["Attributes"]["ApproximateReceiveCount"])}
+                for m in response.get("Messages", [])]
+
+    def delete(self, receipt):
+        self.client.delete_message(QueueUrl=self.url, ReceiptHandle=receipt)
+
+    def release(self, receipt):
+        self.client.change_message_visibility(QueueUrl=self.url, ReceiptHandle=receipt, VisibilityTimeout=0)
+
+def message_from_record(record):
+    """The message in one record of an SQS event delivered to a Lambda function"""
+    attributes = record.get("attributes", {})
+    return {"id": record["messageId"], "receipt": record["receiptHandle"],
+            "group": attributes.get("MessageGroupId"), "body": json.loads(record["body"]),
+            "receives": int(attributes.get("ApproximateReceiveCount", 1))}
+
+def create_queue(backend=None, path=None, url=None):
+    backend = backend or JOB_QUEUE_BACKEND
+    if backend == "sqlite":
+        return SqliteQueue(path or JOB_QUEUE_PATH)
+    if backend == "sqs":
+        return SqsQueue(url or JOB_QUEUE_URL)
+    return MemoryQueue()
+
+_queue = None
+
+def get_queue():
+    """Return the process-wide job queue, created on first use"""
+    global _queue
+    if _queue is None:
+        _queue = create_queue()
+    return _queue
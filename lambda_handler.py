@@ -1,78 +1,198 @@
 import json
 import os
 import base64
-import boto3
-import tempfile
-import openai
+import time
+from collections import OrderedDict
+import fast_json
+import logs
+import prompts
+
+# "item" (default) sends each item as its own frame the moment it is
+# extracted, the original format; "batch" sends all items of a chunk (or of an
+# ITEM_BATCH_WINDOW) in one {"type": "items"} frame, for clients that opt in
+ITEM_FRAMING = os.getenv("ITEM_FRAMING", "item")
+# Seconds; 0 batches the whole chunk into a single frame
+ITEM_BATCH_WINDOW = float(os.getenv("ITEM_BATCH_WINDOW", "0"))
+GONE_CONNECTIONS_MAX = 1024
+
+# Only the audio route needs boto3/openai/pydantic. Deferring those imports keeps
+# $connect and $disconnect cold starts cheap; set to 0 to load everything at init
+# (e.g. with provisioned concurrency, where init time is free)
+LAMBDA_LAZY_IMPORTS = os.getenv("LAMBDA_LAZY_IMPORTS", "1") == "1"
+# Overrides https://{domain}/{stage} for the management API, e.g. for local testing
+GATEWAY_ENDPOINT_URL = os.getenv("GATEWAY_ENDPOINT_URL")
+# Seconds of the invocation kept back so errors can still reach the client
+# before Lambda times out
+LAMBDA_DEADLINE_MARGIN = float(os.getenv("LAMBDA_DEADLINE_MARGIN", "2"))
+# "sync" processes audio inside the $default invocation; "queue" stores it as a
+# job (job_queue.py) and acks at once, and worker_handler does the processing
+LAMBDA_PROCESSING = os.getenv("LAMBDA_PROCESSING", "sync")
+# Jobs per receive when worker_handler polls the queue itself
+WORKER_BATCH_SIZE = int(os.getenv("WORKER_BATCH_SIZE", "10"))
+# Seconds of invocation a polling worker needs left to take another batch
+WORKER_MIN_REMAINING = float(os.getenv("WORKER_MIN_REMAINING", "30"))
+
+# Shared with the FastAPI app; see prompts.py
+SYSTEM_PROMPT, USER_PROMPT = prompts.get_prompts()
+
+log = logs.get_logger("lambda")
+
+# Module-level so warm containers reuse clients and remember closed connections
+_gateway_clients = {}
+_gone_connections = OrderedDict()
+_openai_client = None
+_coalescer = None
+_job_queue = None
+_part_assembler = None
+_session_list = None
+_transcript_context = None
+# time.monotonic() by which upstream calls must be done; set per invocation
+_invocation_deadline = None
+
+# Filled in by _load_audio_dependencies()
+transcribe = None
+stream_items = None
+call_budget = None
+
+def _load_audio_dependencies():
+    global transcribe, stream_items, call_budget
+    if stream_items is None:
+        from transcription import transcribe as _transcribe
+        from extraction import stream_items as _stream_items
+        from call_policy import budget as _budget
+        transcribe = _transcribe
+        stream_items = _stream_items
+        call_budget = _budget
+
+def get_openai_client():
+    """Return the container-wide OpenAI client, created on first audio message"""
+    global _openai_client
+    if _openai_client is None:
+        if not os.getenv("OPENAI_API_KEY"):
+            log.error("OPENAI_API_KEY environment variable not set")
+            raise ValueError("OPENAI_API_KEY environment variable not set")
+        log.info("Initializing OpenAI client")
+        import openai_client
+        _openai_client = openai_client.get_sync_client()
+    return _openai_client
 
 def handler(event, context):
-    # Log the event for debugging
-    print(f"Received event: {json.dumps(event)}")
+    request_context = event.get('requestContext', {})
+    # Every record of this invocation carries the request and connection ids
+    with logs.scope(request_id=getattr(context, "aws_request_id", None),
+                    connection=request_context.get('connectionId')):
+        return _handle(event, context, request_context)
+
+def _set_deadline(context):
+    global _invocation_deadline
+    # Upstream calls must finish before Lambda kills the invocation
+    if context is not None and hasattr(context, "get_remaining_time_in_millis"):
+        _invocation_deadline = time.monotonic() + context.get_remaining_time_in_millis() / 1000 - LAMBDA_DEADLINE_MARGIN
+    else:
+        _invocation_deadline = None
+
+def _remaining():
+    """Seconds left before the invocation deadline, or None without one"""
+    if _invocation_deadline is None:
+        return None
+    return _invocation_deadline - time.monotonic()
+
+def _handle(event, context, request_context):
+    # The body is logged as its size and hash, never as audio
+    log.info("Received event", route=request_context.get('routeKey'),
+             base64=event.get('isBase64Encoded', False), body=event.get('body'))
+    _set_deadline(context)
     
     # Get connection ID
-    connection_id = event.get('requestContext', {}).get('connectionId')
+    connection_id = request_context.get('connectionId')
     if not connection_id:
         return {'statusCode': 400, 'body': json.dumps({'error': 'ConnectionId not found'})}
     
     # Handle different route types
-    route_key = event.get('requestContext', {}).get('routeKey')
+    route_key = request_context.get('routeKey')
     
     if route_key == '$connect':
-        return handle_connect(event)
+        return handle_connect(event, connection_id)
     elif route_key == '$disconnect':
-        return handle_disconnect(event)
+        return handle_disconnect(event, connection_id)
     else:  # $default or any other route
         try:
             return handle_default_message(event, connection_id)
         except Exception as e:
             # Log the error but return a 200 to keep the connection alive
-            print(f"Error in handle_default_message: {str(e)}")
+            log.exception("Error in handle_default_message")
             return {'statusCode': 200, 'body': json.dumps({'error': str(e)})}
 
-def handle_connect(event):
+def handle_connect(event, connection_id):
     # Handle new connection
-    print("New connection established")
+    log.info("New connection established")
+    # Clients connecting with ?session=<id> get a server-side list (session_list.py)
+    session_id = (event.get('queryStringParameters') or {}).get('session')
+    if session_id is not None:
+        import session_list
+        import session_store
+        if not session_list.valid_session_id(session_id):
+            return {'statusCode': 400, 'body': json.dumps({'error': 'Invalid session id'})}
+        if session_store.container_local():
+            # Later invocations on other containers wouldn't see the binding,
+            # and the list would be split between containers
+            log.error("Session lists need a shared session store (SESSION_STORE_BACKEND=dynamodb)")
+            return {'statusCode': 400, 'body': json.dumps({'error': 'Session lists are not enabled on this server'})}
+        get_session_list().bind(connection_id, session_id)
     return {'statusCode': 200, 'body': json.dumps({'message': 'Connected'})}
 
-def handle_disconnect(event):
+def handle_disconnect(event, connection_id):
     # Handle disconnection
-    print("Connection closed")
+    log.info("Connection closed")
+    context = get_transcript_context()
+    if context:
+        context.clear(connection_id)
     return {'statusCode': 200, 'body': json.dumps({'message': 'Disconnected'})}
 
 def handle_default_message(event, connection_id):
     # Set up API Gateway Management API client to send messages back
     domain = event['requestContext']['domainName']
     stage = event['requestContext']['stage']
-    print(f"Using endpoint URL: https://{domain}/{stage}")
+    log.debug("Using endpoint URL", url=f"https://{domain}/{stage}")
     
     # For binary messages (audio data) directly from API Gateway
     if event.get('isBase64Encoded', False):
-        print(f"Processing base64 encoded message from API Gateway for connection {connection_id}")
+        log.debug("Processing base64 encoded message from API Gateway")
         body = event.get('body', '')
         # Decode base64 data
         audio_data = base64.b64decode(body)
-        print(f"Decoded audio data of size: {len(audio_data)} bytes")
+        log.debug("Decoded audio data", bytes=len(audio_data))
+        
+        # One part of a chunked utterance upload (see upload_parts.py)
+        import upload_parts
+        if upload_parts.is_frame(audio_data):
+            return handle_part(audio_data, connection_id, domain, stage)
+        
+        # A single 255 byte is the binary end-of-stream marker
+        if audio_data == b'\xff':
+            return handle_end_of_stream(connection_id, domain, stage)
         
         try:
-            # Process the audio data
-            process_audio_lambda(audio_data, connection_id, domain, stage)
-            return {'statusCode': 200, 'body': json.dumps({'message': 'Processing audio'})}
+            # Process the audio data (or buffer it until enough has arrived)
+            processed = handle_audio(audio_data, connection_id, domain, stage)
+            return {'statusCode': 200, 'body': json.dumps({'message': 'Processing audio' if processed else 'Audio buffered'})}
         except Exception as e:
-            print(f"Error processing audio: {str(e)}")
+            log.exception("Error processing audio")
             error_message = {'error': f"Error processing audio: {str(e)}"}
             try:
                 send_message(connection_id, domain, stage, error_message)
             except Exception as send_error:
-                print(f"Failed to send error message: {str(send_error)}")
+                log.warning("Failed to send error message", error=send_error)
             # Still return 200 to keep connection alive
             return {'statusCode': 200, 'body': json.dumps({'error': str(e)})}
     else:
         # For text/JSON messages from our frontend
-        print(f"Processing text/JSON message for connection {connection_id}")
+        log.debug("Processing text/JSON message")
         try:
             body = event.get('body', '{}')
             json_data = json.loads(body)
-            print(f"Received JSON message: {json_data}")
+            # Redacts "data", which carries base64 audio
+            log.debug("Received JSON message", message=json_data)
             
             # Check for action field (used by API Gateway route selection)
             # or type field (used in our frontend)
@@ -81,50 +201,52 @@ def handle_default_message(event, connection_id):
             # Check if it's our audio data in JSON format
             if (message_type == 'audio' and 
                 (json_data.get('data') or json_data.get('data') == '')):
-                print(f"Found base64 audio data in JSON message")
+                log.debug("Found base64 audio data in JSON message")
                 try:
                     # Extract base64 data and decode
                     audio_data = base64.b64decode(json_data.get('data', ''))
-                    print(f"Decoded audio data from JSON: {len(audio_data)} bytes")
+                    log.debug("Decoded audio data from JSON", bytes=len(audio_data))
                     
                     if len(audio_data) < 100:
-                        print(f"Audio data too small, skipping: {len(audio_data)} bytes")
+                        log.info("Audio data too small, skipping", bytes=len(audio_data))
                         return {'statusCode': 200, 'body': json.dumps({'message': 'Audio data too small'})}
                     
-                    # Process the audio data
-                    process_audio_lambda(audio_data, connection_id, domain, stage)
-                    return {'statusCode': 200, 'body': json.dumps({'message': 'Processing audio from JSON'})}
+                    # Process the audio data (or buffer it until enough has arrived)
+                    processed = handle_audio(audio_data, connection_id, domain, stage)
+                    return {'statusCode': 200, 'body': json.dumps({'message': 'Processing audio from JSON' if processed else 'Audio buffered'})}
                 except Exception as e:
-                    print(f"Error processing audio JSON: {str(e)}")
+                    log.exception("Error processing audio JSON")
                     # Return 200 to keep connection alive
                     return {'statusCode': 200, 'body': json.dumps({'error': str(e)})}
                     
+            elif message_type == 'part':
+                # Same part as a binary frame, for clients that can only send text
+                return handle_part(json_data, connection_id, domain, stage)
+                
+            elif message_type == 'sync' or message_type == 'remove':
+                return handle_list_message(json_data, connection_id, domain, stage)
+                
             elif message_type == 'end' or message_type == 'stop':
                 # This is our end-of-stream marker
-                print(f"Received end-of-stream marker")
-                try:
-                    send_message(connection_id, domain, stage, {"status": "completed"})
-                except Exception as send_error:
-                    print(f"Failed to send completion message: {str(send_error)}")
-                return {'statusCode': 200, 'body': json.dumps({'message': 'End of stream received'})}
+                return handle_end_of_stream(connection_id, domain, stage)
             
             elif message_type == 'test':
                 # Test message for debugging
-                print(f"Received test message: {json_data.get('message', '')}")
+                log.info("Received test message", message=json_data.get('message', ''))
                 try:
                     send_message(connection_id, domain, stage, {"status": "test_received", "message": "Test successful"})
                 except Exception as send_error:
-                    print(f"Failed to send test response: {str(send_error)}")
+                    log.warning("Failed to send test response", error=send_error)
                 return {'statusCode': 200, 'body': json.dumps({'message': 'Test message received'})}
                 
             else:
                 # Some other JSON message
-                print(f"Received other JSON message: {json_data}")
+                log.info("Received other JSON message", message=json_data)
                 return {'statusCode': 200, 'body': json.dumps({'message': 'Received JSON message'})}
                 
         except json.JSONDecodeError as json_error:
             # Not JSON, maybe binary data without isBase64Encoded flag
-            print(f"Message is not JSON: {str(json_error)}")
+            log.debug("Message is not JSON", error=json_error)
             try:
                 # Try to decode as base64 anyway
                 body = event.get('body', '')
@@ -132,159 +254,409 @@ def handle_default_message(event, connection_id):
                     return {'statusCode': 200, 'body': json.dumps({'message': 'Empty body received'})}
                     
                 audio_data = base64.b64decode(body)
-                print(f"Managed to decode as base64: {len(audio_data)} bytes")
+                log.debug("Managed to decode as base64", bytes=len(audio_data))
                 
-                # Process the audio data
-                process_audio_lambda(audio_data, connection_id, domain, stage)
+                # Process the audio data (or buffer it until enough has arrived)
+                handle_audio(audio_data, connection_id, domain, stage)
                 return {'statusCode': 200, 'body': json.dumps({'message': 'Processing potential audio data'})}
             except Exception as base64_error:
                 # Not base64 either
-                print(f"Received non-binary, non-JSON data: {body[:100]}...")
+                log.warning("Received non-binary, non-JSON data", body=body)
                 # Still return 200 to keep connection alive
                 return {'statusCode': 200, 'body': json.dumps({'message': 'Unrecognized message format'})}
 
-def process_audio_lambda(audio_data, connection_id, domain, stage):
+def get_coalescer():
+    """Return the container-wide chunk coalescer, or None when coalescing is disabled"""
+    global _coalescer
+    if _coalescer is None:
+        import coalescer
+        import session_store
+        if not coalescer.COALESCE_ENABLED:
+            return None
+        _coalescer = coalescer.StoreCoalescer(session_store.get_store())
+    return _coalescer
+
+def get_session_list():
+    """Return the container-wide session list over the shared session store"""
+    global _session_list
+    if _session_list is None:
+        import session_list
+        import session_store
+        _session_list = session_list.SessionList(session_store.get_store())
+    return _session_list
+
+def get_transcript_context():
+    """Return the container-wide rolling transcript context, or None when it is disabled"""
+    global _transcript_context
+    if _transcript_context is None:
+        import session_store
+        import transcript_context
+        if not transcript_context.TRANSCRIPT_CONTEXT:
+            return None
+        if session_store.container_local():
+            # Another container's chunks would see a stale or missing tail
+            log.error("Transcript context needs a shared session store (SESSION_STORE_BACKEND=dynamodb)")
+            _transcript_context = False
+        else:
+            _transcript_context = transcript_context.StoreContext(session_store.get_store())
+    return _transcript_context or None
+
+def handle_list_message(message, connection_id, domain, stage):
+    """{"type": "sync", "version": n} or {"type": "remove", "id": n} for the connection's session list"""
+    session_id = get_session_list().session_of(connection_id)
+    if session_id is None:
+        send_message(connection_id, domain, stage, {'error': 'No session list; connect with ?session=<id>'})
+        return {'statusCode': 200, 'body': json.dumps({'error': 'No session list'})}
+    try:
+        if message.get('action', message.get('type')) == 'sync':
+            version = message.get('version')
+            reply = get_session_list().sync(session_id, None if version is None else int(version))
+        else:
+            reply = get_session_list().remove(session_id, int(message['id']))
+    except (KeyError, TypeError, ValueError) as e:
+        send_message(connection_id, domain, stage, {'error': f"Invalid list message: {str(e)}"})
+        return {'statusCode': 200, 'body': json.dumps({'error': str(e)})}
+    if reply is not None:
+        send_message(connection_id, domain, stage, reply)
+    return {'statusCode': 200, 'body': json.dumps({'message': 'List updated'})}
+
+def get_part_assembler():
+    """Return the container-wide assembler for chunked utterance uploads"""
+    global _part_assembler
+    if _part_assembler is None:
+        import upload_parts
+        import session_store
+        _part_assembler = upload_parts.PartAssembler(session_store.get_store())
+    return _part_assembler
+
+def handle_part(message, connection_id, domain, stage):
+    """
+    Store one part of a chunked upload, given as a binary frame or a JSON
+    message. Whichever invocation receives the last part processes the
+    utterance; complete utterances skip the coalescer.
+    """
+    import session_store
+    import upload_parts
+    try:
+        if isinstance(message, dict):
+            part = upload_parts.parse_json_part(message)
+        else:
+            part = upload_parts.parse_frame(message)
+        if part["total"] > 1 and session_store.container_local():
+            # Parts landing on other containers would never be assembled
+            log.error("Multi-part uploads need a shared session store (SESSION_STORE_BACKEND=dynamodb)")
+            raise upload_parts.PartError("Multi-part uploads are not enabled on this server")
+        ready = get_part_assembler().add(connection_id, part)
+    except upload_parts.PartError as e:
+        log.warning("Rejected upload part", error=e)
+        send_message(connection_id, domain, stage, {"error": str(e)})
+        return {'statusCode': 200, 'body': json.dumps({'error': str(e)})}
+    log.debug("Stored upload part", utterance=part["utterance"], seq=part["seq"],
+              total=part["total"], bytes=len(part["payload"]))
+    if ready is None:
+        return {'statusCode': 200, 'body': json.dumps({'message': 'Part received'})}
+    try:
+        audio_data, filename = get_part_assembler().take(ready)
+    except upload_parts.PartError as e:
+        log.warning("Incomplete utterance", error=e)
+        send_message(connection_id, domain, stage, {"error": str(e)})
+        return {'statusCode': 200, 'body': json.dumps({'error': str(e)})}
+    log.info("Utterance complete", utterance=part["utterance"], parts=ready["total"], bytes=len(audio_data))
+    try:
+        dispatch_audio(audio_data, connection_id, domain, stage, filename)
+    except Exception as e:
+        log.exception("Error processing utterance")
+        send_message(connection_id, domain, stage, {'error': f"Error processing audio: {str(e)}"})
+        return {'statusCode': 200, 'body': json.dumps({'error': str(e)})}
+    return {'statusCode': 200, 'body': json.dumps({'message': 'Processing utterance'})}
+
+def get_job_queue():
+    """Return the container-wide job queue (LAMBDA_PROCESSING=queue)"""
+    global _job_queue
+    if _job_queue is None:
+        import job_queue
+        _job_queue = job_queue.get_queue()
+    return _job_queue
+
+def _job(job_type, connection_id, domain, stage, **fields):
+    return {"type": job_type, "connection_id": connection_id, "domain": domain, "stage": stage,
+            "queued_at": time.time(), **fields}
+
+def dispatch_audio(audio_data, connection_id, domain, stage, filename="audio.webm"):
+    """Process audio now, or in queue mode leave it to worker_handler"""
+    if LAMBDA_PROCESSING == "queue":
+        import job_queue
+        job = _job("audio", connection_id, domain, stage, filename=filename,
+                   audio=base64.b64encode(audio_data).decode("ascii"))
+        # API Gateway caps frames at 128 KB, so only unusual merges get here
+        if job_queue.body_size(job) <= job_queue.JOB_MAX_BODY_BYTES:
+            get_job_queue().send(connection_id, job)
+            log.debug("Queued audio job", bytes=len(audio_data))
+            return
+        log.warning("Audio too large for a job, processing inline", bytes=len(audio_data))
+    process_audio_lambda(audio_data, connection_id, domain, stage, filename)
+
+def handle_audio(audio_data, connection_id, domain, stage):
+    """
+    Process an audio chunk, merging it with earlier small chunks of the same
+    connection. Returns False if the chunk was only buffered.
+    """
+    chunk_coalescer = get_coalescer()
+    if chunk_coalescer is None:
+        dispatch_audio(audio_data, connection_id, domain, stage)
+        return True
+    uploads = chunk_coalescer.add(connection_id, audio_data)
+    for data, filename in uploads:
+        dispatch_audio(data, connection_id, domain, stage, filename)
+    return bool(uploads)
+
+def handle_end_of_stream(connection_id, domain, stage):
+    log.info("Received end-of-stream marker")
+    # Flush audio still buffered for this connection before completing
+    chunk_coalescer = get_coalescer()
+    if chunk_coalescer is not None:
+        try:
+            for data, filename in chunk_coalescer.flush(connection_id):
+                dispatch_audio(data, connection_id, domain, stage, filename)
+        except Exception:
+            log.exception("Error flushing buffered audio")
+    if LAMBDA_PROCESSING == "queue":
+        # Queued behind this connection's audio jobs, so the worker sends the
+        # completion message once they are done
+        get_job_queue().send(connection_id, _job("end", connection_id, domain, stage))
+        return {'statusCode': 200, 'body': json.dumps({'message': 'End of stream received'})}
+    try:
+        send_message(connection_id, domain, stage, {"status": "completed"})
+    except Exception as send_error:
+        log.warning("Failed to send completion message", error=send_error)
+    return {'statusCode': 200, 'body': json.dumps({'message': 'End of stream received'})}
+
+def worker_handler(event, context):
+    """
+    Processes queued audio jobs: the records of an SQS event (enable
+    ReportBatchItemFailures on the event source mapping), or otherwise as
+    many batches as the invocation has time for, polled from the queue.
+    """
+    with logs.scope(request_id=getattr(context, "aws_request_id", None)):
+        _set_deadline(context)
+        if "Records" in event:
+            import job_queue
+            failed = run_jobs([job_queue.message_from_record(record) for record in event["Records"]])
+            return {"batchItemFailures": [{"itemIdentifier": message["id"]} for message in failed]}
+        queue = get_job_queue()
+        processed = 0
+        while _remaining() is None or _remaining() > WORKER_MIN_REMAINING:
+            messages = queue.receive(WORKER_BATCH_SIZE)
+            if not messages:
+                break
+            failed = {message["id"] for message in run_jobs(messages)}
+            for message in messages:
+                if message["id"] in failed:
+                    queue.release(message["receipt"])
+                else:
+                    queue.delete(message["receipt"])
+            processed += len(messages) - len(failed)
+        return {"processed": processed}
+
+def run_jobs(messages):
+    """
+    Run jobs in order and return the messages that must be retried. After a
+    failure, the rest of that connection's jobs are returned unrun, so they
+    are retried after it rather than ahead of it.
+    """
+    failed = []
+    failed_groups = set()
+    for message in messages:
+        if message["group"] in failed_groups:
+            failed.append(message)
+            continue
+        with logs.scope(connection=message["group"], job=message["id"]):
+            try:
+                run_job(message["body"])
+            except Exception:
+                log.exception("Job failed", receives=message["receives"])
+                failed_groups.add(message["group"])
+                failed.append(message)
+    return failed
+
+def run_job(job):
+    connection_id, domain, stage = job["connection_id"], job["domain"], job["stage"]
+    log.info("Running job", type=job["type"], waited=round(time.time() - job["queued_at"], 3))
+    if is_connection_gone(connection_id):
+        log.info("Connection gone, dropping job")
+        return
+    if job["type"] == "end":
+        send_message(connection_id, domain, stage, {"status": "completed"})
+    else:
+        process_audio_lambda(base64.b64decode(job["audio"]), connection_id, domain, stage, job["filename"])
+
+def process_audio_lambda(audio_data, connection_id, domain, stage, filename="audio.webm"):
     """Process audio data and extract grocery items"""
-    print(f"process_audio_lambda started for connection {connection_id}")
+    # Heavy imports are loaded once per container
+    _load_audio_dependencies()
+    # OpenAI calls (retries included) give up before the invocation times out
+    with call_budget(_remaining()):
+        _process_audio(audio_data, connection_id, domain, stage, filename)
+
+def _process_audio(audio_data, connection_id, domain, stage, filename):
+    log.info("Processing audio chunk", bytes=len(audio_data), filename=filename)
     
-    # Create a temporary file to store the audio chunk
-    temp_file_path = None
     try:
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.webm') as temp_file:
-            temp_file_path = temp_file.name
-            temp_file.write(audio_data)
-        
-        print(f"Created temporary file at {temp_file_path}")
-        print(f"Processing audio chunk of size {len(audio_data)} bytes")
+        # The pooled client is created once per container
+        client = get_openai_client()
+        # Tail of the connection's earlier chunks, shared through the session store
+        context = get_transcript_context()
+        previous = context.get(connection_id) if context else ""
         
-        # Use OpenAI Whisper to transcribe the audio
-        with open(temp_file_path, "rb") as audio_file:
-            OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-            if not OPENAI_API_KEY:
-                print("OPENAI_API_KEY environment variable not set")
-                raise ValueError("OPENAI_API_KEY environment variable not set")
-                
-            print("Initializing OpenAI client")
-            client = openai.OpenAI(api_key=OPENAI_API_KEY)
-            
-            # Use a faster whisper model for real-time processing
-            try:
-                print("Sending audio to OpenAI for transcription")
-                transcript = client.audio.transcriptions.create(
-                    model="whisper-1",
-                    file=audio_file,
-                    response_format="text"
-                )
-                print(f"Transcribed: {transcript}")
-            except Exception as e:
-                error_message = str(e)
-                print(f"Transcription error: {error_message}")
-                send_message(connection_id, domain, stage, {"error": f"Error from server: {error_message}"})
-                return
+        # Use OpenAI Whisper to transcribe the audio straight from memory;
+        # API Gateway retries and resent chunks reuse the earlier transcript
+        try:
+            log.debug("Sending audio to OpenAI for transcription")
+            transcript = transcribe(client, audio_data, filename, prompt=previous or None)
+            log.debug("Transcribed", transcript=transcript)
+            if context:
+                context.add(connection_id, transcript)
+        except Exception as e:
+            error_message = str(e)
+            log.exception("Transcription error")
+            send_message(connection_id, domain, stage, {"error": f"Error from server: {error_message}"})
+            return
         
         if not transcript.strip():
-            print("Empty transcript, skipping")
+            log.info("Empty transcript, skipping")
             send_message(connection_id, domain, stage, {"message": "Empty transcript, no speech detected"})
             return
         
-        # For real-time processing, use a more focused prompt for faster inference
-        user_prompt = f"Here's the transcript: {transcript}\n\nExtract grocery items with quantities in Tamil or English."
-        print(f"Created user prompt: {user_prompt}")
-        
-        # System prompt for processing grocery items
-        SYSTEM_PROMPT = """
-Extract grocery items from the provided text. The text may contain items in Tamil and English.
-For each item, provide:
-1. The Tamil name in Tamil script (தமிழ் எழுத்து) - NOT transliterated
-2. The English name (translate if only Tamil name is given)
-3. The weight in English (e.g., "500 grams", "1 kg", "1 litre", "1 ml", etc.)
-4. The quantity as a number (if specifically mentioned)
-
-IMPORTANT NOTES ON TAMIL QUANTITIES:
-- "கால் கிலோ" (kaal kilo) means "250 grams", NOT 0.25 kilograms
-- "அரை கிலோ" (arai kilo) means "500 grams", NOT half kilogram
-- "முக்கால் கிலோ" (mukkaal kilo) means "750 grams", NOT 0.75 kilograms
-- If someone says "அரை கிலோ ரெண்டு" (arai kilo rendu), it means quantity = 2, weight = "500 grams"
-- Always express weights in English (grams, kg, litre, ml, etc.)
-- If only a quantity is mentioned (like "2 apples"), set weight to an empty string and quantity to the number
-
-CRITICAL INSTRUCTIONS FOR TAMIL SPELLING:
-- Maintain Tamil words in proper Tamil script (UTF-8) characters
-- Do NOT transliterate Tamil words to English/Roman script
-- Ensure correct Tamil spelling with proper vowel and consonant marks
-- Common Tamil grocery items should appear in Tamil script, for example:
-  * "அரிசி" (rice)
-  * "வெங்காயம்" (onion)
-  * "தக்காளி" (tomato)
-  * "மிளகாய்" (chili)
-  * "பட்டாணி" (peas)
-  * "கீரை" (greens)
-- If the audio contains Tamil words in Tamil script, preserve them as-is
-- If the audio contains transliterated Tamil words, convert them to proper Tamil script
-
-Return a JSON array with objects having the keys 'tamil_name', 'english_name', 'weight', and 'quantity'.
-The response should be in this format: {"items": [{"tamil_name": "", "english_name": "", "weight": "", "quantity": null}]}
-If no quantity is specified, set it to null.
-"""
-        
         try:
-            print("Sending transcript to GPT for processing")
-            response = client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {"role": "system", "content": SYSTEM_PROMPT},
-                    {"role": "user", "content": user_prompt}
-                ],
-                response_format={"type": "json_object"},
-                temperature=0.3  # Lower temperature for more consistent, faster responses
-            )
-            print("Received response from GPT")
-            
-            # Parse the JSON response
-            result = response.choices[0].message.content
-            print(f"GPT response content: {result}")
-            grocery_items = json.loads(result).get("items", [])
+            # Local rules first, GPT only for the segments they couldn't parse.
+            # Each item is sent the moment its JSON object is complete.
+            # Lower temperature for more consistent, faster responses
+            log.debug("Extracting grocery items from transcript", chars=len(transcript))
+            sender = ItemSender(connection_id, domain, stage,
+                                session_id=get_session_list().session_of(connection_id))
+            found = 0
+            for item in stream_items(client, transcript, SYSTEM_PROMPT, USER_PROMPT, temperature=0.3,
+                                     context=previous or None):
+                found += 1
+                log.debug("Queueing item for client", item=item)
+                sender.add(item)
+                if sender.gone:
+                    # Client disconnected mid-stream; stop paying for tokens
+                    log.info("Connection gone, abandoning extraction")
+                    return
+            sender.flush()
             
-            if not grocery_items:
-                print("No grocery items found in transcript")
+            if not found:
+                log.info("No grocery items found in transcript")
                 send_message(connection_id, domain, stage, {"message": "No grocery items found in speech"})
                 return
                 
-            print(f"Found {len(grocery_items)} grocery items: {grocery_items}")
-            
-            # Send each item individually to the frontend
-            for item in grocery_items:
-                print(f"Sending item to client: {item}")
-                send_message(connection_id, domain, stage, item)
+            log.info("Found grocery items", items=found)
                 
         except Exception as e:
             error_message = str(e)
-            print(f"GPT processing error: {error_message}")
+            log.exception("GPT processing error")
             send_message(connection_id, domain, stage, {"error": f"Error processing text: {error_message}"})
             
     except Exception as e:
         error_message = str(e)
-        print(f"Error processing audio: {error_message}")
+        log.exception("Error processing audio")
         send_message(connection_id, domain, stage, {"error": f"Error from server: {error_message}"})
-    finally:
-        # Clean up the temporary file
-        if temp_file_path and os.path.exists(temp_file_path):
-            print(f"Removing temporary file: {temp_file_path}")
-            os.remove(temp_file_path)
+
+def get_gateway_client(domain_name, stage_name):
+    """Return the management API client for this endpoint, reused across warm invocations"""
+    key = (domain_name, stage_name)
+    gateway_api = _gateway_clients.get(key)
+    if gateway_api is None:
+        import boto3
+        gateway_api = boto3.client('apigatewaymanagementapi',
+                                   endpoint_url=GATEWAY_ENDPOINT_URL or f'https://{domain_name}/{stage_name}')
+        _gateway_clients[key] = gateway_api
+    return gateway_api
+
+def is_connection_gone(connection_id):
+    return connection_id in _gone_connections
+
+def _mark_connection_gone(connection_id):
+    _gone_connections[connection_id] = True
+    while len(_gone_connections) > GONE_CONNECTIONS_MAX:
+        _gone_connections.popitem(last=False)
 
 def send_message(connection_id, domain_name, stage_name, message):
     """Send a message back to the client through the WebSocket connection"""
+    if is_connection_gone(connection_id):
+        # The client already disconnected; don't pay for another HTTPS call
+        return False
+    gateway_api = get_gateway_client(domain_name, stage_name)
     try:
-        gateway_api = boto3.client('apigatewaymanagementapi', 
-                                endpoint_url=f'https://{domain_name}/{stage_name}')
-        
+        data = fast_json.dumps_bytes(message)
         gateway_api.post_to_connection(
             ConnectionId=connection_id,
-            Data=json.dumps(message).encode('utf-8')
+            Data=data
         )
-        print(f"Successfully sent message to client: {json.dumps(message)[:100]}...")
+        log.debug("Sent message to client", bytes=len(data))
         return True
+    except gateway_api.exceptions.GoneException:
+        log.info("Connection is gone, skipping remaining messages", connection_id=connection_id)
+        _mark_connection_gone(connection_id)
+        return False
     except Exception as e:
-        print(f"Error sending message: {str(e)}")
+        log.warning("Error sending message", error=e)
         # Don't raise the exception as it might interrupt the flow
-        return False 
\ No newline at end of file
+        return False
+
+class ItemSender:
+    """
+    Delivers grocery items for one chunk. In "batch" framing, items are sent
+    as {"type": "items", "items": [...]} frames: one per chunk, or one per
+    ITEM_BATCH_WINDOW seconds when a window is set (checked as items arrive).
+    "item" framing sends each item as its own frame, as older clients expect.
+    With a session_id, each batch is merged into the session list instead and
+    only the resulting delta is sent.
+    """
+
+    def __init__(self, connection_id, domain_name, stage_name, framing=None, window=None, session_id=None):
+        self.connection_id = connection_id
+        self.domain_name = domain_name
+        self.stage_name = stage_name
+        self.session_id = session_id
+        self.framing = "batch" if session_id else (framing or ITEM_FRAMING)
+        self.window = ITEM_BATCH_WINDOW if window is None else window
+        self.pending = []
+        self.batch_started = None
+        self.sent = 0
+
+    @property
+    def gone(self):
+        return is_connection_gone(self.connection_id)
+
+    def add(self, item):
+        if self.gone:
+            return False
+        if self.framing == "item":
+            self.sent += 1
+            return send_message(self.connection_id, self.domain_name, self.stage_name, item)
+        if not self.pending:
+            self.batch_started = time.monotonic()
+        self.pending.append(item)
+        if self.window and time.monotonic() - self.batch_started >= self.window:
+            return self.flush()
+        return True
+
+    def flush(self):
+        if not self.pending:
+            return True
+        items, self.pending = self.pending, []
+        self.sent += len(items)
+        if self.session_id:
+            # One store update per batch; nothing is sent for repeated items
+            delta = get_session_list().apply(self.session_id, items)
+            return delta is None or send_message(self.connection_id, self.domain_name, self.stage_name, delta)
+        return send_message(self.connection_id, self.domain_name, self.stage_name,
+                            {"type": "items", "items": items})
+
+if not LAMBDA_LAZY_IMPORTS:
+    # get_gateway_client() imports boto3 itself; this only moves the cost to init
+    import importlib
+    importlib.import_module("boto3")
+    _load_audio_dependencies()
@@ -0,0 +1,175 @@
+import contextvars
+import hashlib
+import json
+import logging
+import os
+import random
+import sys
+import time
+from contextlib import contextmanager
+
+# Structured logging for the Lambda handler and the FastAPI app. Each record is
+# one JSON line (LOG_FORMAT=text gives "message key=value" for local runs)
+# with the message, any keyword fields and the fields bound to the current
+# invocation / connection by scope().
+#
+# Nothing is serialized unless the record is emitted: debug() returns after a
+# level check, and fields are rendered by the formatter. Audio and other
+# payloads never reach the log as content: bytes, and the fields named in
+# REDACTED_FIELDS, are logged as their size and a short hash, and long strings
+# are truncated to LOG_FIELD_MAX characters.
+#
+# LOG_SAMPLE_RATE turns on debug logging for that share of invocations /
+# connections (chosen when the scope opens), so detail is available in
+# production without paying for it on every request.
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0"))
+LOG_FIELD_MAX = int(os.getenv("LOG_FIELD_MAX", "200"))
+
+REDACTED_FIELDS = {"audio", "audio_data", "body", "data", "payload"}
+_MAX_DEPTH = 4
+_MAX_ITEMS = 20
+
+_LEVELS = {"DEBUG": logging.DEBUG, "INFO": logging.INFO, "WARNING": logging.WARNING, "ERROR": logging.ERROR}
+_level = _LEVELS.get(LOG_LEVEL, logging.INFO)
+_sampled = contextvars.ContextVar("log_sampled", default=False)
+_bound = contextvars.ContextVar("log_fields", default={})
+
+def _digest(value):
+    return {"size": len(value), "sha256": hashlib.sha256(value).hexdigest()[:12]}
+
+def redact(value):
+    """Size and short hash of a payload, in place of its content"""
+    if isinstance(value, str):
+        value = value.encode("utf-8", "replace")
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return _digest(bytes(value))
+    return {"size": len(value)} if hasattr(value, "__len__") else {"type": type(value).__name__}
+
+def _safe(value, depth=0):
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    if isinstance(value, str):
+        if len(value) > LOG_FIELD_MAX:
+            return f"{value[:LOG_FIELD_MAX]}...(+{len(value) - LOG_FIELD_MAX} chars)"
+        return value
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return redact(value)
+    if depth >= _MAX_DEPTH:
+        return f"<{type(value).__name__}>"
+    if isinstance(value, dict):
+        safe = {}
+        for index, (key, item) in enumerate(value.items()):
+            if index == _MAX_ITEMS:
+                safe["..."] = f"+{len(value) - _MAX_ITEMS} keys"
+                break
+            key = str(key)
+            safe[key] = redact(item) if key in REDACTED_FIELDS and item else _safe(item, depth + 1)
+        return safe
+    if isinstance(value, (list, tuple, set)):
+        items = [_safe(item, depth + 1) for item in list(value)[:_MAX_ITEMS]]
+        if len(value) > _MAX_ITEMS:
+            items.append(f"+{len(value) - _MAX_ITEMS} more")
+        return items
+    if isinstance(value, BaseException):
+        return f"{type(value).__name__}: {value}"
+    return _safe(str(value), depth)
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        fields = {**_bound.get(), **getattr(record, "fields", {})}
+        for key, value in _safe(fields).items():
+            entry.setdefault(key, value)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        fields = _safe({**_bound.get(), **getattr(record, "fields", {})})
+        text = " ".join([time.strftime("%H:%M:%S", time.localtime(record.created)), record.levelname,
+                         record.getMessage()] + [f"{key}={json.dumps(value, ensure_ascii=False, default=str)}"
+                                                 for key, value in fields.items()])
+        if record.exc_info:
+            text += "\n" + self.formatException(record.exc_info)
+        return text
+
+class _StdoutHandler(logging.StreamHandler):
+    """Writes to whatever sys.stdout is at emit time, like print() did"""
+
+    def __init__(self):
+        super().__init__(sys.stdout)
+
+    @property
+    def stream(self):
+        return sys.stdout
+
+    @stream.setter
+    def stream(self, value):
+        pass
+
+_root = logging.getLogger("grocery")
+if not _root.handlers:
+    _handler = _StdoutHandler()
+    _handler.setFormatter(TextFormatter() if LOG_FORMAT == "text" else JsonFormatter())
+    _root.addHandler(_handler)
+    # Levels are checked in Logger below so sampled scopes can log debug
+    _root.setLevel(logging.DEBUG)
+    _root.propagate = False
+
+class Logger:
+    """log.info("message", key=value, ...); fields are only rendered if emitted"""
+
+    def __init__(self, name):
+        self._logger = _root.getChild(name)
+
+    def debug_enabled(self):
+        """For callers that would have to compute a debug field"""
+        return _level <= logging.DEBUG or _sampled.get()
+
+    def _emit(self, level, message, fields, exc_info=None):
+        self._logger.log(level, message, exc_info=exc_info, extra={"fields": fields})
+
+    def debug(self, message, /, **fields):
+        if _level <= logging.DEBUG or _sampled.get():
+            self._emit(logging.DEBUG, message, fields)
+
+    def info(self, message, /, **fields):
+        if _level <= logging.INFO:
+            self._emit(logging.INFO, message, fields)
+
+    def warning(self, message, /, **fields):
+        if _level <= logging.WARNING:
+            self._emit(logging.WARNING, message, fields)
+
+    def error(self, message, /, **fields):
+        self._emit(logging.ERROR, message, fields)
+
+    def exception(self, message, /, **fields):
+        """error() with the current exception's traceback"""
+        self._emit(logging.ERROR, message, fields, exc_info=True)
+
+def get_logger(name):
+    return Logger(name)
+
+@contextmanager
+def scope(**fields):
+    """
+    Bind fields (request id, connection id, ...) to every record logged in
+    the block, and decide whether the block is sampled for debug logging
+    """
+    fields_token = _bound.set({**_bound.get(), **fields})
+    sampled_token = _sampled.set(_sampled.get() or (LOG_SAMPLE_RATE > 0 and random.random() < LOG_SAMPLE_RATE))
+    try:
+        yield
+    finally:
+        _sampled.reset(sampled_token)
+        _bound.reset(fields_token)
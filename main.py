@@ -1,18 +1,59 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, UploadFile, File, HTTPException, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.datastructures import UploadFile as StarletteUploadFile
 import openai
 import os
-from typing import List, Optional
+from typing import List
 from dotenv import load_dotenv
 import json
 import asyncio
-import tempfile
+import time
+from contextlib import asynccontextmanager
+import openai_client
+import audio_preprocess
+import call_policy
+import logs
+import metrics
+from chunk_pipeline import ChunkPipeline
+from connections import ConnectionManager
+from coalescer import AsyncChunkCoalescer, COALESCE_ENABLED
+import transcription
+from transcription import transcribe, transcribe_async
+from upload_limits import UploadSizeLimitMiddleware, UPLOAD_MAX_BYTES
+import batch_upload
+from models import GroceryItem
+import extraction
+import grocery_rules
+import model_router
+import prompts
+import session_list
+import session_store
+import fast_json
+import transcript_context
+from extraction import extract_items, extract_items_async, stream_items_async
 
 # Load environment variables from .env file if it exists
 load_dotenv()
-app = FastAPI(root_path="/prod")  # This is important for API Gateway stage name
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One pooled AsyncOpenAI client per worker, closed on shutdown
+    await openai_client.startup()
+    try:
+        yield
+    finally:
+        await manager.shutdown()
+        await openai_client.shutdown()
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with fast_json (orjson when installed)"""
+
+    def render(self, content):
+        return fast_json.dumps_bytes(content)
+
+app = FastAPI(root_path="/prod", lifespan=lifespan,  # root_path is important for API Gateway stage name
+              default_response_class=FastJSONResponse)
 
 # Configure CORS more comprehensively for direct API Gateway integration
 app.add_middleware(
@@ -24,17 +65,16 @@ app.add_middleware(
     expose_headers=["*"],  # Expose all headers
 )
 
+# Cap upload size so long recordings can't exhaust memory or disk
+app.add_middleware(UploadSizeLimitMiddleware, paths=["/transcribe"])
+app.add_middleware(UploadSizeLimitMiddleware, paths=["/transcribe/batch"],
+                   max_bytes=batch_upload.BATCH_UPLOAD_MAX_BYTES)
+
 # Set your OpenAI API key
 # In production, use environment variables for secrets
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "your-api-key-here")
 openai.api_key = OPENAI_API_KEY
 
-class GroceryItem(BaseModel):
-    tamil_name: str
-    english_name: str
-    weight: str  # For weights like "500 grams", "1 kg", "1 litre", etc.
-    quantity: Optional[int] = None  # Numerical quantity if specified
-
 @app.get("/")
 def read_root():
     return {"message": "Grocery List Speech-to-Text API"}
@@ -51,58 +91,30 @@ async def options_route(full_path: str):
         },
     )
 
-# WebSocket connection manager
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: List[WebSocket] = []
-
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections.append(websocket)
-
-    def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
-
-    async def send_json(self, websocket: WebSocket, data: dict):
-        await websocket.send_json(data)
-
+# WebSocket connection registry (bounded send queues, heartbeats, admission)
 manager = ConnectionManager()
 
-# System prompt for processing grocery items
-SYSTEM_PROMPT = """
-Extract grocery items from the provided text. The text may contain items in Tamil and English.
-For each item, provide:
-1. The Tamil name in Tamil script (தமிழ் எழுத்து) - NOT transliterated
-2. The English name (translate if only Tamil name is given)
-3. The weight in English (e.g., "500 grams", "1 kg", "1 litre", "1 ml", etc.)
-4. The quantity as a number (if specifically mentioned)
+metrics.register_gauge("grocery_websocket_connections", "Open WebSocket connections", lambda: len(manager))
+metrics.register_gauge("grocery_upstream_inflight", "Chunks/uploads holding an upstream slot",
+                       openai_client.inflight)
+metrics.register_stats("grocery_transcription", transcription.get_stats)
+metrics.register_stats("grocery_preprocess", audio_preprocess.get_stats)
+metrics.register_stats("grocery_rules", grocery_rules.get_stats)
+metrics.register_stats("grocery_extraction_cache", extraction.cache_stats)
+metrics.register_stats("grocery_model_router", model_router.get_stats)
+
+@app.get("/metrics")
+def read_metrics():
+    # Prometheus text exposition format
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
-IMPORTANT NOTES ON TAMIL QUANTITIES:
-- "கால் கிலோ" (kaal kilo) means "250 grams", NOT 0.25 kilograms
-- "அரை கிலோ" (arai kilo) means "500 grams", NOT half kilogram
-- "முக்கால் கிலோ" (mukkaal kilo) means "750 grams", NOT 0.75 kilograms
-- If someone says "அரை கிலோ ரெண்டு" (arai kilo rendu), it means quantity = 2, weight = "500 grams"
-- Always express weights in English (grams, kg, litre, ml, etc.)
-- If only a quantity is mentioned (like "2 apples"), set weight to an empty string and quantity to the number
+# Server-side grocery lists for clients that connect with ?session=<id>
+session_lists = session_list.SessionList(session_store.get_store())
 
-CRITICAL INSTRUCTIONS FOR TAMIL SPELLING:
-- Maintain Tamil words in proper Tamil script (UTF-8) characters
-- Do NOT transliterate Tamil words to English/Roman script
-- Ensure correct Tamil spelling with proper vowel and consonant marks
-- Common Tamil grocery items should appear in Tamil script, for example:
-  * "அரிசி" (rice)
-  * "வெங்காயம்" (onion)
-  * "தக்காளி" (tomato)
-  * "மிளகாய்" (chili)
-  * "பட்டாணி" (peas)
-  * "கீரை" (greens)
-- If the audio contains Tamil words in Tamil script, preserve them as-is
-- If the audio contains transliterated Tamil words, convert them to proper Tamil script
+# One prompt for every path; see prompts.py
+SYSTEM_PROMPT, USER_PROMPT = prompts.get_prompts()
 
-Return a JSON array with objects having the keys 'tamil_name', 'english_name', 'weight', and 'quantity'.
-The response should be in this format: {"items": [{"tamil_name": "", "english_name": "", "weight": "", "quantity": null}]}
-If no quantity is specified, set it to null.
-"""
+log = logs.get_logger("app")
 
 # Add a non-async version of process_audio for Lambda usage
 def process_audio(audio_data, websocket=None):
@@ -110,64 +122,46 @@ def process_audio(audio_data, websocket=None):
     Non-async version of process_audio that can be called directly from Lambda
     If websocket is None, we're in Lambda mode and need to return the results instead of sending them
     """
-    # Create a temporary file to store the audio chunk
-    temp_file_path = None
+    started = time.perf_counter()
+    metrics.inc("grocery_chunks_total", pipeline="sync")
     try:
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.webm') as temp_file:
-            temp_file_path = temp_file.name
-            temp_file.write(audio_data)
-        
-        print(f"Processing audio chunk of size {len(audio_data)} bytes")
+        log.info("Processing audio chunk", bytes=len(audio_data))
         results = []
         
-        # Use OpenAI Whisper to transcribe the audio
-        with open(temp_file_path, "rb") as audio_file:
-            client = openai.OpenAI(api_key=OPENAI_API_KEY)
-            
-            # Use a faster whisper model for real-time processing
-            try:
-                transcript = client.audio.transcriptions.create(
-                    model="whisper-1",
-                    file=audio_file,
-                    response_format="text"
-                )
-                print(f"Transcribed: {transcript}")
-            except Exception as e:
-                error_message = str(e)
-                print(f"Transcription error: {error_message}")
-                error_data = {"error": f"Error from server: {error_message}"}
-                if websocket:
-                    # In FastAPI mode, send error to websocket
-                    asyncio.run(manager.send_json(websocket, error_data))
-                return error_data
+        # Use OpenAI Whisper to transcribe the audio straight from memory;
+        # resent chunks reuse the transcript of identical audio
+        client = openai_client.get_sync_client()
+        try:
+            with metrics.timer("grocery_stage_seconds", pipeline="sync", stage="transcribe"):
+                transcript = transcribe(client, audio_data)
+            log.debug("Transcribed", transcript=transcript)
+        except Exception as e:
+            metrics.inc("grocery_errors_total", pipeline="sync", stage="transcribe")
+            error_message = str(e)
+            log.exception("Transcription error")
+            error_data = {"error": f"Error from server: {error_message}"}
+            if websocket:
+                # In FastAPI mode, send error to websocket
+                asyncio.run(manager.send_json(websocket, error_data))
+            return error_data
         
         if not transcript.strip():
-            print("Empty transcript, skipping")
+            log.info("Empty transcript, skipping")
+            metrics.inc("grocery_empty_transcripts_total", pipeline="sync")
             return {"message": "Empty transcript"}
         
-        # For real-time processing, use a more focused prompt for faster inference
-        user_prompt = f"Here's the transcript: {transcript}\n\nExtract grocery items with quantities in Tamil or English."
-        
         try:
-            response = client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {"role": "system", "content": SYSTEM_PROMPT},
-                    {"role": "user", "content": user_prompt}
-                ],
-                response_format={"type": "json_object"},
-                temperature=0.3  # Lower temperature for more consistent, faster responses
-            )
-            
-            # Parse the JSON response
-            result = response.choices[0].message.content
-            grocery_items = json.loads(result).get("items", [])
+            # Local rules first, GPT only for what they couldn't parse.
+            # Lower temperature for more consistent, faster responses
+            with metrics.timer("grocery_stage_seconds", pipeline="sync", stage="extract"):
+                grocery_items = extract_items(client, transcript, SYSTEM_PROMPT, USER_PROMPT, temperature=0.3)
+            metrics.inc("grocery_items_total", len(grocery_items), pipeline="sync")
             
             if not grocery_items:
-                print("No grocery items found in transcript")
+                log.info("No grocery items found in transcript")
                 return {"message": "No grocery items found"}
                 
-            print(f"Found {len(grocery_items)} grocery items")
+            log.info("Found grocery items", items=len(grocery_items))
             
             if websocket:
                 # In FastAPI mode, send items to websocket
@@ -178,8 +172,9 @@ def process_audio(audio_data, websocket=None):
                 return grocery_items
                 
         except Exception as e:
+            metrics.inc("grocery_errors_total", pipeline="sync", stage="extract")
             error_message = str(e)
-            print(f"GPT processing error: {error_message}")
+            log.exception("GPT processing error")
             error_data = {"error": f"Error processing text: {error_message}"}
             if websocket:
                 # In FastAPI mode, send error to websocket
@@ -187,167 +182,356 @@ def process_audio(audio_data, websocket=None):
             return error_data
             
     except Exception as e:
+        metrics.inc("grocery_errors_total", pipeline="sync", stage="other")
         error_message = str(e)
-        print(f"Error processing audio: {error_message}")
+        log.exception("Error processing audio")
         error_data = {"error": f"Error from server: {error_message}"}
         if websocket:
             # In FastAPI mode, send error to websocket
             asyncio.run(manager.send_json(websocket, error_data))
         return error_data
     finally:
-        # Clean up the temporary file
-        if temp_file_path and os.path.exists(temp_file_path):
-            os.remove(temp_file_path)
+        metrics.observe("grocery_stage_seconds", time.perf_counter() - started, pipeline="sync", stage="total")
 
-# Rename the async version to avoid confusion
-async def process_audio_async(audio_data, websocket: WebSocket):
-    # Create a temporary file to store the audio chunk
-    temp_file_path = None
+# Async per-chunk processing; yields the messages to send instead of sending
+# them so the connection pipeline can deliver results in chunk order while
+# still pushing each item the moment extraction completes it
+async def process_chunk_async(audio_data, filename="audio.webm", context=None):
+    # Cap concurrent upstream work per worker; a chunk that can't get a slot
+    # in time is reported as busy instead of queueing without limit
     try:
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.webm') as temp_file:
-            temp_file_path = temp_file.name
-            temp_file.write(audio_data)
-        
-        print(f"Processing audio chunk of size {len(audio_data)} bytes")
+        # The previous chunk's transcript is awaited before taking a slot, so
+        # the wait doesn't hold one that other chunks need
+        earlier = await context.context() if context is not None else None
+        async with openai_client.upstream_slot():
+            async for message in _process_chunk(audio_data, filename, context, earlier):
+                yield message
+    except openai_client.UpstreamBusy as e:
+        log.warning("Upstream busy, rejecting chunk", error=e)
+        metrics.inc("grocery_busy_total", pipeline="websocket")
+        yield {"error": "Server busy, chunk not processed", "busy": True}
+    finally:
+        # Later chunks stop waiting for this one's transcript
+        if context is not None:
+            context.done("")
+
+def _discard_chunk(audio_data, filename="audio.webm", context=None):
+    # A dropped chunk adds nothing to the rolling context
+    if context is not None:
+        context.done("")
+
+async def _process_chunk(audio_data, filename, context=None, earlier=None):
+    started = time.perf_counter()
+    metrics.inc("grocery_chunks_total", pipeline="websocket")
+    try:
+        log.info("Processing audio chunk", bytes=len(audio_data))
         
-        # Use OpenAI Whisper to transcribe the audio
-        with open(temp_file_path, "rb") as audio_file:
-            client = openai.OpenAI(api_key=OPENAI_API_KEY)
-            
-            # Use a faster whisper model for real-time processing
-            try:
-                transcript = client.audio.transcriptions.create(
-                    model="whisper-1",
-                    file=audio_file,
-                    response_format="text"
-                )
-                print(f"Transcribed: {transcript}")
-            except Exception as e:
-                error_message = str(e)
-                print(f"Transcription error: {error_message}")
-                await manager.send_json(websocket, {"error": f"Error from server: {error_message}"})
-                return
+        # Use OpenAI Whisper to transcribe the audio straight from memory;
+        # resent chunks reuse the transcript of identical audio
+        client = openai_client.get_async_client()
+        try:
+            with metrics.timer("grocery_stage_seconds", pipeline="websocket", stage="transcribe"):
+                # The session's earlier transcript guides Whisper
+                transcript = await transcribe_async(client, audio_data, filename, prompt=earlier or None)
+            log.debug("Transcribed", transcript=transcript)
+            if context is not None:
+                context.done(transcript)
+        except Exception as e:
+            metrics.inc("grocery_errors_total", pipeline="websocket", stage="transcribe")
+            error_message = str(e)
+            log.exception("Transcription error")
+            yield {"error": f"Error from server: {error_message}"}
+            return
         
         if not transcript.strip():
-            print("Empty transcript, skipping")
+            log.info("Empty transcript, skipping")
+            metrics.inc("grocery_empty_transcripts_total", pipeline="websocket")
             return
         
-        # For real-time processing, use a more focused prompt for faster inference
-        user_prompt = f"Here's the transcript: {transcript}\n\nExtract grocery items with quantities in Tamil or English."
-        
         try:
-            response = client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {"role": "system", "content": SYSTEM_PROMPT},
-                    {"role": "user", "content": user_prompt}
-                ],
-                response_format={"type": "json_object"},
-                temperature=0.3  # Lower temperature for more consistent, faster responses
-            )
-            
-            # Parse the JSON response
-            result = response.choices[0].message.content
-            grocery_items = json.loads(result).get("items", [])
+            # Local rules first, GPT only for what they couldn't parse; items
+            # are streamed out as soon as each one is complete.
+            # Lower temperature for more consistent, faster responses
+            found = 0
+            extract_started = time.perf_counter()
+            # Items cut off at the previous chunk's end are completed from its text
+            async for item in stream_items_async(client, transcript, SYSTEM_PROMPT, USER_PROMPT, temperature=0.3,
+                                                 context=earlier or None):
+                if not found:
+                    metrics.observe("grocery_stage_seconds", time.perf_counter() - extract_started,
+                                    pipeline="websocket", stage="first_item")
+                found += 1
+                yield item
+            metrics.observe("grocery_stage_seconds", time.perf_counter() - extract_started,
+                            pipeline="websocket", stage="extract")
+            metrics.inc("grocery_items_total", found, pipeline="websocket")
             
-            if not grocery_items:
-                print("No grocery items found in transcript")
+            if not found:
+                log.info("No grocery items found in transcript")
                 return
                 
-            print(f"Found {len(grocery_items)} grocery items")
-            
-            # Send each item individually to the frontend
-            for item in grocery_items:
-                await manager.send_json(websocket, item)
+            log.info("Found grocery items", items=found)
                 
         except Exception as e:
+            metrics.inc("grocery_errors_total", pipeline="websocket", stage="extract")
             error_message = str(e)
-            print(f"GPT processing error: {error_message}")
-            await manager.send_json(websocket, {"error": f"Error processing text: {error_message}"})
+            log.exception("GPT processing error")
+            yield {"error": f"Error processing text: {error_message}"}
             
     except Exception as e:
+        metrics.inc("grocery_errors_total", pipeline="websocket", stage="other")
         error_message = str(e)
-        print(f"Error processing audio: {error_message}")
-        await manager.send_json(websocket, {"error": f"Error from server: {error_message}"})
+        log.exception("Error processing audio")
+        yield {"error": f"Error from server: {error_message}"}
     finally:
-        # Clean up the temporary file
-        if temp_file_path and os.path.exists(temp_file_path):
-            os.remove(temp_file_path)
+        metrics.observe("grocery_stage_seconds", time.perf_counter() - started, pipeline="websocket", stage="total")
 
 @app.websocket("/")
 async def websocket_endpoint(websocket: WebSocket):
-    await manager.connect(websocket)
+    connection = await manager.connect(websocket)
+    if connection is None:
+        return
+    # Records logged for this connection, including from its pipeline tasks,
+    # carry its id
+    with logs.scope(connection=connection.id):
+        session_id = websocket.query_params.get("session")
+        if session_id is not None and not session_list.valid_session_id(session_id):
+            await fast_json.send_json(websocket, {"error": "Invalid session id"})
+            await connection.close(1008)  # policy violation
+            await manager.disconnect(connection)
+            return
+        await _serve_connection(websocket, connection, session_id)
+
+def _list_sender(connection, session_id):
+    """Send function that merges items into the session list and sends only the delta"""
+    async def send(message):
+        if "english_name" not in message:
+            await connection.send(message)
+            return
+        item = {key: value for key, value in message.items() if key != "seq"}
+        try:
+            # The store may be SQLite, so keep its I/O off the event loop
+            delta = await asyncio.to_thread(session_lists.apply, session_id, [item])
+        except Exception as e:
+            # e.g. a locked SQLite file or DynamoDB contention; the client can
+            # resync once the store is back
+            log.exception("Session list update failed", session=session_id)
+            await connection.send({"seq": message.get("seq"), "error": f"Session list update failed: {str(e)}"})
+            return
+        if delta is not None:
+            await connection.send(delta)
+    return send
+
+async def _handle_list_message(text, connection, session_id):
+    """{"type": "sync", "version": n} or {"type": "remove", "id": n}"""
+    if session_id is None:
+        await connection.send({"error": "No session list; connect with ?session=<id>"})
+        return
+    try:
+        message = json.loads(text)
+        if message.get("type") == "sync":
+            version = message.get("version")
+            reply = await asyncio.to_thread(session_lists.sync, session_id, None if version is None else int(version))
+        elif message.get("type") == "remove":
+            reply = await asyncio.to_thread(session_lists.remove, session_id, int(message["id"]))
+        else:
+            return
+    except (KeyError, TypeError, ValueError, AttributeError) as e:
+        await connection.send({"error": f"Invalid list message: {str(e)}"})
+        return
+    if reply is not None:
+        await connection.send(reply)
+
+async def _serve_connection(websocket: WebSocket, connection, session_id=None):
+    # Chunks are transcribed/extracted concurrently but delivered in order;
+    # results go through the connection's bounded send queue
+    send = _list_sender(connection, session_id) if session_id else connection.send
+    # Each chunk is transcribed and extracted with the tail of the ones before it
+    rolling = transcript_context.RollingContext() if transcript_context.TRANSCRIPT_CONTEXT else None
+    pipeline = ChunkPipeline(process_chunk_async, send, discard=_discard_chunk)
+    
+    async def submit(data, filename="audio.webm"):
+        # The slot is taken in submission order, like the pipeline's own seq
+        return await pipeline.submit(data, filename, rolling.slot() if rolling else None)
+    
+    # Small consecutive chunks are merged into one Whisper request
+    coalescer = AsyncChunkCoalescer(submit) if COALESCE_ENABLED else None
+    connection.stages = [stage for stage in (coalescer, pipeline) if stage is not None]
     
     try:
         while True:
-            # Receive binary data from the WebSocket
-            data = await websocket.receive_bytes()
+            # Audio arrives as binary frames; text frames are list messages
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            connection.touch()
+            data = message.get("bytes")
+            if data is None:
+                await _handle_list_message(message.get("text") or "", connection, session_id)
+                continue
             
             # Check for end-of-stream marker
             if len(data) == 1 and data[0] == 255:
-                # Send completion message
-                await manager.send_json(websocket, {"status": "completed"})
+                # Flush buffered audio, then send the completion message once
+                # in-flight chunks have drained
+                if coalescer:
+                    await coalescer.flush()
+                await pipeline.end_of_stream()
                 continue
             
-            # Process the complete audio chunk
-            # No need to accumulate, each chunk is a valid audio file now
+            # Each chunk is a valid audio file; short ones are coalesced first
             if len(data) > 0:
-                await process_audio_async(data, websocket)
+                if coalescer:
+                    await coalescer.add(data)
+                else:
+                    await submit(data)
                 
     except WebSocketDisconnect:
-        manager.disconnect(websocket)
-    except Exception as e:
-        print(f"WebSocket error: {str(e)}")
-        if websocket in manager.active_connections:
-            manager.disconnect(websocket)
+        pass
+    except Exception:
+        log.exception("WebSocket error")
+    finally:
+        if coalescer:
+            await coalescer.close()
+        await pipeline.close()
+        await manager.disconnect(connection)
 
 @app.post("/transcribe/", response_model=List[GroceryItem])
 async def transcribe_audio(file: UploadFile = File(...)):
-    # Save the uploaded file temporarily
-    temp_file_path = f"/tmp/temp_{file.filename}"  # Use /tmp for Lambda
-    with open(temp_file_path, "wb") as buffer:
-        buffer.write(await file.read())
-    
     try:
-        # Use OpenAI Whisper to transcribe the audio
-        with open(temp_file_path, "rb") as audio_file:
-            client = openai.OpenAI(api_key=OPENAI_API_KEY)
-            transcript = client.audio.transcriptions.create(
+        async with openai_client.upstream_slot():
+            return await _transcribe_upload(file)
+    except openai_client.UpstreamBusy:
+        metrics.inc("grocery_busy_total", pipeline="upload")
+        raise HTTPException(status_code=503, detail="Server busy, try again shortly", headers={"Retry-After": "1"})
+
+async def _transcribe_file(client, file: UploadFile, pipeline):
+    """Preprocess and transcribe one spooled upload; "" when it holds no speech"""
+    stage = "preprocess"
+    try:
+        # Starlette has already spooled the upload (in memory up to 1 MB, then
+        # on disk), so hand that file to Whisper and let httpx stream it out
+        # in pieces rather than reading the whole recording into memory
+        file.file.seek(0)
+        upload = (os.path.basename(file.filename or "audio.webm"), file.file)
+        
+        # Audio we can decode (WAV, or anything with ffmpeg) is read in for
+        # silence trimming; recordings without speech never reach Whisper
+        head = file.file.read(12)
+        file.file.seek(0)
+        if (file.size is None or file.size <= audio_preprocess.AUDIO_PREPROCESS_MAX_BYTES) and audio_preprocess.can_decode(head):
+            with metrics.timer("grocery_stage_seconds", pipeline=pipeline, stage="preprocess"):
+                audio_data = await asyncio.to_thread(file.file.read)
+                prepared = await asyncio.to_thread(audio_preprocess.preprocess, audio_data, upload[0])
+            if prepared is None:
+                metrics.inc("grocery_empty_transcripts_total", pipeline=pipeline)
+                return ""
+            upload = prepared
+        
+        stage = "transcribe"
+        
+        async def attempt(timeout):
+            # Retries resend the same spooled file from the start
+            if hasattr(upload[1], "seek"):
+                upload[1].seek(0)
+            return await client.audio.transcriptions.create(
                 model="whisper-1",
-                file=audio_file,
-                response_format="text"
+                file=upload,
+                response_format="text",
+                timeout=timeout
             )
         
-        print(transcript)
-        # Process the transcript to extract grocery items
-        # This is a simplified version. In a real app, you'd use more sophisticated NLP
-        
-        user_prompt = f"Here's the transcript: {transcript}\n\nPlease extract the grocery items with their quantities following the guidelines for Tamil quantity terms."
+        with metrics.timer("grocery_stage_seconds", pipeline=pipeline, stage="transcribe"):
+            # Concurrent hedged attempts can't share one file position
+            transcript = await call_policy.get_policy("transcription").call_async(
+                attempt, hedge=not hasattr(upload[1], "seek"))
         
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": SYSTEM_PROMPT},
-                {"role": "user", "content": user_prompt}
-            ],
-            response_format={"type": "json_object"}
-        )
+        log.debug("Transcribed", transcript=transcript)
+        if not transcript.strip():
+            metrics.inc("grocery_empty_transcripts_total", pipeline=pipeline)
+        return transcript
+    except Exception:
+        metrics.inc("grocery_errors_total", pipeline=pipeline, stage=stage)
+        raise
+
+async def _transcribe_upload(file: UploadFile):
+    started = time.perf_counter()
+    metrics.inc("grocery_chunks_total", pipeline="upload")
+    try:
+        client = openai_client.get_async_client()
+        transcript = await _transcribe_file(client, file, "upload")
+        if not transcript.strip():
+            return []
         
-        # Parse the JSON response
-        result = response.choices[0].message.content
-        import json
-        grocery_items = json.loads(result).get("items", [])
+        # Process the transcript to extract grocery items
+        try:
+            with metrics.timer("grocery_stage_seconds", pipeline="upload", stage="extract"):
+                grocery_items = await extract_items_async(client, transcript, SYSTEM_PROMPT, USER_PROMPT)
+        except Exception:
+            metrics.inc("grocery_errors_total", pipeline="upload", stage="extract")
+            raise
+        metrics.inc("grocery_items_total", len(grocery_items), pipeline="upload")
         
         return grocery_items
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing audio: {str(e)}")
     finally:
-        # Clean up the temporary file
-        if os.path.exists(temp_file_path):
-            os.remove(temp_file_path)
+        metrics.observe("grocery_stage_seconds", time.perf_counter() - started, pipeline="upload", stage="total")
+
+@app.post("/transcribe/batch/")
+async def transcribe_batch(request: Request):
+    """
+    Several recordings as multipart "files" parts. Responds with NDJSON, one
+    {"index", "file", "items"} (or "error") line per file as it finishes,
+    then {"status": "completed"}.
+    """
+    # The form is parsed here rather than by FastAPI, which would close the
+    # uploads before the streamed response is sent
+    try:
+        form = await request.form(max_files=batch_upload.BATCH_MAX_FILES)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Invalid batch upload: {str(e)}")
+    files = [part for part in form.getlist("files") if isinstance(part, StarletteUploadFile)]
+    if not files:
+        await form.close()
+        raise HTTPException(status_code=400, detail='No files; send recordings as "files" parts')
+    return StreamingResponse(_batch_lines(form, files), media_type="application/x-ndjson")
+
+async def _batch_lines(form, files):
+    started = time.perf_counter()
+    client = openai_client.get_async_client()
+    
+    async def transcribe_one(file):
+        metrics.inc("grocery_chunks_total", pipeline="batch")
+        if file.size is not None and file.size > UPLOAD_MAX_BYTES:
+            raise ValueError(f"File too large, limit is {UPLOAD_MAX_BYTES} bytes")
+        async with openai_client.upstream_slot():
+            return await _transcribe_file(client, file, "batch")
+    
+    async def extract_group(transcripts):
+        try:
+            async with openai_client.upstream_slot():
+                with metrics.timer("grocery_stage_seconds", pipeline="batch", stage="extract"):
+                    return await extraction.extract_batch_async(client, transcripts, SYSTEM_PROMPT, USER_PROMPT)
+        except Exception:
+            metrics.inc("grocery_errors_total", pipeline="batch", stage="extract")
+            raise
+    
+    try:
+        async for result in batch_upload.run_batch(files, transcribe_one, extract_group, extraction.EXTRACTION_PACK_MAX):
+            if result.get("busy"):
+                metrics.inc("grocery_busy_total", pipeline="batch")
+            metrics.inc("grocery_items_total", len(result.get("items", [])), pipeline="batch")
+            yield fast_json.dumps(result) + "\n"
+        yield fast_json.dumps({"status": "completed", "files": len(files)}) + "\n"
+    finally:
+        await form.close()
+        metrics.observe("grocery_stage_seconds", time.perf_counter() - started, pipeline="batch", stage="total")
 
-# This section will be used when running locally, not in Lambda
+# This section will be used when running locally, not in Lambda; see serve.py
 if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000) 
\ No newline at end of file
+    import serve
+    serve.main()
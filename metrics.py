@@ -0,0 +1,148 @@
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+import logs
+
+log = logs.get_logger("metrics")
+
+# Minimal in-process metrics, rendered in the Prometheus text format by the
+# /metrics route. Stage timings are summaries whose p50/p95/p99 come from a
+# sliding window of the most recent METRICS_WINDOW observations per series,
+# so recording is an append under a lock and the sorting only happens when
+# the endpoint is scraped. Each uvicorn worker keeps its own numbers.
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+METRICS_WINDOW = int(os.getenv("METRICS_WINDOW", "2048"))
+QUANTILES = (0.5, 0.95, 0.99)
+
+_lock = threading.Lock()
+_descriptions = {}  # name -> (type, help)
+_counters = {}      # (name, labels) -> value
+_summaries = {}     # (name, labels) -> [window, sum, count]
+_gauges = []        # (name, help, fn) evaluated at render time
+
+def describe(name, kind, help_text):
+    _descriptions[name] = (kind, help_text)
+
+describe("grocery_stage_seconds", "summary", "Time spent in each stage of a pipeline")
+describe("grocery_upstream_seconds", "summary", "Latency of OpenAI calls")
+describe("grocery_preprocess_seconds", "summary", "Audio decode, VAD and trimming time")
+describe("grocery_parse_seconds", "summary", "Time spent parsing model output into items")
+describe("grocery_chunks_total", "counter", "Audio chunks or uploads processed")
+describe("grocery_items_total", "counter", "Grocery items returned to clients")
+describe("grocery_errors_total", "counter", "Errors by pipeline and stage")
+describe("grocery_empty_transcripts_total", "counter", "Chunks whose transcript was empty")
+describe("grocery_busy_total", "counter", "Chunks/uploads rejected because every upstream slot was taken")
+describe("grocery_upstream_retries_total", "counter", "OpenAI attempts retried by the call policy")
+describe("grocery_upstream_hedges_total", "counter", "Hedged second requests sent")
+describe("grocery_upstream_hedge_wins_total", "counter", "Hedged calls by which request answered first")
+describe("grocery_circuit_opened_total", "counter", "Times a circuit breaker opened")
+describe("grocery_circuit_rejections_total", "counter", "Calls failed fast by an open circuit")
+describe("grocery_extraction_routed_total", "counter", "Extraction requests by the model first chosen")
+describe("grocery_extraction_escalations_total", "counter", "Small-model extractions redone on the large model, by reason")
+describe("grocery_extraction_unpacked_total", "counter", "Batch transcripts re-extracted on their own after a packed request, by reason")
+describe("grocery_tokens_total", "counter", "Chat tokens billed, by model and kind (prompt, cached_prompt, completion)")
+describe("grocery_dropped_messages_total", "counter", "Messages dropped for slow WebSocket clients")
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+def inc(name, value=1, **labels):
+    if not METRICS_ENABLED:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+def observe(name, seconds, **labels):
+    if not METRICS_ENABLED:
+        return
+    key = _key(name, labels)
+    with _lock:
+        series = _summaries.get(key)
+        if series is None:
+            series = _summaries[key] = [deque(maxlen=METRICS_WINDOW), 0.0, 0]
+        series[0].append(seconds)
+        series[1] += seconds
+        series[2] += 1
+
+@contextmanager
+def timer(name, **labels):
+    """Observe the duration of the with-block, whether or not it raises"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+def register_gauge(name, help_text, fn):
+    """fn() returns the current value; it is called on every scrape"""
+    _gauges.append((name, help_text, fn))
+
+def register_stats(prefix, fn):
+    """Expose every numeric value of a get_stats()-style dict as a gauge"""
+    _gauges.append((prefix, None, fn))
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (
+        (k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in pairs
+    )
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+def _quantile(ordered, q):
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+def render():
+    """Prometheus text exposition of everything recorded in this process"""
+    with _lock:
+        counters = dict(_counters)
+        summaries = {key: (sorted(window), total, count) for key, (window, total, count) in _summaries.items()}
+
+    lines = []
+    described = set()
+
+    def header(name, kind, help_text):
+        if name not in described:
+            described.add(name)
+            if help_text:
+                lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+    for (name, labels), (ordered, total, count) in sorted(summaries.items()):
+        header(name, "summary", _descriptions.get(name, (None, None))[1])
+        for q in QUANTILES:
+            lines.append(f"{name}{_format_labels(labels, [('quantile', q)])} {_quantile(ordered, q):.6f}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {total:.6f}")
+        lines.append(f"{name}_count{_format_labels(labels)} {count}")
+
+    for (name, labels), value in sorted(counters.items()):
+        header(name, "counter", _descriptions.get(name, (None, None))[1])
+        lines.append(f"{name}{_format_labels(labels)} {value}")
+
+    for name, help_text, fn in _gauges:
+        try:
+            value = fn()
+        except Exception as e:
+            log.warning("Metrics gauge failed", gauge=name, error=e)
+            continue
+        if isinstance(value, dict):
+            for key, item in value.items():
+                if isinstance(item, (int, float)) and not isinstance(item, bool):
+                    header(f"{name}_{key}", "gauge", None)
+                    lines.append(f"{name}_{key} {item}")
+        else:
+            header(name, "gauge", help_text)
+            lines.append(f"{name} {value}")
+
+    return "\n".join(lines) + "\n"
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _summaries.clear()
@@ -0,0 +1,121 @@
+import os
+import re
+import threading
+from pydantic import ValidationError
+import grocery_rules
+import logs
+import metrics
+from models import GroceryItem
+
+log = logs.get_logger("model_router")
+
+# Picks the chat model for extraction. Most transcripts that reach GPT are one
+# or two short segments, which the small model answers faster and cheaper;
+# long, many-segment or idiom-heavy mixed-script text goes to the large model.
+# The small model's output is checked against the GroceryItem schema and a few
+# known failure modes (transliterated Tamil, "0.25 kg" instead of "250 grams",
+# nothing found in text that clearly names a quantity), and the request is
+# escalated to the large model when a check fails.
+
+EXTRACTION_ROUTING = os.getenv("EXTRACTION_ROUTING", "1") == "1"
+EXTRACTION_SMALL_MODEL = os.getenv("EXTRACTION_SMALL_MODEL", "gpt-4o-mini")
+EXTRACTION_LARGE_MODEL = os.getenv("EXTRACTION_LARGE_MODEL", "gpt-4o")
+# Text longer than this, or scoring above ROUTER_MAX_COMPLEXITY, goes straight
+# to the large model. The score is one point per segment, one for mixed
+# Tamil/Latin script and two for Tamil fraction idioms ("கால் கிலோ")
+ROUTER_MAX_CHARS = int(os.getenv("ROUTER_MAX_CHARS", "200"))
+ROUTER_MAX_COMPLEXITY = int(os.getenv("ROUTER_MAX_COMPLEXITY", "3"))
+
+_TAMIL_RE = re.compile(r"[஀-௿]")
+_LATIN_RE = re.compile(r"[A-Za-z]")
+_WORD_RE = re.compile(r"[^\s,.;!?]+")
+# "0.25 kg", ".5 kilo": the prompt asks for "250 grams"
+_FRACTIONAL_KG_RE = re.compile(r"^\s*0?\.\d+\s*(kg|kgs|kilo|kilos|kilogram|kilograms)\b", re.IGNORECASE)
+
+# Words that show the text is asking for something, so an empty answer is suspect
+_QUANTITY_WORDS = (
+    set(grocery_rules.NUMBER_WORDS) | set(grocery_rules.FRACTION_WORDS) | set(grocery_rules.UNIT_WORDS)
+) - {"a", "an", "l", "g"}
+
+_stats_lock = threading.Lock()
+_stats = {
+    "routed_small": 0,
+    "routed_large": 0,
+    "escalated": 0,
+}
+
+def _count(**increments):
+    with _stats_lock:
+        for key, value in increments.items():
+            _stats[key] += value
+
+def get_stats():
+    """Routing counters, plus the share of small-model requests that were escalated"""
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["escalation_rate"] = stats["escalated"] / stats["routed_small"] if stats["routed_small"] else 0.0
+    return stats
+
+def reset_stats():
+    with _stats_lock:
+        for key in _stats:
+            _stats[key] = 0
+
+def _words(text):
+    return [word.lower() for word in _WORD_RE.findall(text)]
+
+def complexity(text):
+    score = len(grocery_rules.split_segments(text))
+    if _TAMIL_RE.search(text) and _LATIN_RE.search(text):
+        score += 1
+    if any(word in grocery_rules.FRACTION_WORDS for word in _words(text)):
+        score += 2
+    return score
+
+def choose_model(text):
+    """Model to try first for this transcript remainder"""
+    if not EXTRACTION_ROUTING or EXTRACTION_SMALL_MODEL == EXTRACTION_LARGE_MODEL:
+        model = EXTRACTION_LARGE_MODEL
+    elif len(text) > ROUTER_MAX_CHARS or complexity(text) > ROUTER_MAX_COMPLEXITY:
+        model = EXTRACTION_LARGE_MODEL
+    else:
+        model = EXTRACTION_SMALL_MODEL
+    _count(**{"routed_small" if model == EXTRACTION_SMALL_MODEL else "routed_large": 1})
+    metrics.inc("grocery_extraction_routed_total", model=model)
+    return model
+
+def can_escalate(model):
+    return model != EXTRACTION_LARGE_MODEL
+
+def item_problem(item):
+    """Why a single extracted item can't be trusted, or None"""
+    try:
+        item = GroceryItem.model_validate(item)
+    except ValidationError:
+        return "schema"
+    if not item.english_name.strip() or not _TAMIL_RE.search(item.tamil_name):
+        return "names"
+    if _FRACTIONAL_KG_RE.match(item.weight):
+        return "fractional_weight"
+    return None
+
+def review(text, items):
+    """
+    Why a whole extraction can't be trusted, or None. items is None when the
+    model's output wasn't valid JSON.
+    """
+    if items is None or not isinstance(items, list):
+        return "invalid_json"
+    for item in items:
+        problem = item_problem(item)
+        if problem:
+            return problem
+    if not items and any(word.isdigit() or word in _QUANTITY_WORDS for word in _words(text)):
+        return "empty"
+    return None
+
+def escalated(model, reason):
+    """Record that a request on `model` is being retried on the large model"""
+    log.info("Escalating extraction", model=model, to=EXTRACTION_LARGE_MODEL, reason=reason)
+    _count(escalated=1)
+    metrics.inc("grocery_extraction_escalations_total", reason=reason)
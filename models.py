@@ -0,0 +1,8 @@
+from pydantic import BaseModel
+from typing import Optional
+
+class GroceryItem(BaseModel):
+    tamil_name: str
+    english_name: str
+    weight: str  # For weights like "500 grams", "1 kg", "1 litre", etc.
+    quantity: Optional[int] = None  # Numerical quantity if specified
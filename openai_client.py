@@ -0,0 +1,103 @@
+import asyncio
+import os
+from contextlib import asynccontextmanager
+import httpx
+import openai
+
+# Shared OpenAI clients, one per process, so every request reuses the same
+# keep-alive connection pool instead of paying a TCP/TLS handshake per chunk.
+
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "100"))
+OPENAI_MAX_KEEPALIVE = int(os.getenv("OPENAI_MAX_KEEPALIVE", "20"))
+OPENAI_KEEPALIVE_EXPIRY = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", "60"))
+OPENAI_CONNECT_TIMEOUT = float(os.getenv("OPENAI_CONNECT_TIMEOUT", "5"))
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "60"))
+# Retries, deadlines and hedging are handled by call_policy; keep the SDK from
+# retrying underneath it
+OPENAI_SDK_RETRIES = int(os.getenv("OPENAI_SDK_RETRIES", "0"))
+
+# Admission control: at most OPENAI_MAX_INFLIGHT chunks/uploads per worker do
+# upstream work at once. Callers wait up to OPENAI_BUSY_TIMEOUT seconds for a
+# slot and are then told the server is busy rather than queueing without limit.
+OPENAI_MAX_INFLIGHT = int(os.getenv("OPENAI_MAX_INFLIGHT", "64"))
+OPENAI_BUSY_TIMEOUT = float(os.getenv("OPENAI_BUSY_TIMEOUT", "2"))
+
+_async_client = None
+_sync_client = None
+_slots = None
+_inflight = 0
+
+class UpstreamBusy(Exception):
+    """Raised when no upstream slot frees up within OPENAI_BUSY_TIMEOUT"""
+
+def _api_key():
+    # Read lazily so a .env loaded after import is still picked up
+    return os.getenv("OPENAI_API_KEY", "your-api-key-here")
+
+def _limits():
+    return httpx.Limits(
+        max_connections=OPENAI_MAX_CONNECTIONS,
+        max_keepalive_connections=OPENAI_MAX_KEEPALIVE,
+        keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY,
+    )
+
+def _timeout():
+    return httpx.Timeout(OPENAI_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT)
+
+def create_async_client():
+    """Build an AsyncOpenAI client backed by a tuned keep-alive httpx pool"""
+    http_client = httpx.AsyncClient(limits=_limits(), timeout=_timeout())
+    return openai.AsyncOpenAI(api_key=_api_key(), http_client=http_client, max_retries=OPENAI_SDK_RETRIES)
+
+def create_sync_client():
+    """Build a blocking OpenAI client backed by a tuned keep-alive httpx pool"""
+    http_client = httpx.Client(limits=_limits(), timeout=_timeout())
+    return openai.OpenAI(api_key=_api_key(), http_client=http_client, max_retries=OPENAI_SDK_RETRIES)
+
+def get_async_client():
+    """Return the process-wide AsyncOpenAI client, creating it on first use"""
+    global _async_client
+    if _async_client is None:
+        _async_client = create_async_client()
+    return _async_client
+
+def get_sync_client():
+    """Return the process-wide blocking OpenAI client, creating it on first use"""
+    global _sync_client
+    if _sync_client is None:
+        _sync_client = create_sync_client()
+    return _sync_client
+
+@asynccontextmanager
+async def upstream_slot():
+    """Hold one of the worker's OPENAI_MAX_INFLIGHT upstream slots"""
+    global _slots, _inflight
+    if _slots is None:
+        _slots = asyncio.Semaphore(OPENAI_MAX_INFLIGHT)
+    try:
+        await asyncio.wait_for(_slots.acquire(), OPENAI_BUSY_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise UpstreamBusy(f"{OPENAI_MAX_INFLIGHT} upstream requests already in flight")
+    _inflight += 1
+    try:
+        yield
+    finally:
+        _inflight -= 1
+        _slots.release()
+
+def inflight():
+    """Upstream slots currently held"""
+    return _inflight
+
+async def startup():
+    # Create the async client eagerly so the first request doesn't pay for it
+    get_async_client()
+
+async def shutdown():
+    global _async_client, _sync_client
+    if _async_client is not None:
+        await _async_client.close()
+        _async_client = None
+    if _sync_client is not None:
+        _sync_client.close()
+        _sync_client = None
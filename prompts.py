@@ -0,0 +1,103 @@
+import os
+
+# Extraction prompts, shared by the FastAPI app and the Lambda handler. Every
+# request is [system prompt][user prompt with the transcript at the end]. The
+# compact variant saves prompt tokens on every call (738 characters of system
+# prompt against 1768 for the original); both are far below
+# the 1024 tokens OpenAI needs before it caches a prefix, so upstream prompt
+# caching doesn't apply. Bump a variant's revision whenever its text changes;
+# the revision is logged with token usage and the extraction cache keys on
+# the text itself.
+
+# "full" (default), the original long-form instructions, or "compact". Stays
+# on "full" until benchmarks/prompt_eval.py, run against recorded responses,
+# shows the compact variant is as accurate
+EXTRACTION_PROMPT = os.getenv("EXTRACTION_PROMPT", "full")
+
+FULL_SYSTEM_PROMPT = """
+Extract grocery items from the provided text. The text may contain items in Tamil and English.
+For each item, provide:
+1. The Tamil name in Tamil script (தமிழ் எழுத்து) - NOT transliterated
+2. The English name (translate if only Tamil name is given)
+3. The weight in English (e.g., "500 grams", "1 kg", "1 litre", "1 ml", etc.)
+4. The quantity as a number (if specifically mentioned)
+
+IMPORTANT NOTES ON TAMIL QUANTITIES:
+- "கால் கிலோ" (kaal kilo) means "250 grams", NOT 0.25 kilograms
+- "அரை கிலோ" (arai kilo) means "500 grams", NOT half kilogram
+- "முக்கால் கிலோ" (mukkaal kilo) means "750 grams", NOT 0.75 kilograms
+- If someone says "அரை கிலோ ரெண்டு" (arai kilo rendu), it means quantity = 2, weight = "500 grams"
+- Always express weights in English (grams, kg, litre, ml, etc.)
+- If only a quantity is mentioned (like "2 apples"), set weight to an empty string and quantity to the number
+
+CRITICAL INSTRUCTIONS FOR TAMIL SPELLING:
+- Maintain Tamil words in proper Tamil script (UTF-8) characters
+- Do NOT transliterate Tamil words to English/Roman script
+- Ensure correct Tamil spelling with proper vowel and consonant marks
+- Common Tamil grocery items should appear in Tamil script, for example:
+  * "அரிசி" (rice)
+  * "வெங்காயம்" (onion)
+  * "தக்காளி" (tomato)
+  * "மிளகாய்" (chili)
+  * "பட்டாணி" (peas)
+  * "கீரை" (greens)
+- If the audio contains Tamil words in Tamil script, preserve them as-is
+- If the audio contains transliterated Tamil words, convert them to proper Tamil script
+
+Return a JSON array with objects having the keys 'tamil_name', 'english_name', 'weight', and 'quantity'.
+The response should be in this format: {"items": [{"tamil_name": "", "english_name": "", "weight": "", "quantity": null}]}
+If no quantity is specified, set it to null.
+"""
+
+# Same rules in under half the text
+COMPACT_SYSTEM_PROMPT = """Extract grocery items from a Tamil/English shopping transcript.
+Reply with JSON only: {"items": [{"tamil_name": "", "english_name": "", "weight": "", "quantity": null}]}
+- tamil_name: Tamil script with correct spelling (அரிசி, வெங்காயம், தக்காளி), never transliterated; write transliterated Tamil in Tamil script
+- english_name: English name, translated if only Tamil was said
+- weight: English units ("500 grams", "1 kg", "1 litre", "200 ml"), "" if none
+- quantity: whole-number count if said, else null
+Tamil fractions are grams: கால் கிலோ (kaal kilo) = "250 grams", அரை கிலோ (arai kilo) = "500 grams", முக்கால் கிலோ (mukkaal kilo) = "750 grams".
+"அரை கிலோ ரெண்டு" = quantity 2, weight "500 grams". "2 apples" = quantity 2, weight "".
+"""
+
+USER_PROMPT = "Extract grocery items with quantities in Tamil or English.\n\nTranscript: {transcript}"
+
+# Several numbered transcripts in one request (batch uploads), with the same
+# system prompt as single-transcript calls
+BATCH_USER_PROMPT = (
+    "Extract grocery items with quantities in Tamil or English, separately for each numbered transcript. "
+    'Reply with {{"transcripts": {{"1": {{"items": [...]}}, "2": {{"items": [...]}}}}}}, '
+    "one entry per transcript number, using the item format above.\n\n{transcript}"
+)
+
+# Streaming sessions (transcript_context.py): the tail of the earlier
+# transcript goes before the new text, so a phrase cut at a chunk boundary is
+# read whole, and only items mentioned in the new text are extracted
+CONTEXT_USER_PROMPT = (
+    "Extract grocery items with quantities in Tamil or English mentioned in the new text. "
+    "The earlier text is context only: don't list its items, but use it to complete an item "
+    "whose name, weight or quantity was cut off where the new text begins.\n\n"
+    "Earlier text: {context}\n\nNew text: {transcript}"
+)
+
+# variant -> (revision, system prompt, user prompt template)
+PROMPT_VARIANTS = {
+    "full": (1, FULL_SYSTEM_PROMPT, USER_PROMPT),
+    "compact": (1, COMPACT_SYSTEM_PROMPT, USER_PROMPT),
+}
+
+def get_prompts(variant=None):
+    """(system prompt, user prompt template) for a variant, EXTRACTION_PROMPT by default"""
+    _, system_prompt, user_prompt = PROMPT_VARIANTS[variant or EXTRACTION_PROMPT]
+    return system_prompt, user_prompt
+
+def with_context(context):
+    """CONTEXT_USER_PROMPT with the earlier text filled in; still a {transcript} template"""
+    return CONTEXT_USER_PROMPT.replace("{context}", context.replace("{", "{{").replace("}", "}}"))
+
+def version_of(system_prompt):
+    """e.g. "compact-v1", or "custom" for a system prompt that isn't defined here"""
+    for variant, (revision, system, _) in PROMPT_VARIANTS.items():
+        if system == system_prompt:
+            return f"{variant}-v{revision}"
+    return "custom"
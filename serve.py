@@ -0,0 +1,86 @@
+import argparse
+import importlib.util
+import os
+import uvicorn
+from uvicorn.supervisors import Multiprocess
+import logs
+
+# Production entry point for the FastAPI app:
+#   python serve.py [--host H] [--port P] [--workers N]
+#
+# Runs SERVER_WORKERS uvicorn worker processes (default: one per CPU core) on
+# the uvloop event loop with the httptools HTTP parser, falling back to
+# asyncio/h11 where those aren't installed. On SIGTERM/SIGINT each worker stops
+# admitting WebSocket connections, lets open sessions finish the chunks they
+# have already sent (up to WS_DRAIN_TIMEOUT seconds) and then closes them with
+# 1012 so clients reconnect elsewhere, before uvicorn's own shutdown.
+#
+# With more than one worker, set SESSION_STORE_BACKEND=sqlite (or dynamodb) so
+# session lists and other shared state are visible to every worker.
+
+log = logs.get_logger("serve")
+
+SERVER_HOST = os.getenv("SERVER_HOST", "0.0.0.0")
+SERVER_PORT = int(os.getenv("SERVER_PORT", "8000"))
+SERVER_WORKERS = int(os.getenv("SERVER_WORKERS", "0"))  # 0: one per CPU core
+SERVER_BACKLOG = int(os.getenv("SERVER_BACKLOG", "2048"))
+SERVER_KEEPALIVE = float(os.getenv("SERVER_KEEPALIVE", "5"))
+# Seconds uvicorn waits for HTTP requests after the WebSocket drain
+SERVER_GRACEFUL_TIMEOUT = float(os.getenv("SERVER_GRACEFUL_TIMEOUT", "30"))
+SERVER_LOG_LEVEL = os.getenv("SERVER_LOG_LEVEL", "info")
+
+def worker_count():
+    return SERVER_WORKERS or os.cpu_count() or 1
+
+def _installed(module):
+    return importlib.util.find_spec(module) is not None
+
+class DrainingServer(uvicorn.Server):
+    """uvicorn.Server that drains the app's WebSocket sessions before shutting down"""
+
+    async def shutdown(self, sockets=None):
+        # uvicorn closes WebSocket connections at the start of its shutdown,
+        # so the drain has to run first, while sessions can still be served
+        import main
+        await main.manager.drain()
+        await super().shutdown(sockets=sockets)
+
+def build_config(workers=None, host=None, port=None):
+    loop = "uvloop" if _installed("uvloop") else "asyncio"
+    http = "httptools" if _installed("httptools") else "h11"
+    return uvicorn.Config(
+        "main:app",
+        host=host or SERVER_HOST,
+        port=port or SERVER_PORT,
+        workers=workers or worker_count(),
+        loop=loop,
+        http=http,
+        backlog=SERVER_BACKLOG,
+        timeout_keep_alive=SERVER_KEEPALIVE,
+        timeout_graceful_shutdown=SERVER_GRACEFUL_TIMEOUT,
+        # API Gateway / load balancers in front set X-Forwarded-*
+        proxy_headers=True,
+        forwarded_allow_ips="*",
+        log_level=SERVER_LOG_LEVEL,
+        # Our loggers write JSON lines themselves; keep uvicorn's access log off
+        access_log=False,
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the app with production settings")
+    parser.add_argument("--host", help=f"default SERVER_HOST ({SERVER_HOST})")
+    parser.add_argument("--port", type=int, help=f"default SERVER_PORT ({SERVER_PORT})")
+    parser.add_argument("--workers", type=int, help=f"default SERVER_WORKERS, else CPU cores ({worker_count()})")
+    args = parser.parse_args()
+    config = build_config(args.workers, args.host, args.port)
+    server = DrainingServer(config)
+    log.info("Starting server", host=config.host, port=config.port, workers=config.workers,
+             loop=config.loop, http=config.http)
+    if config.workers > 1:
+        # Workers share one listening socket; the supervisor restarts any that die
+        Multiprocess(config, target=server.run, sockets=[config.bind_socket()]).run()
+    else:
+        server.run()
+
+if __name__ == "__main__":
+    main()
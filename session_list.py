@@ -0,0 +1,178 @@
+import os
+import re
+import time
+import unicodedata
+import logs
+
+log = logs.get_logger("session_list")
+
+# Server-side grocery list per session, for clients that connect with a
+# session id. Items are merged on their normalized name plus unit-normalized
+# weight ("Tomatoes"/"thakkali" and "1 kg"/"1000 grams" are the same entry),
+# so a repeated mention changes nothing and a correction updates the entry.
+# Clients get versioned deltas that only carry the entries that changed:
+#
+#   {"type": "delta", "version": 5, "base": 4, "ops": [
+#       {"op": "add", "id": 3, "item": {...}},
+#       {"op": "update", "id": 3, "item": {...}},
+#       {"op": "remove", "id": 3}]}
+#
+# A client that sees a base other than its own version (or reconnects) sends
+# {"type": "sync", "version": n} and gets the deltas since n, or the whole
+# list as {"type": "list", "version": v, "items": [{"id": 3, ...}]} once
+# those have left the log. {"type": "remove", "id": n} deletes an entry.
+#
+# State lives in the session store (session_store.py) so Lambda containers
+# share it, and expires SESSION_LIST_TTL seconds after the last change.
+
+SESSION_LIST_MAX_ITEMS = int(os.getenv("SESSION_LIST_MAX_ITEMS", "500"))
+# Versions kept for resyncing; older clients get the whole list
+SESSION_LIST_LOG_SIZE = int(os.getenv("SESSION_LIST_LOG_SIZE", "64"))
+SESSION_LIST_TTL = float(os.getenv("SESSION_LIST_TTL", "3600"))
+# Seconds between sweeps of expired sessions out of an in-process store
+SESSION_LIST_PURGE_INTERVAL = float(os.getenv("SESSION_LIST_PURGE_INTERVAL", "60"))
+# API Gateway closes WebSocket connections after two hours
+CONNECTION_MAX_SECONDS = 2 * 3600
+
+_SESSION_ID_RE = re.compile(r"^[A-Za-z0-9_.:-]{1,128}$")
+_SPACE_RE = re.compile(r"\s+")
+_FIELDS = ("tamil_name", "english_name", "weight", "quantity")
+
+def valid_session_id(session_id):
+    return isinstance(session_id, str) and bool(_SESSION_ID_RE.match(session_id))
+
+def _normalize(text):
+    return _SPACE_RE.sub(" ", unicodedata.normalize("NFC", str(text or ""))).strip().lower()
+
+def item_key(item):
+    """Merge key: canonical name plus weight in grams/ml where it parses"""
+    # Imported here so binding a session on Lambda $connect doesn't load pydantic
+    import grocery_rules
+    name = (grocery_rules.canonical_name(item.get("english_name"))
+            or grocery_rules.canonical_name(item.get("tamil_name"))
+            or _normalize(item.get("english_name")) or _normalize(item.get("tamil_name")))
+    weight = grocery_rules.parse_weight(item.get("weight"))
+    weight = f"{weight[0]:g}{weight[1]}" if weight else _normalize(item.get("weight"))
+    return f"{name.lower()}|{weight}"
+
+def _merge(old, new):
+    """
+    old with its empty fields filled from new and new's quantity (a spoken
+    correction), or None if nothing changes. Names and weight keep their
+    first spelling, which new only matched after normalization.
+    """
+    merged = dict(old)
+    for field in _FIELDS:
+        if new.get(field) not in (None, "") and (field == "quantity" or merged.get(field) in (None, "")):
+            merged[field] = new[field]
+    return None if merged == old else merged
+
+def _compact(ops):
+    """One op per entry with its final state; an entry added since the base stays an add"""
+    latest = {}
+    for op in ops:
+        previous = latest.pop(op["id"], None)
+        if previous is not None and previous["op"] == "add":
+            if op["op"] == "remove":
+                continue
+            op = dict(op, op="add")
+        latest[op["id"]] = op
+    return list(latest.values())
+
+def _new_state():
+    return {"version": 0, "next_id": 1, "items": {}, "keys": {}, "log": []}
+
+class SessionList:
+    def __init__(self, store, ttl=None, max_items=None, log_size=None):
+        self.store = store
+        self.ttl = SESSION_LIST_TTL if ttl is None else ttl
+        self.max_items = max_items or SESSION_LIST_MAX_ITEMS
+        self.log_size = log_size or SESSION_LIST_LOG_SIZE
+        self.last_purge = time.monotonic()
+
+    @staticmethod
+    def _key(session_id):
+        return f"grocery-list:{session_id}"
+
+    @staticmethod
+    def _binding_key(connection_id):
+        return f"grocery-list-connection:{connection_id}"
+
+    def bind(self, connection_id, session_id):
+        """Remember the session of a Lambda connection ($default events don't carry it)"""
+        self.store.put(self._binding_key(connection_id), session_id, ttl=CONNECTION_MAX_SECONDS)
+
+    def session_of(self, connection_id):
+        return self.store.get(self._binding_key(connection_id))
+
+    def _maybe_purge(self):
+        # MemoryStore only drops expired keys when they are read again
+        now = time.monotonic()
+        if now - self.last_purge >= SESSION_LIST_PURGE_INTERVAL:
+            self.last_purge = now
+            self.store.purge_expired()
+
+    def _commit(self, session_id, change):
+        """Apply change(state) -> ops under the store's lock; returns the delta or None"""
+        self._maybe_purge()
+
+        def update(state):
+            state = state or _new_state()
+            ops = change(state)
+            if not ops:
+                return state, None
+            base = state["version"]
+            state["version"] += 1
+            state["log"].append({"version": state["version"], "ops": ops})
+            del state["log"][:-self.log_size]
+            return state, {"type": "delta", "version": state["version"], "base": base, "ops": ops}
+
+        return self.store.update(self._key(session_id), update, ttl=self.ttl)
+
+    def apply(self, session_id, items):
+        """Merge extracted items; returns the delta message, or None if the list is unchanged"""
+        def change(state):
+            ops = []
+            for item in items:
+                item = {field: item.get(field) for field in _FIELDS}
+                key = item_key(item)
+                item_id = state["keys"].get(key)
+                if item_id is None:
+                    if len(state["items"]) >= self.max_items:
+                        log.warning("Session list full, dropping item", items=len(state["items"]))
+                        continue
+                    item_id = state["next_id"]
+                    state["next_id"] += 1
+                    state["keys"][key] = item_id
+                    state["items"][str(item_id)] = item
+                    ops.append({"op": "add", "id": item_id, "item": item})
+                    continue
+                merged = _merge(state["items"][str(item_id)], item)
+                if merged is not None:
+                    state["items"][str(item_id)] = merged
+                    ops.append({"op": "update", "id": item_id, "item": merged})
+            return ops
+
+        return self._commit(session_id, change)
+
+    def remove(self, session_id, item_id):
+        def change(state):
+            if state["items"].pop(str(item_id), None) is None:
+                return []
+            state["keys"] = {key: value for key, value in state["keys"].items() if value != int(item_id)}
+            return [{"op": "remove", "id": int(item_id)}]
+
+        return self._commit(session_id, change)
+
+    def sync(self, session_id, version=None):
+        """Deltas since version as one delta message, or the whole list if they are gone"""
+        state = self.store.get(self._key(session_id)) or _new_state()
+        if version is not None and version == state["version"]:
+            return {"type": "delta", "version": version, "base": version, "ops": []}
+        log_entries = state["log"]
+        if (version is not None and 0 <= version < state["version"]
+                and log_entries and log_entries[0]["version"] <= version + 1):
+            ops = _compact([op for entry in log_entries if entry["version"] > version for op in entry["ops"]])
+            return {"type": "delta", "version": state["version"], "base": version, "ops": ops}
+        items = [{"id": int(item_id), **item} for item_id, item in state["items"].items()]
+        return {"type": "list", "version": state["version"], "items": items}
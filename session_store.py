@@ -0,0 +1,216 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Per-connection state for the stateless Lambda handler (pending audio,
+# partial uploads, session lists, ...). Values are JSON-serialisable dicts.
+#
+# All backends share one small interface:
+#   get(key) -> value or None
+#   put(key, value, ttl=None)
+#   delete(key)
+#   update(key, fn, ttl=None) -> result
+#       atomically applies fn(old_value_or_None) -> (new_value_or_None, result);
+#       a None new value deletes the key
+#
+# MemoryStore only works within one process (local testing, uvicorn);
+# SqliteStore is the local stand-in for a shared store; DynamoDBStore is what
+# concurrent Lambda containers need in production.
+
+SESSION_STORE_BACKEND = os.getenv("SESSION_STORE_BACKEND", "memory")
+SESSION_STORE_PATH = os.getenv("SESSION_STORE_PATH", "/tmp/grocery_sessions.sqlite3")
+SESSION_TABLE = os.getenv("SESSION_TABLE", "grocery-sessions")
+SESSION_TTL = float(os.getenv("SESSION_TTL", "3600"))
+# Set by the Lambda runtime
+ON_LAMBDA = "AWS_LAMBDA_FUNCTION_NAME" in os.environ
+
+class MemoryStore:
+    def __init__(self, default_ttl=SESSION_TTL):
+        self.default_ttl = default_ttl
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def _live(self, key, now):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires < now:
+            del self._data[key]
+            return None
+        return value
+
+    def get(self, key):
+        with self._lock:
+            value = self._live(key, time.time())
+            return json.loads(value) if value is not None else None
+
+    def put(self, key, value, ttl=None):
+        with self._lock:
+            self._data[key] = (time.time() + (ttl or self.default_ttl), json.dumps(value))
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def update(self, key, fn, ttl=None):
+        with self._lock:
+            now = time.time()
+            value = self._live(key, now)
+            new_value, result = fn(json.loads(value) if value is not None else None)
+            if new_value is None:
+                self._data.pop(key, None)
+            else:
+                self._data[key] = (now + (ttl or self.default_ttl), json.dumps(new_value))
+            return result
+
+    def purge_expired(self):
+        with self._lock:
+            now = time.time()
+            for key in [k for k, (expires, _) in self._data.items() if expires < now]:
+                del self._data[key]
+
+class SqliteStore:
+    def __init__(self, path=SESSION_STORE_PATH, default_ttl=SESSION_TTL):
+        self.path = path
+        self.default_ttl = default_ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=10, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL)"
+        )
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM sessions WHERE key = ? AND expires >= ?", (key, time.time())
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, key, value, ttl=None):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sessions (key, value, expires) VALUES (?, ?, ?)",
+                (key, json.dumps(value), time.time() + (ttl or self.default_ttl)),
+            )
+
+    def delete(self, key):
+        with self._lock:
+            self._conn.execute("DELETE FROM sessions WHERE key = ?", (key,))
+
+    def update(self, key, fn, ttl=None):
+        with self._lock:
+            # IMMEDIATE takes the write lock up front so other processes can't
+            # interleave between our read and write
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                row = self._conn.execute(
+                    "SELECT value FROM sessions WHERE key = ? AND expires >= ?", (key, now)
+                ).fetchone()
+                new_value, result = fn(json.loads(row[0]) if row else None)
+                if new_value is None:
+                    self._conn.execute("DELETE FROM sessions WHERE key = ?", (key,))
+                else:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO sessions (key, value, expires) VALUES (?, ?, ?)",
+                        (key, json.dumps(new_value), now + (ttl or self.default_ttl)),
+                    )
+                self._conn.execute("COMMIT")
+                return result
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def purge_expired(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM sessions WHERE expires < ?", (time.time(),))
+
+class DynamoDBStore:
+    """
+    Table with a string partition key "pk"; enable DynamoDB TTL on "expires".
+    update() uses optimistic concurrency on a "version" attribute.
+    """
+
+    def __init__(self, table_name=SESSION_TABLE, default_ttl=SESSION_TTL, max_retries=5):
+        import boto3
+        self.table = boto3.resource("dynamodb").Table(table_name)
+        self.default_ttl = default_ttl
+        self.max_retries = max_retries
+
+    def _get_item(self, key):
+        item = self.table.get_item(Key={"pk": key}, ConsistentRead=True).get("Item")
+        if item is None or float(item["expires"]) < time.time():
+            return None
+        return item
+
+    def get(self, key):
+        item = self._get_item(key)
+        return json.loads(item["value"]) if item else None
+
+    def put(self, key, value, ttl=None):
+        self.table.put_item(Item={
+            "pk": key, "value": json.dumps(value), "version": 0,
+            "expires": int(time.time() + (ttl or self.default_ttl)),
+        })
+
+    def delete(self, key):
+        self.table.delete_item(Key={"pk": key})
+
+    def update(self, key, fn, ttl=None):
+        from botocore.exceptions import ClientError
+        for _ in range(self.max_retries):
+            item = self._get_item(key)
+            version = int(item["version"]) if item else None
+            new_value, result = fn(json.loads(item["value"]) if item else None)
+            if version is None:
+                condition = {"ConditionExpression": "attribute_not_exists(pk) OR expires < :now",
+                             "ExpressionAttributeValues": {":now": int(time.time())}}
+            else:
+                condition = {"ConditionExpression": "version = :version",
+                             "ExpressionAttributeValues": {":version": version}}
+            try:
+                if new_value is None:
+                    if item is not None:
+                        self.table.delete_item(Key={"pk": key}, **condition)
+                else:
+                    self.table.put_item(Item={
+                        "pk": key, "value": json.dumps(new_value), "version": (version or 0) + 1,
+                        "expires": int(time.time() + (ttl or self.default_ttl)),
+                    }, **condition)
+                return result
+            except ClientError as e:
+                if e.response.get("Error", {}).get("Code") != "ConditionalCheckFailedException":
+                    raise
+        raise RuntimeError(f"Too much contention updating session key {key}")
+
+    def purge_expired(self):
+        pass  # handled by DynamoDB TTL
+
+def create_store(backend=None, path=None, table_name=None):
+    backend = backend or SESSION_STORE_BACKEND
+    if backend == "sqlite":
+        return SqliteStore(path or SESSION_STORE_PATH)
+    if backend == "dynamodb":
+        return DynamoDBStore(table_name or SESSION_TABLE)
+    return MemoryStore()
+
+_store = None
+
+def container_local(store=None):
+    """
+    True when other Lambda containers can't see the store (memory, or SQLite
+    under a container's own /tmp), so state that must follow a connection
+    across invocations would be lost. Always False outside Lambda.
+    """
+    return ON_LAMBDA and not isinstance(store or get_store(), DynamoDBStore)
+
+def get_store():
+    """Return the process-wide session store, created on first use"""
+    global _store
+    if _store is None:
+        _store = create_store()
+    return _store
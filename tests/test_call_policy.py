@@ -0,0 +1,109 @@
+import asyncio
+import time
+
+import pytest
+
+import call_policy
+
+@pytest.fixture
+def policy(monkeypatch):
+    """A fresh policy for a "test" stage: no backoff, one failure opens the circuit"""
+    def make(**settings):
+        defaults = {"retries": 0, "retry_base": 0.0, "breaker_failures": 1, "breaker_reset": 0.1}
+        for name, value in {**defaults, **settings}.items():
+            monkeypatch.setenv(f"POLICY_TEST_{name.upper()}", str(value))
+        return call_policy.CallPolicy("test")
+    return make
+
+class Attempts:
+    """attempt(timeout) stand-in that counts calls and plays back outcomes"""
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+
+    def __call__(self, timeout):
+        self.calls += 1
+        outcome = self.outcomes.pop(0) if len(self.outcomes) > 1 else self.outcomes[0]
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return outcome
+
+def test_non_retryable_errors_are_not_retried(policy):
+    attempt = Attempts(ValueError("bad request"))
+    with pytest.raises(ValueError):
+        policy(retries=2, breaker_failures=5).call(attempt)
+    assert attempt.calls == 1
+
+def test_retryable_errors_are_retried(policy):
+    attempt = Attempts(ConnectionError(), ConnectionError(), "ok")
+    assert policy(retries=2, breaker_failures=5).call(attempt) == "ok"
+    assert attempt.calls == 3
+
+def test_circuit_opens_then_closes_after_cooldown(policy):
+    p = policy(breaker_failures=2)
+    failing = Attempts(ConnectionError())
+    for _ in range(2):
+        with pytest.raises(ConnectionError):
+            p.call(failing)
+
+    # Open: fails fast without calling upstream
+    with pytest.raises(call_policy.CircuitOpen):
+        p.call(failing)
+    assert failing.calls == 2
+
+    time.sleep(0.15)
+    healthy = Attempts("ok")
+    assert p.call(healthy) == "ok"
+    # The probe succeeded, so the circuit is closed again
+    assert p.call(healthy) == "ok"
+    assert healthy.calls == 2
+
+def test_failed_probe_reopens_the_circuit(policy):
+    p = policy()
+    with pytest.raises(ConnectionError):
+        p.call(Attempts(ConnectionError()))
+    time.sleep(0.15)
+    with pytest.raises(ConnectionError):
+        p.call(Attempts(ConnectionError()))
+    with pytest.raises(call_policy.CircuitOpen):
+        p.call(Attempts("ok"))
+
+def test_cancelled_probe_is_released(policy):
+    p = policy()
+
+    async def fail(timeout):
+        raise ConnectionError()
+
+    async def hang(timeout):
+        await asyncio.sleep(10)
+
+    async def ok(timeout):
+        return "ok"
+
+    async def scenario():
+        with pytest.raises(ConnectionError):
+            await p.call_async(fail)
+        await asyncio.sleep(0.15)
+        probe = asyncio.ensure_future(p.call_async(hang))
+        await asyncio.sleep(0.01)
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+        # The next call is let through as a new probe instead of failing fast
+        return await p.call_async(ok)
+
+    assert asyncio.run(scenario()) == "ok"
+
+def test_hedge_answers_from_the_second_attempt(policy):
+    p = policy(hedge=1, hedge_delay=0.05, breaker_failures=5)
+    started = []
+
+    async def attempt(timeout):
+        started.append(time.monotonic())
+        if len(started) == 1:
+            await asyncio.sleep(1)
+            return "slow"
+        return "hedge"
+
+    assert asyncio.run(p.call_async(attempt)) == "hedge"
+    assert len(started) == 2
@@ -0,0 +1,38 @@
+import pytest
+
+import grocery_rules
+
+def _items(transcript):
+    items, remainder = grocery_rules.extract(transcript)
+    return [(item.english_name, item.weight, item.quantity) for item in items], remainder
+
+@pytest.mark.parametrize("transcript, items", [
+    ("அரை கிலோ தக்காளி", [("Tomato", "500 grams", None)]),
+    ("2 kg rice", [("Rice", "2 kg", None)]),
+    ("அரை கிலோ ரெண்டு பருப்பு", [("Dal", "500 grams", 2)]),
+    ("arisi 2 kg and paal 1 litre", [("Rice", "2 kg", None), ("Milk", "1 litre", None)]),
+    ("2 kg rice. 1 litre milk", [("Rice", "2 kg", None), ("Milk", "1 litre", None)]),
+])
+def test_simple_utterances_skip_gpt(transcript, items):
+    assert _items(transcript) == (items, "")
+
+@pytest.mark.parametrize("transcript, items", [
+    ("1.5 kg sugar", [("Sugar", "1.5 kg", None)]),
+    ("1.5kg sugar, thakkali", [("Sugar", "1.5 kg", None), ("Tomato", "", None)]),
+    ("one and a half kg rice", [("Rice", "1.5 kg", None)]),
+    ("two and a quarter kg onion", [("Onion", "2.25 kg", None)]),
+])
+def test_amounts_are_not_split(transcript, items):
+    assert _items(transcript) == (items, "")
+
+@pytest.mark.parametrize("transcript", ["rice 0 kg", "0 rice", "arai kilo", "rice and a half"])
+def test_unclear_segments_go_to_gpt(transcript):
+    assert _items(transcript) == ([], transcript)
+
+def test_unparsed_segments_are_returned():
+    assert _items("2 kg rice, konjam poondu") == ([("Rice", "2 kg", None)], "konjam poondu")
+
+def test_parse_weight():
+    assert grocery_rules.parse_weight("அரை கிலோ") == (500.0, "g")
+    assert grocery_rules.parse_weight("one and a half litre") == (1500.0, "ml")
+    assert grocery_rules.parse_weight("0 kg") is None
@@ -0,0 +1,81 @@
+import time
+
+import pytest
+
+import job_queue
+
+@pytest.fixture(params=["memory", "sqlite"])
+def make_queue(request, tmp_path):
+    def make(**settings):
+        if request.param == "sqlite":
+            return job_queue.SqliteQueue(str(tmp_path / "jobs.sqlite3"), **settings)
+        return job_queue.MemoryQueue(**settings)
+    return make
+
+def _bodies(messages):
+    return [m["body"]["chunk"] for m in messages]
+
+def test_group_is_held_while_a_message_is_in_flight(make_queue):
+    queue = make_queue()
+    for chunk in ["a1", "a2"]:
+        queue.send("a", {"chunk": chunk})
+    queue.send("b", {"chunk": "b1"})
+
+    first = queue.receive(max_messages=1)
+    assert _bodies(first) == ["a1"]
+    # a2 waits for a1; other groups aren't held up
+    assert _bodies(queue.receive()) == ["b1"]
+    assert queue.receive() == []
+
+    queue.delete(first[0]["receipt"])
+    assert _bodies(queue.receive()) == ["a2"]
+
+def test_batch_keeps_send_order_within_a_group(make_queue):
+    queue = make_queue()
+    for chunk in ["a1", "b1", "a2", "a3"]:
+        queue.send(chunk[0], {"chunk": chunk})
+    received = queue.receive()
+    assert [m["body"]["chunk"] for m in received if m["group"] == "a"] == ["a1", "a2", "a3"]
+
+def test_unacknowledged_message_is_redelivered_after_timeout(make_queue):
+    queue = make_queue(visibility_timeout=0.05)
+    queue.send("a", {"chunk": "a1"})
+    first = queue.receive()
+    assert queue.receive() == []
+
+    time.sleep(0.1)
+    again = queue.receive()
+    assert _bodies(again) == ["a1"]
+    assert again[0]["receives"] == 2
+    assert again[0]["receipt"] != first[0]["receipt"]
+
+def test_released_message_is_redelivered_at_once(make_queue):
+    queue = make_queue()
+    queue.send("a", {"chunk": "a1"})
+    queue.send("a", {"chunk": "a2"})
+    first = queue.receive(max_messages=1)
+    queue.release(first[0]["receipt"])
+    # Still ahead of a2
+    assert _bodies(queue.receive(max_messages=1)) == ["a1"]
+
+def test_message_is_dropped_after_max_receives(make_queue):
+    queue = make_queue(max_receives=2)
+    queue.send("a", {"chunk": "a1"})
+    queue.send("a", {"chunk": "a2"})
+    for _ in range(2):
+        received = queue.receive(max_messages=1)
+        assert _bodies(received) == ["a1"]
+        queue.release(received[0]["receipt"])
+    assert _bodies(queue.receive(max_messages=1)) == ["a2"]
+
+def test_deleted_message_is_not_redelivered(make_queue):
+    queue = make_queue(visibility_timeout=0)
+    queue.send("a", {"chunk": "a1"})
+    queue.delete(queue.receive()[0]["receipt"])
+    assert queue.receive() == []
+
+def test_message_from_sqs_record():
+    record = {"messageId": "m1", "receiptHandle": "r1", "body": '{"chunk": "a1"}',
+              "attributes": {"MessageGroupId": "conn", "ApproximateReceiveCount": "2"}}
+    assert job_queue.message_from_record(record) == {"id": "m1", "receipt": "r1", "group": "conn",
+                                                     "body": {"chunk": "a1"}, "receives": 2}
@@ -0,0 +1,105 @@
+import pytest
+
+import session_list
+import session_store
+
+TOMATO = {"tamil_name": "தக்காளி", "english_name": "Tomatoes", "weight": "1 kg", "quantity": None}
+RICE = {"tamil_name": "அரிசி", "english_name": "Rice", "weight": "5 kg", "quantity": None}
+MILK = {"tamil_name": "பால்", "english_name": "Milk", "weight": "1 litre", "quantity": None}
+
+@pytest.fixture
+def lists():
+    return session_list.SessionList(session_store.MemoryStore(), log_size=3)
+
+def _ops(delta):
+    return [(op["op"], op["id"]) for op in delta["ops"]]
+
+def test_new_items_are_added():
+    delta = session_list.SessionList(session_store.MemoryStore()).apply("s", [TOMATO, RICE])
+    assert delta["version"] == 1 and delta["base"] == 0
+    assert _ops(delta) == [("add", 1), ("add", 2)]
+
+def test_repeated_mention_changes_nothing(lists):
+    lists.apply("s", [TOMATO])
+    same = {"english_name": "thakkali", "weight": "1000 grams"}
+    assert lists.apply("s", [same]) is None
+
+def test_correction_updates_the_entry(lists):
+    lists.apply("s", [TOMATO])
+    delta = lists.apply("s", [dict(TOMATO, quantity=2)])
+    assert _ops(delta) == [("update", 1)]
+    assert delta["ops"][0]["item"]["quantity"] == 2
+
+def test_different_weight_is_a_new_entry(lists):
+    lists.apply("s", [TOMATO])
+    assert _ops(lists.apply("s", [dict(TOMATO, weight="500 grams")])) == [("add", 2)]
+
+def test_remove(lists):
+    lists.apply("s", [TOMATO])
+    assert _ops(lists.remove("s", 1)) == [("remove", 1)]
+    assert lists.remove("s", 1) is None
+    # Mentioned again after removal: a new entry
+    assert _ops(lists.apply("s", [TOMATO])) == [("add", 2)]
+
+def test_sessions_are_kept_apart(lists):
+    lists.apply("a", [TOMATO])
+    assert _ops(lists.apply("b", [TOMATO])) == [("add", 1)]
+
+def test_sync_at_current_version_is_an_empty_delta(lists):
+    lists.apply("s", [TOMATO])
+    assert lists.sync("s", 1) == {"type": "delta", "version": 1, "base": 1, "ops": []}
+
+def test_sync_sends_compacted_delta_since_version(lists):
+    lists.apply("s", [TOMATO])                      # v1: add 1
+    lists.apply("s", [RICE])                        # v2: add 2
+    lists.apply("s", [dict(RICE, quantity=2)])      # v3: update 2
+    lists.apply("s", [dict(TOMATO, quantity=3)])    # v4: update 1
+    delta = lists.sync("s", 1)
+    assert (delta["type"], delta["version"], delta["base"]) == ("delta", 4, 1)
+    # Rice was added since v1, so its update stays an add with the final item
+    assert _ops(delta) == [("add", 2), ("update", 1)]
+    assert delta["ops"][0]["item"]["quantity"] == 2
+
+def test_sync_drops_entries_added_and_removed_since_version(lists):
+    lists.apply("s", [TOMATO])
+    lists.apply("s", [RICE])
+    lists.remove("s", 2)
+    assert _ops(lists.sync("s", 1)) == []
+
+def test_sync_falls_back_to_full_list_when_log_is_gone(lists):
+    for item in [TOMATO, RICE, MILK, dict(MILK, quantity=2)]:
+        lists.apply("s", [item])
+    # log_size=3 keeps versions 2-4, so a client at v0 needs the whole list
+    full = lists.sync("s", 0)
+    assert full["type"] == "list" and full["version"] == 4
+    assert [(item["id"], item["english_name"]) for item in full["items"]] == [(1, "Tomatoes"), (2, "Rice"), (3, "Milk")]
+    assert lists.sync("s", 1)["type"] == "delta"
+
+@pytest.mark.parametrize("version", [None, 7, -1])
+def test_sync_without_usable_version_sends_full_list(lists, version):
+    lists.apply("s", [TOMATO])
+    full = lists.sync("s", version)
+    assert full["type"] == "list" and [item["id"] for item in full["items"]] == [1]
+
+def test_sync_of_unknown_session_is_empty_list(lists):
+    assert lists.sync("new", None) == {"type": "list", "version": 0, "items": []}
+
+def test_compact_keeps_one_op_per_entry():
+    ops = [{"op": "update", "id": 1, "item": {"quantity": 2}},
+           {"op": "add", "id": 2, "item": {"quantity": 1}},
+           {"op": "update", "id": 1, "item": {"quantity": 3}},
+           {"op": "update", "id": 2, "item": {"quantity": 4}},
+           {"op": "add", "id": 3, "item": {}},
+           {"op": "remove", "id": 3}]
+    assert session_list._compact(ops) == [{"op": "update", "id": 1, "item": {"quantity": 3}},
+                                          {"op": "add", "id": 2, "item": {"quantity": 4}}]
+
+def test_bind_records_the_connection_session(lists):
+    lists.bind("conn", "s")
+    assert lists.session_of("conn") == "s"
+    assert lists.session_of("other") is None
+
+@pytest.mark.parametrize("session_id, valid", [("abc-123_x.y:z", True), ("", False), ("a b", False),
+                                               ("x" * 129, False), (None, False)])
+def test_valid_session_id(session_id, valid):
+    assert session_list.valid_session_id(session_id) is valid
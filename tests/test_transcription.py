@@ -0,0 +1,70 @@
+import asyncio
+
+import pytest
+
+import audio_preprocess
+import transcription
+
+class FakeClient:
+    """Async client whose transcriptions.create plays back one outcome per call"""
+    def __init__(self, *outcomes, delay=0.05):
+        self.outcomes = list(outcomes)
+        self.delay = delay
+        self.calls = 0
+        self.audio = self
+        self.transcriptions = self
+
+    async def create(self, **args):
+        self.calls += 1
+        outcome = self.outcomes.pop(0) if len(self.outcomes) > 1 else self.outcomes[0]
+        await asyncio.sleep(self.delay)
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return outcome
+
+@pytest.fixture(autouse=True)
+def no_cache(monkeypatch):
+    # Every call reaches single-flight instead of an earlier transcript
+    monkeypatch.setattr(transcription, "_cache", None)
+    monkeypatch.setattr(transcription, "_cache_created", True)
+    monkeypatch.setattr(audio_preprocess, "can_decode", lambda audio_data: False)
+    monkeypatch.setattr(audio_preprocess, "preprocess", lambda audio_data, filename: (audio_data, filename))
+
+def test_identical_chunks_share_one_call():
+    client = FakeClient("hello")
+
+    async def scenario():
+        return await asyncio.gather(*(transcription.transcribe_async(client, b"chunk") for _ in range(3)))
+
+    assert asyncio.run(scenario()) == ["hello"] * 3
+    assert client.calls == 1
+
+def test_follower_takes_over_when_leader_is_cancelled():
+    client = FakeClient("hello", delay=0.1)
+
+    async def scenario():
+        leader = asyncio.ensure_future(transcription.transcribe_async(client, b"chunk"))
+        await asyncio.sleep(0.01)
+        followers = [asyncio.ensure_future(transcription.transcribe_async(client, b"chunk")) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await asyncio.gather(*followers)
+
+    assert asyncio.run(scenario()) == ["hello", "hello"]
+    # The cancelled leader's call and one more from the follower that took over
+    assert client.calls == 2
+    assert not transcription._inflight_async
+
+def test_leader_error_reaches_every_follower():
+    client = FakeClient(ValueError("bad audio"))
+
+    async def scenario():
+        return await asyncio.gather(*(transcription.transcribe_async(client, b"chunk") for _ in range(3)),
+                                    return_exceptions=True)
+
+    results = asyncio.run(scenario())
+    assert all(isinstance(r, ValueError) for r in results)
+    assert client.calls == 1
+    assert not transcription._inflight_async
@@ -0,0 +1,98 @@
+import base64
+import zlib
+
+import pytest
+
+import session_store
+import upload_parts
+
+AUDIO = bytes(range(256)) * 4
+
+@pytest.fixture
+def assembler():
+    return upload_parts.PartAssembler(session_store.MemoryStore())
+
+def _parts(audio_data=AUDIO, utterance=7, part_size=300):
+    return [upload_parts.parse_frame(frame) for frame in upload_parts.split(audio_data, utterance, part_size)]
+
+def test_split_frames_round_trip():
+    parts = _parts()
+    assert [p["seq"] for p in parts] == [0, 1, 2, 3]
+    assert {p["total"] for p in parts} == {4}
+    assert b"".join(p["payload"] for p in parts) == AUDIO
+
+def test_out_of_order_parts_assemble_in_seq_order(assembler):
+    parts = _parts()
+    results = [assembler.add("conn", part) for part in reversed(parts)]
+    assert results[:-1] == [None] * 3
+    ready = results[-1]
+    assert ready["total"] == 4 and ready["bytes"] == len(AUDIO)
+    assert assembler.take(ready) == (AUDIO, "audio.webm")
+
+def test_duplicate_parts_are_ignored(assembler):
+    first, second = _parts(part_size=len(AUDIO) // 2 + 1)
+    assert assembler.add("conn", first) is None
+    assert assembler.add("conn", first) is None
+    ready = assembler.add("conn", second)
+    assert ready is not None
+    # A late duplicate doesn't start the utterance again
+    assert assembler.add("conn", second) is None
+    assert assembler.take(ready)[0] == AUDIO
+
+def test_connections_and_utterances_are_kept_apart(assembler):
+    a = _parts(utterance=1)
+    b = _parts(utterance=2)
+    for part in a[:-1] + b[:-1]:
+        assert assembler.add("conn", part) is None
+    assert assembler.add("other", a[-1]) is None
+    assert assembler.add("conn", b[-1]) is not None
+
+def test_checksum_mismatch_is_rejected():
+    frame = bytearray(upload_parts.split(AUDIO, 7, 300)[1])
+    frame[-1] ^= 0xFF
+    with pytest.raises(upload_parts.PartError, match="Checksum mismatch in part 1"):
+        upload_parts.parse_frame(bytes(frame))
+
+@pytest.mark.parametrize("seq, total, error", [
+    (0, 0, "must have 1 to"),
+    (0, upload_parts.UPLOAD_MAX_PARTS + 1, "must have 1 to"),
+    (3, 3, "out of range"),
+])
+def test_seq_and_total_are_validated(seq, total, error):
+    with pytest.raises(upload_parts.PartError, match=error):
+        upload_parts.parse_frame(upload_parts.encode_frame(7, seq, total, b"audio"))
+
+def test_total_must_match_the_first_part(assembler):
+    assembler.add("conn", upload_parts.parse_frame(upload_parts.encode_frame(7, 0, 3, b"a")))
+    with pytest.raises(upload_parts.PartError, match="started with 3 parts"):
+        assembler.add("conn", upload_parts.parse_frame(upload_parts.encode_frame(7, 1, 2, b"b")))
+
+def test_utterance_size_is_limited():
+    assembler = upload_parts.PartAssembler(session_store.MemoryStore(), max_bytes=500)
+    parts = _parts()
+    assembler.add("conn", parts[0])
+    with pytest.raises(upload_parts.PartError, match="larger than 500 bytes"):
+        assembler.add("conn", parts[1])
+
+def test_expired_part_is_reported(assembler):
+    parts = _parts()
+    for part in parts[:-1]:
+        assembler.add("conn", part)
+    ready = assembler.add("conn", parts[-1])
+    assembler.store.delete(f"{ready['key']}:2")
+    with pytest.raises(upload_parts.PartError, match="Part 2 expired"):
+        assembler.take(ready)
+
+def test_json_part():
+    message = {"type": "part", "utterance": 7, "seq": 0, "total": 1, "crc32": zlib.crc32(AUDIO),
+               "data": base64.b64encode(AUDIO).decode("ascii")}
+    assert upload_parts.parse_json_part(message) == {"utterance": 7, "seq": 0, "total": 1, "payload": AUDIO}
+
+@pytest.mark.parametrize("message", [
+    {"utterance": 7, "seq": 0, "total": 1, "data": ""},
+    {"utterance": 7, "seq": "first", "total": 1, "crc32": 0, "data": ""},
+    {"utterance": 7, "seq": 0, "total": 1, "crc32": 0, "data": "not base64!"},
+])
+def test_malformed_json_part_is_rejected(message):
+    with pytest.raises(upload_parts.PartError, match="Malformed part"):
+        upload_parts.parse_json_part(message)
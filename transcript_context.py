@@ -0,0 +1,127 @@
+import asyncio
+import os
+from collections import deque
+
+# Rolling transcript context for streaming sessions. Each chunk is transcribed
+# with the tail of the session's earlier transcript as the Whisper prompt
+# (spelling and language carry over), and extracted with that tail as context
+# so a phrase cut at a chunk boundary ("அரை கிலோ" | "தக்காளி") is read whole
+# while only items in the new text are returned.
+#
+# Off by default (TRANSCRIPT_CONTEXT=1 turns it on): each chunk's
+# transcription waits for the previous one, which gives up most of the
+# concurrency between a session's chunks, and the accuracy gain has yet to be
+# shown by benchmarks/context_eval.py against recorded responses.
+#
+# RollingContext is the per-connection state for the FastAPI WebSocket, where
+# chunks are processed concurrently: each submitted chunk takes a slot in
+# arrival order and waits (boundedly) for the transcript of the one before.
+# StoreContext keeps the tail in the session store for Lambda.
+
+TRANSCRIPT_CONTEXT = os.getenv("TRANSCRIPT_CONTEXT", "0") == "1"
+# Characters of earlier transcript passed along (Whisper only reads the last
+# 224 tokens of its prompt anyway)
+TRANSCRIPT_CONTEXT_CHARS = int(os.getenv("TRANSCRIPT_CONTEXT_CHARS", "300"))
+# Seconds a chunk waits for the previous chunk's transcript
+TRANSCRIPT_CONTEXT_WAIT = float(os.getenv("TRANSCRIPT_CONTEXT_WAIT", "2"))
+# Seconds a Lambda connection's context is kept after its last chunk
+TRANSCRIPT_CONTEXT_TTL = float(os.getenv("TRANSCRIPT_CONTEXT_TTL", "300"))
+
+def append(tail, transcript, max_chars=None):
+    """tail followed by transcript, cut from the left at a word boundary to max_chars"""
+    max_chars = TRANSCRIPT_CONTEXT_CHARS if max_chars is None else max_chars
+    text = " ".join(part for part in (tail.strip(), transcript.strip()) if part)
+    if len(text) <= max_chars:
+        return text
+    text = text[-max_chars:]
+    space = text.find(" ")
+    return text[space + 1:] if 0 <= space < len(text) - 1 else text
+
+class ContextSlot:
+    """One chunk's place in a RollingContext"""
+
+    def __init__(self, rolling, previous):
+        self.rolling = rolling
+        self.previous = previous
+        self.transcript = None
+        self.event = asyncio.Event()
+        # The tail as it was when this chunk was folded into it
+        self.settled = None
+
+    async def context(self):
+        """Context once the previous chunk is transcribed, or after TRANSCRIPT_CONTEXT_WAIT"""
+        if self.previous is not None and not self.previous.event.is_set():
+            try:
+                await asyncio.wait_for(self.previous.event.wait(), self.rolling.wait)
+            except asyncio.TimeoutError:
+                pass
+        return self.rolling.before(self)
+
+    def done(self, transcript):
+        """Record the chunk's transcript; later calls are ignored"""
+        if self.transcript is None:
+            self.transcript = transcript or ""
+            self.event.set()
+            self.rolling.settle()
+
+class RollingContext:
+    def __init__(self, max_chars=None, wait=None):
+        self.max_chars = TRANSCRIPT_CONTEXT_CHARS if max_chars is None else max_chars
+        self.wait = TRANSCRIPT_CONTEXT_WAIT if wait is None else wait
+        # Transcripts of settled chunks, folded together and trimmed
+        self.tail = ""
+        # Slots from the oldest unfinished chunk on
+        self.slots = deque()
+
+    def slot(self):
+        """Take the next slot; call in the order chunks are submitted"""
+        slot = ContextSlot(self, self.slots[-1] if self.slots else None)
+        self.slots.append(slot)
+        return slot
+
+    def settle(self):
+        # Fold finished chunks at the head into the tail so only chunks
+        # still in flight are held
+        while self.slots and self.slots[0].transcript is not None:
+            slot = self.slots.popleft()
+            slot.settled = self.tail
+            self.tail = append(self.tail, slot.transcript, self.max_chars)
+            slot.previous = None
+        if self.slots:
+            self.slots[0].previous = None
+
+    def before(self, slot):
+        """Tail plus finished transcripts of the chunks ahead of slot"""
+        if slot.settled is not None:
+            return slot.settled
+        text = self.tail
+        for other in self.slots:
+            if other is slot:
+                break
+            if other.transcript:
+                text = append(text, other.transcript, self.max_chars)
+        return text
+
+class StoreContext:
+    """Rolling context of Lambda connections, kept in the session store"""
+
+    def __init__(self, store, ttl=None, max_chars=None):
+        self.store = store
+        self.ttl = TRANSCRIPT_CONTEXT_TTL if ttl is None else ttl
+        self.max_chars = TRANSCRIPT_CONTEXT_CHARS if max_chars is None else max_chars
+
+    @staticmethod
+    def _key(connection_id):
+        return f"transcript-context:{connection_id}"
+
+    def get(self, connection_id):
+        return self.store.get(self._key(connection_id)) or ""
+
+    def clear(self, connection_id):
+        self.store.delete(self._key(connection_id))
+
+    def add(self, connection_id, transcript):
+        if not transcript.strip():
+            return
+        self.store.update(self._key(connection_id),
+                          lambda tail: (append(tail or "", transcript, self.max_chars), None), ttl=self.ttl)
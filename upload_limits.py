@@ -0,0 +1,51 @@
+import os
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+
+# Request body limits for upload routes. Starlette already streams multipart
+# file parts into a SpooledTemporaryFile, so memory per request stays bounded;
+# this middleware adds the upper limit on total size.
+
+# Whisper rejects files over 25 MB, so there's no point accepting more
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(25 * 1024 * 1024)))
+
+def _too_large_detail(max_bytes):
+    return f"Upload too large, limit is {max_bytes} bytes"
+
+class UploadSizeLimitMiddleware:
+    """Reject oversize POST bodies on the given paths with a 413"""
+
+    def __init__(self, app, paths, max_bytes=None):
+        self.app = app
+        self.paths = tuple(paths)
+        self.max_bytes = max_bytes or UPLOAD_MAX_BYTES
+
+    async def __call__(self, scope, receive, send):
+        if (scope["type"] != "http" or scope["method"] != "POST"
+                or not scope["path"].rstrip("/").endswith(self.paths)):
+            await self.app(scope, receive, send)
+            return
+
+        # Honest clients tell us the size up front, so reject before reading anything
+        headers = dict(scope.get("headers") or [])
+        content_length = headers.get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > self.max_bytes:
+            response = JSONResponse(status_code=413, content={"detail": _too_large_detail(self.max_bytes)})
+            await response(scope, receive, send)
+            return
+
+        # Chunked or lying clients are cut off as soon as they cross the limit.
+        # FastAPI re-raises HTTPException from body parsing, so this surfaces as a 413.
+        received = 0
+        max_bytes = self.max_bytes
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > max_bytes:
+                    raise HTTPException(status_code=413, detail=_too_large_detail(max_bytes))
+            return message
+
+        await self.app(scope, limited_receive, send)
@@ -0,0 +1,121 @@
+import base64
+import os
+import struct
+import zlib
+from audio_utils import sniff_format
+
+# Chunked utterance uploads for the Lambda WebSocket route. A client splits one
+# complete recording into parts that fit API Gateway's frame limit and sends
+# each part as a binary frame:
+#
+#   "GQP1" | utterance u32 | seq u16 | total u16 | crc32 u32 | payload
+#
+# (16-byte big-endian header; seq counts from 0, crc32 is of this part's
+# payload). Text-only clients can send the same fields as JSON instead:
+#   {"type": "part", "utterance": 7, "seq": 0, "total": 3, "crc32": ..., "data": "<base64>"}
+#
+# Parts are kept in the session store, one key per part plus a small marker
+# that records which have arrived, so parts may land on different containers
+# and no store item holds more than one part. The recording is handed on only
+# once every part is in; duplicates (API Gateway or client retries) are
+# ignored, and parts of an unfinished utterance expire with UPLOAD_PARTS_TTL.
+
+FRAME_MAGIC = b"GQP1"
+_HEADER = struct.Struct(">4sIHHI")
+HEADER_SIZE = _HEADER.size
+
+UPLOAD_MAX_PARTS = int(os.getenv("UPLOAD_MAX_PARTS", "512"))
+# Whisper's own limit on one file
+UTTERANCE_MAX_BYTES = int(os.getenv("UTTERANCE_MAX_BYTES", str(25 * 1024 * 1024)))
+# Seconds an unfinished utterance's parts are kept
+UPLOAD_PARTS_TTL = float(os.getenv("UPLOAD_PARTS_TTL", "300"))
+
+class PartError(ValueError):
+    """A part that can't be accepted; the message is safe to show the client"""
+
+def is_frame(data):
+    return len(data) >= HEADER_SIZE and data[:4] == FRAME_MAGIC
+
+def encode_frame(utterance, seq, total, payload):
+    return _HEADER.pack(FRAME_MAGIC, utterance, seq, total, zlib.crc32(payload)) + payload
+
+def split(audio_data, utterance, part_size):
+    """Binary frames for one recording, part_size payload bytes each"""
+    total = max(1, -(-len(audio_data) // part_size))
+    return [encode_frame(utterance, seq, total, audio_data[seq * part_size:(seq + 1) * part_size])
+            for seq in range(total)]
+
+def _part(utterance, seq, total, crc, payload):
+    if not 0 < total <= UPLOAD_MAX_PARTS:
+        raise PartError(f"Utterance must have 1 to {UPLOAD_MAX_PARTS} parts")
+    if not 0 <= seq < total:
+        raise PartError(f"Part {seq} out of range for {total} parts")
+    if zlib.crc32(payload) != crc:
+        raise PartError(f"Checksum mismatch in part {seq}")
+    return {"utterance": utterance, "seq": seq, "total": total, "payload": payload}
+
+def parse_frame(data):
+    _, utterance, seq, total, crc = _HEADER.unpack_from(data)
+    return _part(utterance, seq, total, crc, bytes(data[HEADER_SIZE:]))
+
+def parse_json_part(message):
+    try:
+        utterance, seq, total, crc = (int(message[key]) for key in ("utterance", "seq", "total", "crc32"))
+        payload = base64.b64decode(message.get("data", ""), validate=True)
+    except (KeyError, TypeError, ValueError) as e:
+        raise PartError(f"Malformed part: {str(e)}")
+    return _part(utterance, seq, total, crc, payload)
+
+class PartAssembler:
+    """
+    Collects parts in a session store. add() returns a reference to a
+    complete utterance, which take() turns into (audio bytes, filename).
+    """
+
+    def __init__(self, store, ttl=None, max_bytes=None):
+        self.store = store
+        self.ttl = UPLOAD_PARTS_TTL if ttl is None else ttl
+        self.max_bytes = UTTERANCE_MAX_BYTES if max_bytes is None else max_bytes
+
+    @staticmethod
+    def _key(connection_id, utterance):
+        return f"upload-parts:{connection_id}:{utterance}"
+
+    def add(self, connection_id, part):
+        """Store a part; returns {"key", "total", "bytes"} once all parts are in, else None"""
+        key = self._key(connection_id, part["utterance"])
+        seq, total, size = part["seq"], part["total"], len(part["payload"])
+        # The part is stored before the marker counts it, so whoever sees the
+        # marker complete can read every part
+        self.store.put(f"{key}:{seq}", base64.b64encode(part["payload"]).decode("ascii"), ttl=self.ttl)
+
+        def mark(state):
+            state = state or {"total": total, "seqs": [], "bytes": 0}
+            if state.get("done") or seq in state["seqs"]:
+                return state, None
+            if state["total"] != total:
+                raise PartError(f"Utterance {part['utterance']} was started with {state['total']} parts")
+            if state["bytes"] + size > self.max_bytes:
+                raise PartError(f"Utterance larger than {self.max_bytes} bytes")
+            state["seqs"].append(seq)
+            state["bytes"] += size
+            if len(state["seqs"]) < total:
+                return state, None
+            # Kept (without the part list) so late duplicates don't start it again
+            return {"total": total, "done": True}, {"key": key, "total": total, "bytes": state["bytes"]}
+
+        # A rejected part is left to expire with the rest
+        return self.store.update(key, mark, ttl=self.ttl)
+
+    def take(self, ready):
+        """Read and remove the parts of a complete utterance"""
+        parts = []
+        for seq in range(ready["total"]):
+            encoded = self.store.get(f"{ready['key']}:{seq}")
+            if encoded is None:
+                raise PartError(f"Part {seq} expired before the utterance was processed")
+            parts.append(base64.b64decode(encoded))
+        for seq in range(ready["total"]):
+            self.store.delete(f"{ready['key']}:{seq}")
+        audio_data = b"".join(parts)
+        return audio_data, f"audio.{sniff_format(audio_data) or 'webm'}"